@@ -0,0 +1,221 @@
+#!/usr/bin/python
+import collections
+import concurrent.futures
+import functools
+import importlib
+import json
+import math
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+RESOLUTIONS = [40, 100, 200, 400]
+PARTS = ['shell', 'skirt', 'top-mold', 'bottom-mold', 'back-clip', 'lens', 'lens-clip', 'lens-cnc', 'lens-cnc-astigmatism']
+STAGES = ['profiles', 'extrude', 'mesh', 'scad', 'openscad', 'other']
+
+# a stage is a regression when it gets slower by more than THRESHOLD,
+# and by more than MIN_DELTA seconds to ignore the noise on short ones
+THRESHOLD = 0.2
+MIN_DELTA = 0.05
+
+
+class _Stages:
+    # exclusive time spent in each stage: a profile built while
+    # extruding counts as profile construction only
+    def __init__(self):
+        self.times = collections.Counter()
+        self.vertices = 0
+        self.triangles = 0
+        self._stack = []
+
+    def wrap(self, name, f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            self._stack.append(0.0)
+            start = time.perf_counter()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                self.times[name] += elapsed - self._stack.pop()
+                if self._stack:
+                    self._stack[-1] += elapsed
+        return wrapper
+
+    def patch(self, owner, attribute, name):
+        setattr(owner, attribute, self.wrap(name, getattr(owner, attribute)))
+
+
+def _openscad(openscad, name):
+    # time and peak memory of the STL conversion
+    start = time.perf_counter()
+    with open(os.devnull, 'wb') as null:
+        process = subprocess.Popen([openscad, '-o', name + '.stl', name + '.scad'], stdout=null, stderr=null)
+    _, status, rusage = os.wait4(process.pid, 0)
+    if os.waitstatus_to_exitcode(status) != 0:
+        raise Exception('%s failed on %s.scad' % (openscad, name))
+    return time.perf_counter() - start, rusage.ru_maxrss * 1024
+
+
+def _run(part, nsteps, openscad):
+    # runs in a fresh process: nothing is cached from a previous run
+    # and the peak memory is the one of this part only
+    import constants
+    import ggg
+    import ggg.scad
+    import solid
+    import goggles
+    import parts
+    import utils
+    parts._lens_cnc()
+    # imported on first use otherwise, which would count as a stage
+    import scipy.interpolate
+    import scipy.spatial
+
+    constants.CACHE = False
+    constants.NSTEPS = nsteps
+    stages = _Stages()
+    for f in ['shell_profiles', '_skirt_profiles', '_skirt_mold_shapes', 'top_attachment_profile', 'bottom_attachment_profile']:
+        stages.patch(goggles, f, 'profiles')
+    # ggg.extrude is the function, not the module
+    stages.patch(importlib.import_module('ggg.extrude').Extrude, 'along_path', 'extrude')
+    stages.patch(ggg.shapes.Shapes, 'mesh', 'mesh')
+    solidify = ggg.mesh.Mesh.solidify
+
+    def counted(mesh):
+        o = solidify(mesh)
+        stages.vertices += len(o.ggg_mesh.points)
+        stages.triangles += len(o.ggg_mesh.triangles)
+        return o
+    ggg.mesh.Mesh.solidify = stages.wrap('mesh', counted)
+    stages.patch(ggg.scad, 'write', 'scad')
+
+    name = part.replace('-', '_')
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        start = time.perf_counter()
+        o = stages.wrap('other', parts.PARTS[part])()
+        utils.render(o, name)
+        wall = time.perf_counter() - start
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        scad_size = os.path.getsize(name + '.scad')
+        openscad_rss = None
+        if openscad is not None:
+            stages.times['openscad'], openscad_rss = _openscad(openscad, name)
+            wall += stages.times['openscad']
+    return {
+        'part': part,
+        'nsteps': nsteps,
+        'wall': wall,
+        'stages': {stage: stages.times.get(stage, 0.0) for stage in STAGES if stage != 'openscad' or openscad is not None},
+        'rss': rss,
+        'openscad_rss': openscad_rss,
+        'vertices': stages.vertices,
+        'triangles': stages.triangles,
+        'scad_size': scad_size,
+    }
+
+
+def _isolated(part, nsteps, openscad):
+    # spawn rather than fork: the peak memory must not include ours
+    context = multiprocessing.get_context('spawn')
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(_run, part, nsteps, openscad).result()
+
+
+def _best(results):
+    # the fastest of the repeats: the others were slowed down by noise
+    best = min(results, key=lambda result: result['wall'])
+    best = dict(best, stages=dict(best['stages']))
+    for stage in best['stages']:
+        best['stages'][stage] = min(result['stages'][stage] for result in results)
+    best['rss'] = max(result['rss'] for result in results)
+    return best
+
+
+def run(args):
+    openscad = args.openscad if args.openscad and os.path.exists(args.openscad) else None
+    if args.openscad and openscad is None:
+        print('%s not found: skipping the STL step' % args.openscad, file=sys.stderr)
+    results = []
+    for nsteps in args.resolutions:
+        for part in args.parts:
+            result = _best([_isolated(part, nsteps, openscad) for i in range(args.repeat)])
+            print('%-22s -r %-4d %7.2fs %7.1fMB %8d triangles  %s' % (
+                part, nsteps, result['wall'], result['rss'] / (1024 * 1024), result['triangles'],
+                ' '.join('%s=%.2f' % (stage, t) for stage, t in result['stages'].items())), flush=True)
+            results.append(result)
+    output = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(output, f, indent=1)
+
+
+def regressions(baseline, current, threshold=THRESHOLD, min_delta=MIN_DELTA):
+    # (part, nsteps, what, before, after) for every measurement which
+    # got worse than the baseline
+    before = {(result['part'], result['nsteps']): result for result in baseline['results']}
+    retval = []
+    for result in current['results']:
+        reference = before.get((result['part'], result['nsteps']))
+        if reference is None:
+            continue
+        timings = [('wall', reference['wall'], result['wall'])]
+        timings += [(stage, reference['stages'][stage], t) for stage, t in result['stages'].items() if stage in reference['stages']]
+        for what, a, b in timings:
+            if b > a * (1 + threshold) and b - a > min_delta:
+                retval.append((result['part'], result['nsteps'], what, a, b))
+        if result['rss'] > reference['rss'] * (1 + threshold):
+            retval.append((result['part'], result['nsteps'], 'rss', reference['rss'], result['rss']))
+        for what in ['vertices', 'triangles']:
+            if result[what] > reference[what] * (1 + threshold):
+                retval.append((result['part'], result['nsteps'], what, reference[what], result[what]))
+    return retval
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    found = regressions(baseline, current, threshold=args.threshold)
+    for part, nsteps, what, a, b in found:
+        print('%-22s -r %-4d %-10s %12.3f -> %12.3f (%+.0f%%)' % (part, nsteps, what, a, b, 100 * (b - a) / a if a else math.inf))
+    print('%d regressions' % len(found))
+    if found:
+        sys.exit(1)
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Time each stage of the generation of every part')
+    commands = parser.add_subparsers(dest='command', required=True)
+    parser_run = commands.add_parser('run', help='run the benchmarks')
+    parser_run.add_argument('-r', '--resolutions', default=RESOLUTIONS, type=int, nargs='+')
+    parser_run.add_argument('--parts', default=PARTS, nargs='+', choices=PARTS)
+    parser_run.add_argument('--repeat', default=1, type=int, help='keep the fastest of this many runs')
+    parser_run.add_argument('--openscad', default='/usr/bin/openscad', help='also time the STL conversion with this OpenSCAD, if it exists (empty to skip)')
+    parser_run.add_argument('-o', '--output', default='bench.json')
+    parser_compare = commands.add_parser('compare', help='report the regressions against a baseline')
+    parser_compare.add_argument('baseline')
+    parser_compare.add_argument('current', nargs='?', default='bench.json')
+    parser_compare.add_argument('--threshold', default=THRESHOLD, type=float, help='relative slowdown to report (default: %(default)s)')
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args)
+    else:
+        compare(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,519 @@
+import contextvars
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import sys
+import tempfile
+import types
+
+import constants
+import settings
+
+# bump to invalidate every entry when the layout or the keys change
+VERSION = 2
+DIRECTORY = '.cache'
+MAX_SIZE = 2 * 1024 * 1024 * 1024
+# how many different sets of dependencies are remembered for each part
+MAX_VARIANTS = 8
+# constants which do not change the outputs
+IGNORED_CONSTANTS = {'JOBS', 'CACHE', 'CACHE_FUNCTIONS'}
+
+_ROOT = os.path.dirname(os.path.abspath(__file__))
+_IGNORED_FILES = {os.path.abspath(__file__), os.path.abspath(constants.__file__)}
+
+
+class Dependencies:
+    def __init__(self):
+        self.constants = set()
+        self.functions = set()
+
+    def update(self, other):
+        self.constants |= other.constants
+        self.functions |= other.functions
+
+
+# the recordings of the current thread or asyncio task, innermost last
+_stack = contextvars.ContextVar('recordings', default=())
+
+
+def _trace(frame, event, arg):
+    # only called for python function calls: no line tracing
+    code = frame.f_code
+    _stack.get()[-1].functions.add((code.co_filename, code.co_qualname))
+
+
+def _loaded():
+    # every file loaded, as a whole: _functions() keeps the ones of this
+    # repository
+    return set((module.__file__, '*') for module in list(sys.modules.values()) if getattr(module, '__file__', None))
+
+
+def recording():
+    return len(_stack.get()) > 0
+
+
+class record:
+    # Collect the constants.* attributes read and the python functions
+    # called until the end of the with block. Recordings can be nested:
+    # the outer recording sees everything the inner ones saw.
+    # Tracing the functions (constants.CACHE_FUNCTIONS) slows the build
+    # down by about 40%: every python call goes through the tracer.
+    # Without it, a build depends on all the code of the repository
+    # files loaded when it ran, constants.py aside.
+    def __enter__(self):
+        self.dependencies = Dependencies()
+        # nested recordings trace the functions when the outer one does
+        self._functions = sys.gettrace() is _trace if _stack.get() else constants.CACHE_FUNCTIONS
+        self._tokens = _stack.set(_stack.get() + (self.dependencies,)), settings.reads.set(self.dependencies.constants)
+        if self._functions and len(_stack.get()) == 1:
+            sys.settrace(_trace)
+        return self.dependencies
+
+    def __exit__(self, *exc):
+        stack, reads = self._tokens
+        settings.reads.reset(reads)
+        _stack.reset(stack)
+        if not self._functions:
+            self.dependencies.functions |= _loaded()
+        if _stack.get():
+            _stack.get()[-1].update(self.dependencies)
+        elif self._functions:
+            sys.settrace(None)
+        return False
+
+
+def reset():
+    # forked processes inherit the recordings of their parent
+    _stack.set(())
+    settings.reads.set(None)
+    sys.settrace(None)
+
+
+def replay(dependencies):
+    # dependencies of a result computed earlier and reused now
+    if _stack.get():
+        _stack.get()[-1].update(dependencies)
+
+
+def _hash(text):
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def _constant(value):
+    if isinstance(value, frozenset):
+        return 'frozenset(%s)' % sorted(repr(v) for v in value)
+    return repr(value)
+
+
+def _update(h, code, nested):
+    # the bytecode ignores comments, formatting and line numbers
+    h.update(code.co_code)
+    h.update(repr((code.co_names, code.co_varnames, code.co_freevars, code.co_cellvars)).encode())
+    for value in code.co_consts:
+        if isinstance(value, types.CodeType):
+            if nested:
+                _update(h, value, nested)
+            else:
+                h.update(value.co_qualname.encode())
+        else:
+            h.update(_constant(value).encode())
+
+
+def _is_function(code):
+    return code.co_flags & inspect.CO_OPTIMIZED
+
+
+_sources = {}
+
+
+def _source(filename):
+    # hashes of the top-level functions and methods of a file, plus the
+    # rest of the file (imports, globals, class attributes) as '' and
+    # the whole file as '*'.
+    if filename not in _sources:
+        with open(filename) as f:
+            module = compile(f.read(), filename, 'exec')
+        hashes = {}
+        prelude = hashlib.sha256()
+        pending = [module]
+        while pending:
+            code = pending.pop(0)
+            if _is_function(code) and not code.co_qualname.startswith('<'):
+                h = hashlib.sha256()
+                _update(h, code, True)
+                hashes[code.co_qualname] = h.hexdigest()
+                continue
+            _update(prelude, code, False)
+            pending.extend(value for value in code.co_consts if isinstance(value, types.CodeType))
+        hashes[''] = prelude.hexdigest()
+        hashes['*'] = _hash(json.dumps(sorted(hashes.items())))
+        _sources[filename] = hashes
+    return _sources[filename]
+
+
+_PACKAGES = ['solidpython', 'numpy', 'scipy', 'shapely', 'manifold3d']
+_versions = None
+
+
+def _packages():
+    global _versions
+    if _versions is None:
+        import importlib.metadata
+        _versions = []
+        for package in _PACKAGES:
+            try:
+                _versions.append((package, importlib.metadata.version(package)))
+            except importlib.metadata.PackageNotFoundError:
+                pass
+    return _versions
+
+
+def _functions(dependencies):
+    # (file relative to the repository, top-level qualified name) of the
+    # functions of this repository: nested functions, lambdas and
+    # comprehensions belong to their enclosing function, and '*' covers
+    # all the functions of a file. constants.py does not count: the
+    # constants are keyed by the values read.
+    functions = set()
+    for filename, qualname in dependencies.functions:
+        filename = os.path.abspath(filename)
+        if not filename.startswith(_ROOT + os.sep) or not os.path.exists(filename) or filename in _IGNORED_FILES:
+            continue
+        qualname = qualname.split('.<locals>')[0]
+        qualname = '' if qualname.startswith('<') else qualname
+        functions.add((os.path.relpath(filename, _ROOT), qualname))
+    files = set(filename for filename, qualname in functions if qualname == '*')
+    return set((filename, qualname) for filename, qualname in functions if filename not in files or qualname == '*')
+
+
+def manifest(dependencies):
+    return {
+        'constants': sorted(dependencies.constants - IGNORED_CONSTANTS),
+        'functions': [list(function) for function in sorted(_functions(dependencies))],
+    }
+
+
+def fingerprint(name, extra, manifest):
+    # None if a function the part used does not exist anymore
+    functions = []
+    for filename, qualname in manifest['functions']:
+        hashes = _source(os.path.join(_ROOT, filename))
+        if qualname not in hashes:
+            return None
+        functions.append((filename, qualname, hashes[qualname], hashes['']))
+    values = [(k, repr(getattr(constants, k, None))) for k in manifest['constants']]
+    return _hash(json.dumps([VERSION, name, extra, values, functions, _packages()]))
+
+
+def _directory(*path):
+    return os.path.join(DIRECTORY, *path)
+
+
+def _variants(name):
+    try:
+        with open(_directory('parts', name + '.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+
+def _save_variants(name, variants):
+    os.makedirs(_directory('parts'), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=_directory('parts'))
+    with os.fdopen(fd, 'w') as f:
+        json.dump(variants[:MAX_VARIANTS], f)
+    os.replace(tmp, _directory('parts', name + '.json'))
+
+
+def get(key, outputs):
+    # copy the outputs stored under key to the current directory, with
+    # the files the build added to them
+    entry = _directory('objects', key)
+    if not all(os.path.exists(os.path.join(entry, output)) for output in outputs):
+        return False
+    for output in os.listdir(entry):
+        shutil.copyfile(os.path.join(entry, output), output)
+    # eviction removes the least recently used entries first
+    os.utime(entry)
+    return True
+
+
+def put(key, outputs):
+    os.makedirs(_directory('objects'), exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=_directory('objects'))
+    for output in outputs:
+        shutil.copyfile(output, os.path.join(tmp, output))
+    try:
+        os.rename(tmp, _directory('objects', key))
+    except OSError:
+        # another process stored the same entry
+        shutil.rmtree(tmp, ignore_errors=True)
+    evict()
+
+
+def _size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+
+
+def evict(max_size=None):
+    max_size = MAX_SIZE if max_size is None else max_size
+    entries = []
+    for parent in ['objects', 'files']:
+        try:
+            names = os.listdir(_directory(parent))
+        except OSError:
+            continue
+        for name in names:
+            path = _directory(parent, name)
+            try:
+                entries.append((os.path.getmtime(path), _size(path), path))
+            except OSError:
+                pass
+    total = sum(size for mtime, size, path in entries)
+    for mtime, size, path in sorted(entries):
+        if total <= max_size:
+            break
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+        total -= size
+
+
+def build(name, extra, outputs, f):
+    # Run f(), which writes outputs and returns the names of the other
+    # files it wrote, if any, unless a previous run with the same code
+    # and the same values for the constants read by that run has stored
+    # them already. Returns True when the outputs were reused.
+    if not constants.CACHE:
+        f()
+        return False
+    for variant in _variants(name):
+        key = fingerprint(name, extra, variant)
+        if key is not None and get(key, outputs):
+            return True
+    with record() as dependencies:
+        written = f() or []
+    variant = manifest(dependencies)
+    put(fingerprint(name, extra, variant), outputs + written)
+    variants = _variants(name)
+    if variant in variants:
+        variants.remove(variant)
+    _save_variants(name, [variant] + variants)
+    return False
+
+
+def get_file(text, suffix, output):
+    # content-addressed files: the key is the text they were generated from
+    if not constants.CACHE:
+        return False
+    path = _directory('files', _hash(text) + suffix)
+    if not os.path.exists(path):
+        return False
+    shutil.copyfile(path, output)
+    os.utime(path)
+    return True
+
+
+def put_file(text, suffix, filename):
+    if not constants.CACHE:
+        return
+    os.makedirs(_directory('files'), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=_directory('files'), suffix=suffix)
+    os.close(fd)
+    shutil.copyfile(filename, tmp)
+    os.replace(tmp, _directory('files', _hash(text) + suffix))
+    evict()
+
+import unittest
+
+
+_MODULE = '''import constants
+
+
+def f(x):
+    # %s
+    return x + %d
+
+
+def g(x):
+    return x * %d
+'''
+
+
+class _TestCase(unittest.TestCase):
+    # a repository of one module, part.py, with its cache in a
+    # temporary directory
+    def setUp(self):
+        global _ROOT, DIRECTORY
+        self._saved = _ROOT, DIRECTORY, os.getcwd()
+        self._tmp = tempfile.TemporaryDirectory()
+        _ROOT = os.path.realpath(self._tmp.name)
+        DIRECTORY = os.path.join(_ROOT, '.cache')
+        os.chdir(_ROOT)
+        self._write()
+
+    def tearDown(self):
+        global _ROOT, DIRECTORY
+        _ROOT, DIRECTORY, cwd = self._saved
+        os.chdir(cwd)
+        sys.modules.pop('_buildcache_part', None)
+        _sources.clear()
+        self._tmp.cleanup()
+
+    def _write(self, comment='', f=1, g=2):
+        with open(os.path.join(_ROOT, 'part.py'), 'w') as out:
+            out.write(_MODULE % (comment, f, g))
+        _sources.clear()
+
+    def _module(self):
+        import importlib.util
+        spec = importlib.util.spec_from_file_location('_buildcache_part', os.path.join(_ROOT, 'part.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        # loaded, as far as the build cache can tell
+        sys.modules[spec.name] = module
+        return module
+
+
+class FingerprintTestCase(_TestCase):
+    def _key(self, qualname='f'):
+        return fingerprint('part', [], {'constants': ['NSTEPS'], 'functions': [['part.py', qualname]]})
+
+    def test_function(self):
+        key = self._key()
+        self._write(comment='comments and other functions do not count', g=3)
+        self.assertEqual(self._key(), key)
+        self._write(f=2)
+        self.assertNotEqual(self._key(), key)
+
+    def test_file(self):
+        key = self._key('*')
+        self._write(comment='comments do not count')
+        self.assertEqual(self._key('*'), key)
+        self._write(g=3)
+        self.assertNotEqual(self._key('*'), key)
+
+    def test_constants(self):
+        key = self._key()
+        with settings.use(settings.Config(nsteps=constants.NSTEPS+1)):
+            self.assertNotEqual(self._key(), key)
+        self.assertEqual(self._key(), key)
+
+    def test_removed(self):
+        self.assertIsNone(self._key('h'))
+
+
+class BuildTestCase(_TestCase):
+    def _build(self, module, calls):
+        def f():
+            calls.append(None)
+            with open('out.txt', 'w') as out:
+                out.write('%d %d' % (module.f(constants.NSTEPS), constants.CHORD_ERROR or 0))
+        return build('part', [], ['out.txt'], f)
+
+    def _check(self, track, changed, unchanged):
+        module = self._module()
+        calls = []
+        config = settings.Config(cache_functions=track)
+        with settings.use(config):
+            self.assertFalse(self._build(module, calls))
+            self.assertTrue(self._build(module, calls))
+        # a constant the build read
+        with settings.use(config._replace(nsteps=constants.NSTEPS+1)):
+            self.assertFalse(self._build(module, calls))
+        with settings.use(config):
+            self.assertTrue(self._build(module, calls))
+            self._write(**unchanged)
+            self.assertTrue(self._build(module, calls))
+            self._write(**changed)
+            self.assertFalse(self._build(module, calls))
+        self.assertEqual(len(calls), 3)
+        with open('out.txt') as f:
+            self.assertEqual(f.read(), '%d 0' % (constants.NSTEPS+1))
+
+    def test_files(self):
+        self._check(False, {'g': 3}, {'comment': 'comments do not count'})
+
+    def test_functions(self):
+        self._check(True, {'f': 2}, {'g': 3})
+
+    def test_disabled(self):
+        calls = []
+        with settings.use(settings.Config(cache=False)):
+            self.assertFalse(self._build(self._module(), calls))
+            self.assertFalse(self._build(self._module(), calls))
+        self.assertEqual(len(calls), 2)
+        self.assertFalse(os.path.exists(DIRECTORY))
+
+    def test_threads(self):
+        # recordings in different threads see their own reads only
+        import threading
+        barrier = threading.Barrier(2)
+        seen = {}
+
+        def run(name, functions):
+            with settings.use(settings.Config(cache_functions=functions)):
+                with record() as dependencies:
+                    barrier.wait()
+                    getattr(constants, name)
+                    barrier.wait()
+            seen[name] = dependencies
+
+        threads = [threading.Thread(target=run, args=args) for args in [('NSTEPS', True), ('CHORD_ERROR', False)]]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(seen['NSTEPS'].constants, {'NSTEPS'})
+        self.assertEqual(seen['CHORD_ERROR'].constants, {'CHORD_ERROR'})
+        # only the first thread traced the calls
+        self.assertIn((threading.__file__, 'Barrier.wait'), seen['NSTEPS'].functions)
+        self.assertEqual(set(qualname for filename, qualname in seen['CHORD_ERROR'].functions), {'*'})
+        self.assertFalse(recording())
+
+
+class ManifestTestCase(unittest.TestCase):
+    def test_constants(self):
+        # the values of the constants count, not the code of constants.py
+        dependencies = Dependencies()
+        dependencies.constants.add('NSTEPS')
+        dependencies.functions |= set((module.__file__, '*') for module in [constants, settings, sys.modules[__name__]])
+        self.assertEqual(manifest(dependencies), {'constants': ['NSTEPS'], 'functions': [['settings.py', '*']]})
+
+
+class EvictTestCase(_TestCase):
+    def _entry(self, parent, name, size, age):
+        path = os.path.join(DIRECTORY, parent, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if parent == 'objects':
+            os.makedirs(path)
+            for i in range(2):
+                with open(os.path.join(path, str(i)), 'wb') as f:
+                    f.write(b'x' * (size // 2))
+        else:
+            with open(path, 'wb') as f:
+                f.write(b'x' * size)
+        t = 1e9 - age
+        os.utime(path, (t, t))
+
+    def _left(self):
+        return sorted(os.listdir(os.path.join(DIRECTORY, 'objects')) + os.listdir(os.path.join(DIRECTORY, 'files')))
+
+    def test_evict(self):
+        # the least recently used entries go first, objects and files alike
+        for name, parent, size, age in [('a', 'objects', 100, 4), ('b.stl', 'files', 100, 3), ('c', 'objects', 100, 2), ('d.stl', 'files', 100, 1)]:
+            self._entry(parent, name, size, age)
+        evict(400)
+        self.assertEqual(self._left(), ['a', 'b.stl', 'c', 'd.stl'])
+        evict(250)
+        self.assertEqual(self._left(), ['c', 'd.stl'])
+        evict(0)
+        self.assertEqual(self._left(), [])
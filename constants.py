@@ -1,6 +1,39 @@
 # the resolution of the resulting model. Use the command-line
 # to override this value
 NSTEPS = 40
+# the number of processes used to build the profiles of the sweeps.
+# Use the command-line to override this value
+JOBS = 1
+# when set, the maximum distance in mm between the sampled surfaces and
+# the exact ones: NSTEPS is ignored and the sweep stations and profile
+# vertices are placed where the curvature needs them.
+# Use the command-line to override this value
+CHORD_ERROR = None
+# when set, the number of exact profiles computed for the shell and
+# skirt sweeps: the others are interpolated from them, with more exact
+# profiles added until the interpolation is within KEYFRAME_ERROR mm
+# halfway between them (about twice that elsewhere).
+# Use the command-line to override this value
+KEYFRAMES = None
+KEYFRAME_ERROR = 0.02
+# the digits written after the decimal point of the polyhedron points in
+# the .scad files and, when SCAD_SIDECAR is set, write the polyhedra to
+# binary STL files imported by the .scad files instead.
+# Use the command-line to override these values
+SCAD_PRECISION = 10
+SCAD_SIDECAR = False
+# simplify the CSG trees (see ggg.optimize) before writing or evaluating them.
+# Use the command-line to override this value
+OPTIMIZE_CSG = True
+# check that every mesh is closed and consistently oriented before writing it.
+# Use the command-line to override this value
+VALIDATE = False
+# reuse and store the parts in the build cache (see buildcache.py) and,
+# when CACHE_FUNCTIONS is set, rebuild them when the functions they call
+# change rather than when any file they load changes.
+# Use the command-line to override these values
+CACHE = True
+CACHE_FUNCTIONS = False
 # Some kind of scale-invariant length used a bit everywhere to define 
 # other dimensions. Do not change this value. Instead, change the other
 # variables
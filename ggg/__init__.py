@@ -1,4 +1,7 @@
 from .mesh import Mesh
 from .shapes import Shapes
 from .extrude import extrude
+from .bbox import BoundingBox, bounds
 from .point import Point2, Point3
+from .csg import optimize
+from .primitives import cylinder, sphere, capsule, rounded_box, ring, hull
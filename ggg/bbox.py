@@ -0,0 +1,111 @@
+import collections
+
+import numpy as np
+
+from .scad import matrix, radius, vector
+
+__all__ = ['BoundingBox', 'bounds']
+
+BoundingBox = collections.namedtuple('BoundingBox', ['xmin', 'xmax', 'ymin', 'ymax', 'zmin', 'zmax'])
+
+
+def from_points(points):
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    if len(points) == 0:
+        return None
+    lower = points.min(axis=0).tolist()
+    upper = points.max(axis=0).tolist()
+    return BoundingBox(xmin=lower[0], xmax=upper[0], ymin=lower[1], ymax=upper[1], zmin=lower[2], zmax=upper[2])
+
+
+def corners(bb):
+    return np.array([(x, y, z) for x in (bb.xmin, bb.xmax) for y in (bb.ymin, bb.ymax) for z in (bb.zmin, bb.zmax)])
+
+
+def transform(bb, m):
+    # box of the 8 transformed corners: exact for the translations,
+    # mirrors and scalings, conservative for rotations
+    if bb is None:
+        return None
+    m = np.asarray(m, dtype=np.float64)
+    return from_points(corners(bb) @ m[:3, :3].T + m[:3, 3])
+
+
+def union(boxes):
+    boxes = [bb for bb in boxes if bb is not None]
+    if not boxes:
+        return None
+    return BoundingBox(
+        xmin=min(bb.xmin for bb in boxes), xmax=max(bb.xmax for bb in boxes),
+        ymin=min(bb.ymin for bb in boxes), ymax=max(bb.ymax for bb in boxes),
+        zmin=min(bb.zmin for bb in boxes), zmax=max(bb.zmax for bb in boxes),
+    )
+
+
+def intersection(boxes):
+    if any(bb is None for bb in boxes) or not boxes:
+        return None
+    bb = BoundingBox(
+        xmin=max(bb.xmin for bb in boxes), xmax=min(bb.xmax for bb in boxes),
+        ymin=max(bb.ymin for bb in boxes), ymax=min(bb.ymax for bb in boxes),
+        zmin=max(bb.zmin for bb in boxes), zmax=min(bb.zmax for bb in boxes),
+    )
+    if bb.xmin > bb.xmax or bb.ymin > bb.ymax or bb.zmin > bb.zmax:
+        return None
+    return bb
+
+
+def _primitive(obj):
+    name = obj.name
+    params = obj.params
+    if name == 'cube':
+        size = vector(params.get('size', 1), default=1)
+        if min(size) <= 0:
+            return None
+        lower = [-s/2 for s in size] if params.get('center') else [0, 0, 0]
+        return BoundingBox(xmin=lower[0], xmax=lower[0]+size[0], ymin=lower[1], ymax=lower[1]+size[1], zmin=lower[2], zmax=lower[2]+size[2])
+    if name == 'cylinder':
+        r = radius(params, 'r', 'd')
+        r = 1 if r is None else r
+        r1 = radius(params, 'r1', 'd1')
+        r2 = radius(params, 'r2', 'd2')
+        r = max(r if r1 is None else r1, r if r2 is None else r2)
+        h = 1 if params.get('h') is None else params['h']
+        if h <= 0 or r <= 0:
+            return None
+        z = -h/2 if params.get('center') else 0
+        return BoundingBox(xmin=-r, xmax=r, ymin=-r, ymax=r, zmin=z, zmax=z+h)
+    if name == 'sphere':
+        r = radius(params, 'r', 'd')
+        r = 1 if r is None else r
+        if r <= 0:
+            return None
+        return BoundingBox(xmin=-r, xmax=r, ymin=-r, ymax=r, zmin=-r, zmax=r)
+    if name == 'polyhedron':
+        mesh = getattr(obj, 'ggg_mesh', None)
+        if mesh is not None:
+            return mesh.bounds
+        return from_points(params['points'])
+    raise NotImplementedError('No bounding box for OpenSCAD %s()' % name)
+
+
+def bounds(obj):
+    # Axis-aligned box of a mesh, a sweep or a solidpython tree. None
+    # stands for an empty object. Boxes of transformed and combined
+    # objects are derived from the boxes of their children.
+    if hasattr(obj, 'bounds'):
+        return obj.bounds
+    if getattr(obj, 'modifier', '') == '*':
+        return None
+    if not obj.children:
+        return _primitive(obj)
+    children = [bounds(child) for child in obj.children]
+    name = obj.name
+    if name == 'difference':
+        return children[0]
+    if name == 'intersection':
+        return intersection(children)
+    m = matrix(obj)
+    if m is not None:
+        return transform(union(children), m)
+    return union(children)
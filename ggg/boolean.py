@@ -0,0 +1,208 @@
+import numpy as np
+
+from .mesh import Mesh
+from .scad import fragments, matrix, radius, vector
+
+__all__ = ['available', 'union', 'difference', 'intersection', 'evaluate']
+
+def available():
+    try:
+        import manifold3d  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _manifold(mesh):
+    import manifold3d
+    triangles = mesh._all_triangles()
+    m = manifold3d.Mesh64(
+        # a copy: the points of the meshes made by _mesh() are read-only
+        # views, which manifold3d refuses
+        vert_properties=np.array(mesh.points, dtype=np.float64),
+        # manifold wants counter-clockwise faces, ggg uses the
+        # OpenSCAD convention
+        tri_verts=np.ascontiguousarray(triangles[:, ::-1], dtype=np.uint64),
+    )
+    # weld the vertices duplicated along the seams of the sweeps
+    m.merge()
+    o = manifold3d.Manifold(m)
+    if o.status() != manifold3d.Error.NoError:
+        raise Exception('Mesh is not a closed oriented manifold (%s)' % o.status())
+    return o
+
+
+def _mesh(manifold):
+    m = manifold.to_mesh64()
+    points = np.asarray(m.vert_properties, dtype=np.float64)[:, :3]
+    triangles = np.asarray(m.tri_verts, dtype=np.int64)[:, ::-1]
+    return Mesh(points, triangles)
+
+
+def _batch(meshes, op):
+    return _mesh(_combine([_manifold(mesh) for mesh in meshes], op))
+
+
+def union(*meshes):
+    import manifold3d
+    return _batch(meshes, manifold3d.OpType.Add)
+
+
+def difference(mesh, *others):
+    import manifold3d
+    return _batch((mesh,) + others, manifold3d.OpType.Subtract)
+
+
+def intersection(*meshes):
+    import manifold3d
+    return _batch(meshes, manifold3d.OpType.Intersect)
+
+
+def _cube(params):
+    import manifold3d
+    size = vector(params.get('size', 1), default=1)
+    if min(size) <= 0:
+        return manifold3d.Manifold()
+    return manifold3d.Manifold.cube(size, bool(params.get('center')))
+
+
+def _cylinder(params):
+    import manifold3d
+    r = radius(params, 'r', 'd')
+    r1 = radius(params, 'r1', 'd1')
+    r2 = radius(params, 'r2', 'd2')
+    r = 1 if r is None else r
+    r1 = r if r1 is None else r1
+    r2 = r if r2 is None else r2
+    h = 1 if params.get('h') is None else params['h']
+    if h <= 0 or (r1 <= 0 and r2 <= 0):
+        return manifold3d.Manifold()
+    n = fragments(max(r1, r2), params.get('segments'))
+    return manifold3d.Manifold.cylinder(h, r1, r2, n, bool(params.get('center')))
+
+
+def _sphere(params):
+    import manifold3d
+    r = radius(params, 'r', 'd')
+    r = 1 if r is None else r
+    if r <= 0:
+        return manifold3d.Manifold()
+    # the rings of OpenSCAD, not the subdivided octahedron of manifold3d
+    from .primitives import sphere
+    return _manifold(sphere(r, segments=fragments(r, params.get('segments'))))
+
+
+def _polyhedron(obj):
+    mesh = getattr(obj, 'ggg_mesh', None)
+    if mesh is None:
+        faces = obj.params['faces']
+        triangles = [face for face in faces if len(face) == 3]
+        polygons = [face for face in faces if len(face) != 3]
+        mesh = Mesh(obj.params['points'], triangles, polygons)
+    return _manifold(mesh)
+
+
+def _combine(manifolds, op):
+    import manifold3d
+    if not manifolds:
+        return manifold3d.Manifold()
+    return manifold3d.Manifold.batch_boolean(manifolds, op)
+
+
+def _evaluate(obj):
+    import manifold3d
+    if getattr(obj, 'modifier', '') == '*':
+        return manifold3d.Manifold()
+    name = obj.name
+    params = obj.params
+    if name == 'polyhedron':
+        return _polyhedron(obj)
+    if name == 'cube':
+        return _cube(params)
+    if name == 'cylinder':
+        return _cylinder(params)
+    if name == 'sphere':
+        return _sphere(params)
+
+    children = [_evaluate(child) for child in obj.children]
+    if name == 'difference':
+        return _combine(children, manifold3d.OpType.Subtract)
+    if name == 'intersection':
+        return _combine(children, manifold3d.OpType.Intersect)
+    if name == 'hull':
+        return manifold3d.Manifold.batch_hull(children)
+
+    o = _combine(children, manifold3d.OpType.Add)
+    if name in ('union', 'color', 'render'):
+        return o
+    m = matrix(obj)
+    if m is not None:
+        return o.transform(m[:3, :4])
+    raise NotImplementedError('No in-process evaluation for OpenSCAD %s()' % name)
+
+
+def evaluate(obj):
+    return _mesh(_evaluate(obj))
+
+
+import math
+import unittest
+
+
+def _volume(mesh):
+    # clockwise seen from the outside, like OpenSCAD
+    v = mesh.points[mesh._all_triangles()[:, ::-1]]
+    return np.sum(v[:, 0] * np.cross(v[:, 1], v[:, 2])) / 6
+
+
+def _prism(r, h, n):
+    # the volume of a cylinder of n segments
+    return n / 2 * r * r * math.sin(2 * math.pi / n) * h
+
+
+@unittest.skipUnless(available(), 'needs manifold3d')
+class BooleanTestCase(unittest.TestCase):
+    def _check(self, mesh, volume):
+        # closed, consistently oriented, and the expected volume
+        self.assertEqual(mesh.validate(), [])
+        self.assertAlmostEqual(_volume(mesh), volume, places=9)
+
+    def _cylinder(self, r, h, **kwargs):
+        from .primitives import cylinder
+        return cylinder(h, r, segments=16, **kwargs)
+
+    def test_union(self):
+        a = self._cylinder(1, 2)
+        b = self._cylinder(1, 3).translate([5, 0, 0])
+        self._check(union(a, b), _prism(1, 2, 16) + _prism(1, 3, 16))
+        self._check(union(a, a.translate([0, 0, 1])), _prism(1, 3, 16))
+
+    def test_difference(self):
+        tube = difference(self._cylinder(2, 2), self._cylinder(1, 4, center=True))
+        self._check(tube, _prism(2, 2, 16) - _prism(1, 2, 16))
+        self._check(intersection(self._cylinder(2, 2), self._cylinder(1, 4, center=True)), _prism(1, 2, 16))
+
+    def test_evaluate(self):
+        # the CSG tree gives what the meshes give
+        import solid
+        a = self._cylinder(2, 2)
+        b = self._cylinder(1, 4, center=True)
+        tree = solid.union()(
+            solid.difference()(a.solidify(), solid.translate([0.5, 0, 0])(b.solidify())),
+            solid.translate([0, 0, 3])(solid.cube([1, 2, 3])),
+        )
+        expected = union(difference(a, b.translate([0.5, 0, 0])), Mesh([(0, 0, 0), (1, 0, 0), (1, 2, 0), (0, 2, 0), (0, 0, 3), (1, 0, 3), (1, 2, 3), (0, 2, 3)], [], [[0, 1, 2, 3], [4, 7, 6, 5], [0, 4, 5, 1], [1, 5, 6, 2], [2, 6, 7, 3], [3, 7, 4, 0]]).translate([0, 0, 3]))
+        self._check(evaluate(tree), _volume(expected))
+        self._check(expected, _volume(expected))
+
+    def test_primitives(self):
+        import solid
+        o = solid.cube(2, center=True) - solid.cylinder(r=0.5, h=4, center=True, segments=16)
+        self._check(evaluate(o), 8 - _prism(0.5, 2, 16))
+        o = solid.translate([3, 0, 0])(solid.scale([1, 1, 2])(solid.cube(1))) + solid.mirror([1, 0, 0])(solid.cube(1))
+        self._check(evaluate(o), 3)
+        # OpenSCAD's spheres: 6 rings of 12 vertices
+        from .primitives import sphere
+        o = evaluate(solid.sphere(1, segments=12))
+        self.assertEqual(len(o.points), 72)
+        self._check(o, _volume(sphere(1, segments=12)))
@@ -0,0 +1,315 @@
+import numpy as np
+from solid.solidpython import OpenSCADObject
+
+from . import bbox
+from .scad import matrix
+
+__all__ = ['optimize']
+
+_TRANSFORMS = ['translate', 'rotate', 'mirror', 'scale', 'multmatrix']
+# nodes which only wrap their children
+_WRAPPERS = ['color', 'render']
+# the faces of a shrunk cutter stay this far (mm) from the box of the
+# object it cuts, to avoid creating coplanar faces
+MARGIN = 1.0
+# the box of a subtree which ggg.bbox cannot tell
+_UNKNOWN = object()
+
+
+def _is_plain(node, name):
+    return node.name == name and not node.params and not node.modifier
+
+
+def _new(name, params, children, boxes, box):
+    o = OpenSCADObject(name, params)
+    o.add(list(children))
+    boxes[id(o)] = box
+    return o
+
+
+def _union_box(boxes):
+    if any(box is _UNKNOWN for box in boxes):
+        return _UNKNOWN
+    return bbox.union(boxes)
+
+
+def _transform_box(box, m):
+    return _UNKNOWN if box is _UNKNOWN else bbox.transform(box, m)
+
+
+def _leaf(obj, boxes):
+    # None if obj is empty
+    if obj.modifier == '*':
+        return None
+    if obj.modifier or (obj.children and obj.name != 'hull'):
+        box = _UNKNOWN
+    else:
+        try:
+            box = bbox.bounds(obj)
+        except NotImplementedError:
+            box = _UNKNOWN
+    if box is None:
+        return None
+    boxes[id(obj)] = box
+    return obj
+
+
+def _children(obj, boxes):
+    children = [_optimize(child, boxes) for child in obj.children]
+    return [child for child in children if child is not None]
+
+
+def _union(children, boxes):
+    flat = []
+    for child in children:
+        flat.extend(child.children if _is_plain(child, 'union') else [child])
+    if len(flat) <= 1:
+        return flat[0] if flat else None
+    return _new('union', {}, flat, boxes, _union_box([boxes[id(child)] for child in flat]))
+
+
+def _cube(node):
+    # (transformation, cube) if node is a transformed cube
+    m = np.eye(4)
+    while node.name in _TRANSFORMS and len(node.children) == 1 and not node.modifier:
+        m = m @ matrix(node)
+        node = node.children[0]
+    if node.name != 'cube' or node.modifier:
+        return None
+    return m, node
+
+
+def _overlaps(box, other):
+    return box is _UNKNOWN or other is _UNKNOWN or bbox.intersection([box, other]) is not None
+
+
+def _shrink(cutter, box, boxes):
+    # the part of cutter which can reach box, None if there is none: the
+    # cubes are clipped in their own frame, the first operand of a
+    # difference is shrunk with them
+    if _is_plain(cutter, 'difference'):
+        first = _shrink(cutter.children[0], box, boxes)
+        if first is None:
+            return None
+        if first is cutter.children[0]:
+            return cutter
+        return _cut(first, cutter.children[1:], boxes)
+    found = _cube(cutter)
+    if found is None:
+        return cutter
+    m, cube = found
+    try:
+        inverse = np.linalg.inv(m)
+    except np.linalg.LinAlgError:
+        return cutter
+    local = bbox.bounds(cube)
+    limit = bbox.transform(bbox.BoundingBox(
+        xmin=box.xmin-MARGIN, xmax=box.xmax+MARGIN,
+        ymin=box.ymin-MARGIN, ymax=box.ymax+MARGIN,
+        zmin=box.zmin-MARGIN, zmax=box.zmax+MARGIN,
+    ), inverse)
+    clipped = bbox.intersection([local, limit])
+    if clipped is None:
+        return None
+    if clipped == local:
+        return cutter
+    cube = _new('cube', {'size': [clipped.xmax-clipped.xmin, clipped.ymax-clipped.ymin, clipped.zmax-clipped.zmin]}, [], boxes, None)
+    box = bbox.transform(clipped, m)
+    offset = np.eye(4)
+    offset[:3, 3] = [clipped.xmin, clipped.ymin, clipped.zmin]
+    m = m @ offset
+    if np.array_equal(m[:3, :3], np.eye(3)):
+        return _new('translate', {'v': m[:3, 3].tolist()}, [cube], boxes, box)
+    return _new('multmatrix', {'m': m.tolist()}, [cube], boxes, box)
+
+
+def _cut(target, cutters, boxes):
+    # the difference of target and cutters without the cutters which
+    # cannot reach it
+    box = boxes[id(target)]
+    if box is not _UNKNOWN:
+        cutters = [cutter for cutter in cutters if _overlaps(box, boxes[id(cutter)])]
+        cutters = [_shrink(cutter, box, boxes) if boxes[id(cutter)] is not _UNKNOWN else cutter for cutter in cutters]
+        cutters = [cutter for cutter in cutters if cutter is not None]
+    if not cutters:
+        return target
+    return _new('difference', {}, [target] + cutters, boxes, box)
+
+
+def _difference(obj, boxes):
+    target = _optimize(obj.children[0], boxes)
+    if target is None:
+        return None
+    cutters = []
+    if _is_plain(target, 'difference'):
+        target, cutters = target.children[0], target.children[1:]
+    for child in obj.children[1:]:
+        cutter = _optimize(child, boxes)
+        if cutter is not None:
+            cutters.extend(cutter.children if _is_plain(cutter, 'union') else [cutter])
+    return _cut(target, cutters, boxes)
+
+
+def _intersection(obj, boxes):
+    children = [_optimize(child, boxes) for child in obj.children]
+    if any(child is None for child in children):
+        return None
+    flat = []
+    for child in children:
+        flat.extend(child.children if _is_plain(child, 'intersection') else [child])
+    if len(flat) == 1:
+        return flat[0]
+    children_boxes = [boxes[id(child)] for child in flat]
+    box = _UNKNOWN if any(b is _UNKNOWN for b in children_boxes) else bbox.intersection(children_boxes)
+    if box is None:
+        return None
+    return _new('intersection', {}, flat, boxes, box)
+
+
+def _transform(obj, boxes):
+    child = _union(_children(obj, boxes), boxes)
+    if child is None:
+        return None
+    m = matrix(obj)
+    if np.array_equal(m, np.eye(4)):
+        return child
+    if child.name not in _TRANSFORMS or child.modifier:
+        return _new(obj.name, obj.params, [child], boxes, _transform_box(boxes[id(child)], m))
+    # chained transformations: a single matrix, without the rounding
+    # errors of the rotations by multiples of 90 degrees
+    m = m @ matrix(child)
+    m[:3, :3][np.abs(m[:3, :3]) < 1e-12] = 0
+    grandchildren = child.children
+    box = _transform_box(_union_box([boxes[id(c)] for c in grandchildren]), m)
+    return _new('multmatrix', {'m': m.tolist()}, grandchildren, boxes, box)
+
+
+def _optimize(obj, boxes):
+    # the optimized copy of obj, None if it is empty. The leaves are
+    # shared with obj and boxes[id(node)] is the box of each node.
+    name = obj.name
+    if obj.modifier or name not in ['union', 'difference', 'intersection'] + _TRANSFORMS + _WRAPPERS:
+        return _leaf(obj, boxes)
+    if name == 'union':
+        return _union(_children(obj, boxes), boxes)
+    if name == 'difference':
+        return _difference(obj, boxes) if obj.children else None
+    if name == 'intersection':
+        return _intersection(obj, boxes) if obj.children else None
+    if name in _TRANSFORMS:
+        return _transform(obj, boxes)
+    children = _children(obj, boxes)
+    if not children:
+        return None
+    return _new(name, obj.params, children, boxes, _union_box([boxes[id(child)] for child in children]))
+
+
+def _has_holes(obj):
+    return obj.is_hole or obj.is_part_root or any(_has_holes(child) for child in obj.children)
+
+
+def optimize(obj):
+    # A copy of the solidpython tree obj with the same geometry and less
+    # work for the CSG engine: nested unions, differences and
+    # intersections are flattened, chains of transformations become a
+    # single multmatrix, empty objects and the cutters which do not reach
+    # what they cut are dropped, and the axis-aligned cube cutters are
+    # shrunk to the box of what they cut. The leaves are shared with obj.
+    # Trees which use SolidPython's holes are returned as they are.
+    if _has_holes(obj):
+        return obj
+    o = _optimize(obj, {})
+    if o is None:
+        return OpenSCADObject('union', {})
+    return o
+
+import unittest
+
+import solid
+
+from . import boolean
+
+
+def _volume(obj):
+    mesh = boolean.evaluate(obj)
+    # clockwise seen from the outside, like OpenSCAD
+    v = mesh.points[mesh.triangles[:, ::-1]]
+    return np.sum(v[:, 0] * np.cross(v[:, 1], v[:, 2])) / 6
+
+
+def _walk(obj):
+    yield obj
+    for child in obj.children:
+        yield from _walk(child)
+
+
+def _names(obj):
+    return [node.name for node in _walk(obj)]
+
+
+def _cubes(obj):
+    return [node.params['size'] for node in _walk(obj) if node.name == 'cube']
+
+
+@unittest.skipUnless(boolean.available(), 'needs manifold3d')
+class OptimizeTestCase(unittest.TestCase):
+    def _check(self, obj):
+        # the optimized tree has the same volume, and is not larger
+        o = optimize(obj)
+        self.assertAlmostEqual(_volume(o), _volume(obj), places=6)
+        self.assertLessEqual(len(_names(o)), len(_names(obj)))
+        return o
+
+    def _target(self):
+        return solid.translate([-5, -5, -5])(solid.cube([10, 10, 10])) + solid.sphere(6, segments=16)
+
+    def test_rotated(self):
+        # a large cube turned around two axes is shrunk in its own frame
+        cutter = solid.rotate([0, 20, 30])(solid.translate([2, -100, -100])(solid.cube([200, 200, 200])))
+        o = self._check(self._target() - cutter)
+        self.assertEqual([child.name for child in o.children], ['union', 'multmatrix'])
+        self.assertLess(max(_cubes(o.children[1])[0]), 200)
+
+    def test_mirrored(self):
+        cutter = solid.mirror([1, 0, 0])(solid.translate([-3, -100, -100])(solid.cube([200, 200, 200])))
+        o = self._check(self._target() - solid.rotate([0, 0, 90])(cutter))
+        self.assertEqual([child.name for child in o.children], ['union', 'multmatrix'])
+        np.testing.assert_allclose(_cubes(o.children[1]), [[10, 14, 14]])
+
+    def test_empty(self):
+        # empty operands are dropped, empty results too
+        empty = solid.cube([0, 0, 0])
+        target = self._target()
+        o = self._check(solid.union()(target, empty) - empty)
+        self.assertEqual(_names(o), _names(optimize(target)))
+        o = self._check(solid.difference()(empty, target) + target)
+        self.assertEqual(_names(o), _names(optimize(target)))
+        self.assertEqual(_names(optimize(solid.difference()(empty, target))), ['union'])
+        far = solid.translate([50, 0, 0])(target)
+        self.assertEqual(_names(optimize(solid.intersection()(target, far))), ['union'])
+
+    def test_nested(self):
+        # differences of differences are flattened, a cutter which is a
+        # difference is shrunk through its first operand, and cuts the
+        # cutters of that operand in turn
+        target = self._target()
+        hole = solid.translate([0, 0, -50])(solid.cylinder(r=2, h=100, segments=12))
+        slab = solid.translate([-100, -100, 3])(solid.cube([200, 200, 200])) - solid.translate([-1, -1, -200])(solid.cube([2, 2, 400]))
+        o = self._check((target - hole) - slab)
+        self.assertEqual([child.name for child in o.children], ['union', 'translate', 'difference'])
+        np.testing.assert_allclose(_cubes(o.children[2]), [[14, 14, 4], [2, 2, 6]])
+
+    def test_disjoint(self):
+        # cutters which do not reach the target are dropped
+        target = self._target()
+        far = solid.translate([50, 0, 0])(solid.cube([5, 5, 5]))
+        o = self._check(target - far - solid.rotate([0, 0, 45])(solid.translate([0, 30, 0])(solid.sphere(3))))
+        self.assertEqual(_names(o), _names(optimize(target)))
+        o = self._check(target - far - solid.translate([4, 4, 4])(solid.cube([5, 5, 5])))
+        self.assertEqual([child.name for child in o.children], ['union', 'translate'])
+
+    def test_transforms(self):
+        # chained transformations of a cutter become one matrix
+        cutter = solid.translate([3, 0, 0])(solid.rotate([0, 0, 90])(solid.scale([1, 2, 1])(solid.cube([4, 4, 20], center=True))))
+        o = self._check(self._target() - cutter)
+        self.assertEqual([child.name for child in o.children], ['union', 'multmatrix'])
@@ -1,18 +1,44 @@
-import euclid3
 import math
 
-from .point import Point3
+import numpy as np
+
 from .shapes import Shapes
 
 __all__ = ['extrude']
 
 
+def _as_array(points, dimension):
+    if isinstance(points, np.ndarray):
+        return np.asarray(points, dtype=np.float64)[:, :dimension]
+    if hasattr(points, 'array'):
+        return np.asarray(points.array, dtype=np.float64)[:, :dimension]
+    if dimension == 2:
+        return np.array([(p.x, p.y) for p in points], dtype=np.float64).reshape(-1, 2)
+    return np.array([(p.x, p.y, p.z) for p in points], dtype=np.float64).reshape(-1, 3)
+
+
+def _normalized(v):
+    # same as euclid3.Vector3.normalized(): zero vectors are left alone
+    d = np.sqrt(v[:, 0]**2 + v[:, 1]**2 + v[:, 2]**2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(d[:, np.newaxis] != 0, v / d[:, np.newaxis], v)
+
+
+def _cross(a, b):
+    # same operation order as euclid3.Vector3.cross()
+    return np.column_stack((
+        a[:, 1] * b[:, 2] - a[:, 2] * b[:, 1],
+        -a[:, 0] * b[:, 2] + a[:, 2] * b[:, 0],
+        a[:, 0] * b[:, 1] - a[:, 1] * b[:, 0],
+    ))
+
+
 class Extrude:
     def __init__(self, shape):
         self._shape = shape
 
     def _angle_tangents(self, angles):
-        return [Point3(math.cos(math.pi/2-alpha), math.sin(math.pi/2-alpha), 0) for alpha in angles]
+        return np.array([(math.cos(math.pi/2-alpha), math.sin(math.pi/2-alpha), 0) for alpha in angles], dtype=np.float64)
 
     def _rotation_tangents(self, n):
         angles = [i * 2 * math.pi / n for i in range(n)]
@@ -23,84 +49,91 @@ class Extrude:
         return self._angle_tangents(angles)
 
     def _open_path_tangents(self, path):
-        first = Point3(*(path[0] - (path[1] - path[0])))
-        last = Point3(*(path[-1] - (path[-2] - path[-1])))
-        tmp = [first] + path + [last]
-        tangents = [tmp[i+2] - tmp[i] for i in range(len(tmp)-2)]
-        return tangents
+        first = path[0] - (path[1] - path[0])
+        last = path[-1] - (path[-2] - path[-1])
+        tmp = np.concatenate(([first], path, [last]))
+        return tmp[2:] - tmp[:-2]
 
     def _closed_path_tangents(self, path):
-        tmp = [path[-1]] + path + [path[0]]
-        tangents = [tmp[i+2] - tmp[i] for i in range(len(tmp)-2)]
-        return tangents
+        tmp = np.concatenate((path[-1:], path, path[:1]))
+        return tmp[2:] - tmp[:-2]
 
-    def _transform_matrix(self, dest, dest_normal):
+    def _transform_matrices(self, dest, dest_normal):
         # https://stackoverflow.com/questions/25027045
-        origin = euclid3.Vector3(0, 0, 0)
-        y_axis = euclid3.Vector3(0, 1, 0)
-        z_axis = euclid3.Vector3(0, 0, 1)
-        if dest_normal.cross(z_axis) == origin:
-            up = y_axis
-        else:
-            up = z_axis
+        # One (N, 4, 4) stack of the frames euclid3 would build for each
+        # (dest, dest_normal) pair, using the same operation order so
+        # that the result is bit for bit identical.
+        n = len(dest)
+        degenerate = (dest_normal[:, 0] == 0) & (dest_normal[:, 1] == 0)
+        up = np.zeros((n, 3))
+        up[:, 1] = degenerate
+        up[:, 2] = ~degenerate
         eye = dest
         at = dest + dest_normal
-        z = (eye - at).normalized()
-        x = up.cross(z).normalized()
-        x = x.normalized()
-        y = z.cross(x)
-
-        m = euclid3.Matrix4.new_rotate_triple_axis(x, y, z)
-        m.d, m.h, m.l = eye.x, eye.y, eye.z
+        z = _normalized(eye - at)
+        x = _normalized(_cross(up, z))
+        x = _normalized(x)
+        y = _cross(z, x)
+
+        m = np.zeros((n, 4, 4))
+        m[:, :3, 0] = x
+        m[:, :3, 1] = y
+        m[:, :3, 2] = z
+        m[:, :3, 3] = eye
+        m[:, 3, 3] = 1
         return m
 
     def _transform_shapes(self, path, tangents, shapes):
-        for path_point, tangent, shape in zip(path, tangents, shapes):
-            matrix = self._transform_matrix(path_point, tangent)
-            transformed = [matrix * point for point in shape]
-            yield transformed
+        m = self._transform_matrices(path, tangents)[:, np.newaxis, :3, :]
+        x = shapes[..., 0, np.newaxis]
+        y = shapes[..., 1, np.newaxis]
+        z = np.zeros_like(x)
+        # an explicit a*x + b*y + c*z + d keeps the summation order of
+        # euclid3.Matrix4 * euclid3.Point3
+        return m[..., 0] * x + m[..., 1] * y + m[..., 2] * z + m[..., 3]
 
     def _shapes(self, n):
         if callable(self._shape):
             shapes = [self._shape(i, n) for i in range(n)]
-        elif isinstance(self._shape, list):
-            if isinstance(self._shape[0], list):
-                if len(self._shape) != n:
-                    raise Exception('There should be as many shapes (%s) as path length (%s)' % (len(self._shape), n))
-                shapes = self._shape
-            else:
-                shapes = [self._shape for i in range(n)]
+        elif isinstance(self._shape, np.ndarray) and self._shape.ndim == 3:
+            shapes = self._shape
+        elif isinstance(self._shape, list) and not hasattr(self._shape[0], 'x'):
+            shapes = self._shape
         else:
-            assert False
-        shapes = [[Point3(x=p.x, y=p.y, z=0) for p in shape] for shape in shapes]
-        return shapes
+            return np.broadcast_to(_as_array(self._shape, 2), (n, len(self._shape), 2))
+        if len(shapes) != n:
+            raise Exception('There should be as many shapes (%s) as path length (%s)' % (len(shapes), n))
+        return np.stack([_as_array(shape, 2) for shape in shapes])
 
     def along_closed_path(self, path):
+        path = _as_array(path, 3)
         tangents = self._closed_path_tangents(path)
         return self.along_path(path, tangents, Shapes.ENDS_CONNECT)
 
     def along_open_path(self, path):
+        path = _as_array(path, 3)
         tangents = self._open_path_tangents(path)
         return self.along_path(path, tangents, Shapes.ENDS_CLOSE)
 
     def along_path(self, path, tangents, shape_type):
+        path = _as_array(path, 3)
         shapes = self._shapes(len(path))
-        transformed_shapes = list(self._transform_shapes(path, tangents, shapes))
+        transformed_shapes = self._transform_shapes(path, np.asarray(tangents, dtype=np.float64), shapes)
         return Shapes(transformed_shapes, type=shape_type)
 
     def along_z(self, h, n=2):
         assert n >= 2
-        p = [Point3(0, 0, i*h/(n-1)) for i in range(n)]
+        p = np.array([(0, 0, i*h/(n-1)) for i in range(n)], dtype=np.float64)
         return self.along_open_path(p)
 
     def around_z(self, n):
         tangents = self._rotation_tangents(n)
-        path = [Point3(0, 0, 0) for i in range(n)]
+        path = np.zeros((n, 3))
         return self.along_path(path, tangents, Shapes.ENDS_CONNECT)
 
     def around_z_partially(self, n, start, end):
         tangents = self._partial_rotation_tangents(n, start, end)
-        path = [Point3(0, 0, 0) for i in range(n)]
+        path = np.zeros((n, 3))
         return self.along_path(path, tangents, Shapes.ENDS_CLOSE)
 
 
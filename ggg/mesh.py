@@ -1,10 +1,488 @@
+import collections
+import contextlib
+import contextvars
+import io
+import struct
+import zipfile
+
+import numpy as np
 import solid
 
+from . import bbox
+from .triangulate import triangulate
+
+
+_STL_HEADER_SIZE = 84
+_STL_TRIANGLE = np.dtype([
+    ('normal', '<f4', (3,)),
+    ('vertices', '<f4', (3, 3)),
+    ('attributes', '<u2'),
+])
+
+_3MF_CONTENT_TYPES = '''<?xml version="1.0" encoding="UTF-8"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+ <Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+ <Default Extension="model" ContentType="application/vnd.ms-package.3dmanufacturing-3dmodel+xml"/>
+</Types>
+'''
+_3MF_RELS = '''<?xml version="1.0" encoding="UTF-8"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+ <Relationship Target="/3D/3dmodel.model" Id="rel0" Type="http://schemas.microsoft.com/3dmanufacturing/2013/01/3dmodel"/>
+</Relationships>
+'''
+_3MF_MODEL_HEAD = '''<?xml version="1.0" encoding="UTF-8"?>
+<model unit="millimeter" xml:lang="en-US" xmlns="http://schemas.microsoft.com/3dmanufacturing/core/2015/02">
+ <resources>
+  <object id="1" type="model">
+   <mesh>
+    <vertices>
+'''
+_3MF_MODEL_MIDDLE = '''    </vertices>
+    <triangles>
+'''
+_3MF_MODEL_TAIL = '''    </triangles>
+   </mesh>
+  </object>
+ </resources>
+ <build>
+  <item objectid="1"/>
+ </build>
+</model>
+'''
+
+
+_stats = collections.Counter()
+
+
+def stats():
+    # what Mesh.clean() removed in this process
+    return dict(_stats)
+
+
+# check every mesh when it is turned into an OpenSCAD polyhedron, in the
+# code running in a validating() block only: in the current thread or
+# asyncio task
+validation = contextvars.ContextVar('validation', default=False)
+
+
+@contextlib.contextmanager
+def validating(enabled=True):
+    token = validation.set(enabled)
+    try:
+        yield
+    finally:
+        validation.reset(token)
+
+
+def _cycle_unique(polygon):
+    # drop the vertices equal to the previous one, around the polygon
+    keep = polygon != np.roll(polygon, 1)
+    return polygon[keep] if np.any(keep) else polygon[:1]
+
 
 class Mesh:
-    def __init__(self, points, triangles):
-        self._points = points
-        self._triangles = triangles
+    def __init__(self, points, triangles, polygons=(), bounds=None, stations=None):
+        self._points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        self._triangles = np.asarray(triangles, dtype=np.int32).reshape(-1, 3)
+        # faces which are not triangulated (yet)
+        self._polygons = [np.asarray(polygon, dtype=np.int32) for polygon in polygons]
+        self._bounds = bounds
+        # (station, index in the profile) of each point of a sweep, to
+        # tell where a problem comes from
+        self._stations = stations
+
+    @property
+    def points(self):
+        return self._points
+
+    @property
+    def triangles(self):
+        return self._triangles
+
+    @property
+    def polygons(self):
+        return self._polygons
+
+    @property
+    def bounds(self):
+        if self._bounds is None:
+            self._bounds = bbox.from_points(self._points)
+        return self._bounds
+
+    def _all_triangles(self):
+        faces = [self._triangles]
+        for polygon in self._polygons:
+            faces.append(polygon[triangulate(self._points[polygon][np.newaxis])[0]])
+        return np.concatenate(faces).astype(np.int32)
+
+    def _outward_triangles(self):
+        # faces follow the OpenSCAD convention (clockwise when seen from
+        # the outside) while STL and 3MF want them counter-clockwise
+        return self._all_triangles()[:, ::-1]
+
+    def translate(self, v):
+        m = np.eye(4)
+        m[:3, 3] = v
+        bb = None if self._bounds is None else bbox.transform(self._bounds, m)
+        return Mesh(self._points + np.asarray(v, dtype=np.float64), self._triangles, self._polygons, bounds=bb, stations=self._stations)
+
+    def mirror(self, normal):
+        normal = np.asarray(normal, dtype=np.float64)
+        normal = normal / np.sqrt(normal.dot(normal))
+        points = self._points - 2 * (self._points @ normal)[:, np.newaxis] * normal
+        bb = None
+        if self._bounds is not None and np.count_nonzero(normal) == 1:
+            m = np.eye(4)
+            m[:3, :3] -= 2 * np.outer(normal, normal)
+            bb = bbox.transform(self._bounds, m)
+        # a reflection turns the mesh inside out: flip every face back
+        return Mesh(points, self._triangles[:, ::-1], [polygon[::-1] for polygon in self._polygons], bounds=bb, stations=self._stations)
+
+    def transform(self, m):
+        # affine transformation given as a 4x4 or 3x4 matrix
+        m = np.asarray(m, dtype=np.float64)
+        points = self._points @ m[:3, :3].T + m[:3, 3]
+        # the box of the transformed box is only exact for axis-aligned
+        # transformations
+        bb = None
+        if self._bounds is not None and np.all(np.count_nonzero(m[:3, :3], axis=1) == 1):
+            bb = bbox.transform(self._bounds, m)
+        triangles, polygons = self._triangles, self._polygons
+        if np.linalg.det(m[:3, :3]) < 0:
+            # turned inside out
+            triangles, polygons = triangles[:, ::-1], [polygon[::-1] for polygon in polygons]
+        return Mesh(points, triangles, polygons, bounds=bb, stations=self._stations)
+
+    def hull(self):
+        from .primitives import hull
+        return hull(self)
+
+    def normals(self, triangles=None):
+        triangles = self._outward_triangles() if triangles is None else triangles
+        v = self._points[triangles]
+        n = np.cross(v[:, 1] - v[:, 0], v[:, 2] - v[:, 0])
+        d = np.sqrt((n**2).sum(axis=1))
+        d[d == 0] = 1
+        return n / d[:, np.newaxis]
+
+    def _stl_records(self, triangles, records):
+        records['normal'] = self.normals(triangles)
+        records['vertices'] = self._points[triangles]
+        records['attributes'] = 0
+
+    def write_stl(self, filename, mmap=False, chunk=1 << 20):
+        triangles = self._outward_triangles()
+        header = b'ggg binary stl'.ljust(80) + struct.pack('<I', len(triangles))
+        if not mmap:
+            records = np.empty(len(triangles), dtype=_STL_TRIANGLE)
+            self._stl_records(triangles, records)
+            with open(filename, 'wb') as f:
+                f.write(header + records.tobytes())
+            return
+        with open(filename, 'wb') as f:
+            f.write(header)
+            f.truncate(_STL_HEADER_SIZE + len(triangles) * _STL_TRIANGLE.itemsize)
+        if len(triangles) == 0:
+            return
+        records = np.memmap(filename, dtype=_STL_TRIANGLE, mode='r+', offset=_STL_HEADER_SIZE, shape=(len(triangles),))
+        for start in range(0, len(triangles), chunk):
+            self._stl_records(triangles[start:start+chunk], records[start:start+chunk])
+        records.flush()
+        del records
+
+    def write_3mf(self, filename):
+        vertices = io.StringIO()
+        np.savetxt(vertices, self._points, fmt='     <vertex x="%.9g" y="%.9g" z="%.9g"/>')
+        triangles = io.StringIO()
+        np.savetxt(triangles, self._outward_triangles(), fmt='     <triangle v1="%d" v2="%d" v3="%d"/>')
+        model = _3MF_MODEL_HEAD + vertices.getvalue() + _3MF_MODEL_MIDDLE + triangles.getvalue() + _3MF_MODEL_TAIL
+        with zipfile.ZipFile(filename, 'w', compression=zipfile.ZIP_DEFLATED) as f:
+            f.writestr('[Content_Types].xml', _3MF_CONTENT_TYPES)
+            f.writestr('_rels/.rels', _3MF_RELS)
+            f.writestr('3D/3dmodel.model', model)
+
+    def clean(self, tolerance=1e-6):
+        # Weld the vertices closer than tolerance, and the ones they are
+        # welded to, remove the triangles which lose an edge in the
+        # process and the faces which are there twice, then drop the
+        # unused vertices. CGAL spends a lot of time on these, and
+        # sometimes fails.
+        import scipy.sparse
+        import scipy.sparse.csgraph
+        import scipy.spatial
+        n = len(self._points)
+        pairs = scipy.spatial.cKDTree(self._points).query_pairs(tolerance, output_type='ndarray')
+        graph = scipy.sparse.coo_matrix((np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])), shape=(n, n))
+        count, welded = scipy.sparse.csgraph.connected_components(graph, directed=False)
+        first = np.full(count, n)
+        np.minimum.at(first, welded, np.arange(n))
+        # keep the vertices in their original order
+        order = np.argsort(first)
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        first = first[order]
+        welded = rank[welded]
+        triangles = welded[self._triangles]
+        polygons = [_cycle_unique(welded[polygon]) for polygon in self._polygons]
+        polygons = [polygon for polygon in polygons if len(polygon) >= 3]
+
+        degenerate = (triangles[:, 0] == triangles[:, 1]) | (triangles[:, 1] == triangles[:, 2]) | (triangles[:, 2] == triangles[:, 0])
+        triangles = triangles[~degenerate]
+        # the same triangle twice is kept once, the same triangle in
+        # both orientations encloses nothing
+        rolled = np.argmin(triangles, axis=1)
+        triangles = triangles[np.arange(len(triangles))[:, np.newaxis], (rolled[:, np.newaxis] + np.arange(3)) % 3]
+        _, unique = np.unique(triangles, axis=0, return_index=True)
+        duplicates = len(triangles) - len(unique)
+        triangles = triangles[np.sort(unique)]
+        _, inverse, counts = np.unique(np.sort(triangles, axis=1), axis=0, return_inverse=True, return_counts=True)
+        opposite = counts[inverse.reshape(-1)] > 1
+        triangles = triangles[~opposite]
+
+        used = np.zeros(len(first), dtype=bool)
+        used[triangles.reshape(-1)] = True
+        for polygon in polygons:
+            used[polygon] = True
+        index = np.cumsum(used) - 1
+        points = self._points[first[used]]
+
+        _stats['welded vertices'] += len(self._points) - len(first)
+        _stats['removed faces'] += len(self._triangles) + len(self._polygons) - len(triangles) - len(polygons)
+        _stats['degenerate faces'] += int(np.count_nonzero(degenerate)) + len(self._polygons) - len(polygons)
+        _stats['duplicate faces'] += duplicates + int(np.count_nonzero(opposite))
+        stations = None if self._stations is None else self._stations[first[used]]
+        return Mesh(points, index[triangles], [index[polygon] for polygon in polygons], stations=stations)
+
+    def _where(self, vertices):
+        if self._stations is None:
+            return 'vertices %s' % ', '.join('(%g, %g, %g)' % tuple(self._points[v]) for v in vertices)
+        return ', '.join('station %d profile vertex %d' % tuple(self._stations[v]) for v in vertices)
+
+    def validate(self):
+        # Problems which make CGAL fail or produce broken STLs: every
+        # edge must be shared by exactly two triangles which use it in
+        # opposite directions, and the faces must enclose a positive
+        # volume. Returns a list of messages, empty if the mesh is fine.
+        triangles = self._all_triangles().astype(np.int64)
+        n = len(self._points)
+        edges = np.stack((triangles, np.roll(triangles, -1, axis=1)), axis=2).reshape(-1, 2)
+        problems = []
+        undirected, counts = np.unique(np.sort(edges, axis=1) @ [n, 1], return_counts=True)
+        for name, selected in [('open', counts == 1), ('non-manifold', counts > 2)]:
+            if np.any(selected):
+                a, b = divmod(int(undirected[selected][0]), n)
+                problems.append('%d %s edges, the first one at %s' % (np.count_nonzero(selected), name, self._where([a, b])))
+        directed, counts = np.unique(edges @ [n, 1], return_counts=True)
+        if np.any(counts > 1):
+            a, b = divmod(int(directed[counts > 1][0]), n)
+            problems.append('%d edges with an inconsistent winding, the first one at %s' % (np.count_nonzero(counts > 1), self._where([a, b])))
+        v = self._points[triangles[:, ::-1]]
+        volume = np.sum(v[:, 0] * np.cross(v[:, 1], v[:, 2])) / 6
+        if volume <= 0:
+            problems.append('the faces enclose a volume of %g: the mesh is inside out' % volume)
+        return problems
 
     def solidify(self):
-        return solid.polyhedron(self._points, self._triangles)
+        mesh = self.clean()
+        if validation.get():
+            problems = mesh.validate()
+            if problems:
+                raise Exception('Invalid mesh: %s' % '; '.join(problems))
+        faces = mesh._triangles.tolist() + [polygon.tolist() for polygon in mesh._polygons]
+        o = solid.polyhedron(mesh._points.tolist(), faces)
+        # lets ggg.boolean skip the round trip through the face lists
+        o.ggg_mesh = mesh
+        return o
+
+import unittest
+
+
+# a tetrahedron, clockwise seen from the outside
+_POINTS = [(0, 0, 0), (1, 0, 0), (0, 1, 0), (0, 0, 1)]
+_TRIANGLES = [[0, 1, 2], [0, 3, 1], [0, 2, 3], [1, 3, 2]]
+
+
+class CleanTestCase(unittest.TestCase):
+    def _clean(self, mesh):
+        before = stats()
+        cleaned = mesh.clean()
+        after = stats()
+        return cleaned, {k: after[k] - before.get(k, 0) for k in after if after[k] != before.get(k, 0)}
+
+    def _faces(self, mesh):
+        return sorted(tuple(triangle) for triangle in mesh.triangles.tolist())
+
+    def test_clean(self):
+        mesh, counts = self._clean(Mesh(_POINTS, _TRIANGLES))
+        np.testing.assert_array_equal(mesh.points, _POINTS)
+        self.assertEqual(self._faces(mesh), sorted(map(tuple, _TRIANGLES)))
+        self.assertEqual(counts, {})
+
+    def test_weld(self):
+        # the last point is a copy of the second one, within tolerance,
+        # and an unused point goes away
+        points = _POINTS + [(5, 5, 5), (1+1e-8, 0, 0)]
+        triangles = [[0, 5, 2], [0, 3, 5], [0, 2, 3], [1, 3, 2]]
+        mesh, counts = self._clean(Mesh(points, triangles))
+        np.testing.assert_array_equal(mesh.points, _POINTS)
+        self.assertEqual(self._faces(mesh), sorted(map(tuple, _TRIANGLES)))
+        self.assertEqual(counts, {'welded vertices': 1})
+        self.assertEqual(mesh.validate(), [])
+
+    def test_weld_boundary(self):
+        # close points on either side of what would be a cell boundary
+        # of a grid of tolerance
+        points = _POINTS + [(1+0.49e-6, 0, 0), (1+0.51e-6, 0, 0)]
+        triangles = [[0, 4, 2], [0, 3, 5], [0, 2, 3], [1, 3, 2]]
+        mesh, counts = self._clean(Mesh(points, triangles))
+        np.testing.assert_array_equal(mesh.points, _POINTS)
+        self.assertEqual(self._faces(mesh), sorted(map(tuple, _TRIANGLES)))
+        self.assertEqual(counts, {'welded vertices': 2})
+
+    def test_degenerate(self):
+        # a sliver whose two close vertices are welded
+        points = _POINTS + [(1e-8, 0, 0)]
+        mesh, counts = self._clean(Mesh(points, _TRIANGLES + [[0, 4, 2]], [[0, 1, 4]]))
+        self.assertEqual(len(mesh.points), 4)
+        self.assertEqual(self._faces(mesh), sorted(map(tuple, _TRIANGLES)))
+        self.assertEqual(mesh.polygons, [])
+        self.assertEqual(counts, {'welded vertices': 1, 'removed faces': 2, 'degenerate faces': 2})
+
+    def test_duplicates(self):
+        # the same face twice, starting from another vertex: kept once
+        mesh, counts = self._clean(Mesh(_POINTS, _TRIANGLES + [[2, 0, 1]]))
+        self.assertEqual(self._faces(mesh), sorted(map(tuple, _TRIANGLES)))
+        self.assertEqual(counts, {'removed faces': 1, 'duplicate faces': 1})
+
+    def test_opposite(self):
+        # a face in both orientations encloses nothing: both go
+        points = _POINTS + [(2, 2, 2)]
+        mesh, counts = self._clean(Mesh(points, _TRIANGLES + [[1, 2, 4], [1, 4, 2]]))
+        np.testing.assert_array_equal(mesh.points, _POINTS)
+        self.assertEqual(self._faces(mesh), sorted(map(tuple, _TRIANGLES)))
+        self.assertEqual(counts, {'removed faces': 2, 'duplicate faces': 2})
+
+    def test_polygons(self):
+        # a square cap keeps its vertices, once each, in order
+        points = [(0, 0, 0), (1, 0, 0), (1, 1, 0), (0, 1, 0), (1, 1, 1e-8)]
+        mesh, counts = self._clean(Mesh(points, [], [[0, 1, 2, 4, 3]]))
+        self.assertEqual([polygon.tolist() for polygon in mesh.polygons], [[0, 1, 2, 3]])
+        self.assertEqual(counts, {'welded vertices': 1})
+
+
+class ValidateTestCase(unittest.TestCase):
+    def test_valid(self):
+        self.assertEqual(Mesh(_POINTS, _TRIANGLES).validate(), [])
+        # a polygon face is triangulated first
+        self.assertEqual(Mesh(_POINTS, _TRIANGLES[1:], [_TRIANGLES[0]]).validate(), [])
+
+    def test_open(self):
+        self.assertEqual(Mesh(_POINTS, _TRIANGLES[:3]).validate(), [
+            '3 open edges, the first one at vertices (1, 0, 0), (0, 1, 0)',
+            'the faces enclose a volume of 0: the mesh is inside out',
+        ])
+
+    def test_stations(self):
+        # the problems of a sweep point to its profiles
+        stations = np.array([(0, 0), (0, 1), (1, 0), (1, 1)])
+        problems = Mesh(_POINTS, _TRIANGLES[:3], stations=stations).validate()
+        self.assertEqual(problems[0], '3 open edges, the first one at station 0 profile vertex 1, station 1 profile vertex 0')
+
+    def test_non_manifold(self):
+        # a second tetrahedron on the edge (0, 1) of the first one
+        points = _POINTS + [(0, -1, 0), (0, 0, -1)]
+        triangles = _TRIANGLES + [[0, 1, 4], [0, 5, 1], [0, 4, 5], [1, 5, 4]]
+        problems = Mesh(points, triangles).validate()
+        self.assertEqual(problems[0], '1 non-manifold edges, the first one at vertices (0, 0, 0), (1, 0, 0)')
+
+    def test_winding(self):
+        triangles = _TRIANGLES[:3] + [_TRIANGLES[3][::-1]]
+        self.assertEqual(Mesh(_POINTS, triangles).validate(), [
+            '3 edges with an inconsistent winding, the first one at vertices (1, 0, 0), (0, 1, 0)',
+            'the faces enclose a volume of -0.166667: the mesh is inside out',
+        ])
+
+    def test_inside_out(self):
+        triangles = [triangle[::-1] for triangle in _TRIANGLES]
+        self.assertEqual(Mesh(_POINTS, triangles).validate(), ['the faces enclose a volume of -0.166667: the mesh is inside out'])
+
+    def test_solidify(self):
+        with validating():
+            with self.assertRaisesRegex(Exception, 'Invalid mesh: 3 open edges'):
+                Mesh(_POINTS, _TRIANGLES[:3]).solidify()
+            Mesh(_POINTS, _TRIANGLES).solidify()
+        Mesh(_POINTS, _TRIANGLES[:3]).solidify()
+
+
+def _watertight(testcase, triangles):
+    # every edge is used once in each direction: closed and consistently
+    # oriented
+    edges = np.concatenate([triangles[:, [0, 1]], triangles[:, [1, 2]], triangles[:, [2, 0]]])
+    directed = set(map(tuple, edges.tolist()))
+    testcase.assertEqual(len(directed), len(edges))
+    testcase.assertEqual(directed, set(map(tuple, edges[:, ::-1].tolist())))
+
+
+def _outward_volume(points, triangles):
+    # positive for faces counter-clockwise seen from the outside
+    v = points[triangles]
+    return np.sum(v[:, 0] * np.cross(v[:, 1], v[:, 2])) / 6
+
+
+class WriteTestCase(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        from .primitives import cylinder
+        self._tmp = tempfile.TemporaryDirectory()
+        # triangles and polygons (the caps)
+        self._mesh = cylinder(3, 2, 1, segments=12).translate([1, 2, 3])
+        # OpenSCAD's convention: clockwise seen from the outside
+        self._volume = -_outward_volume(self._mesh.points, self._mesh._all_triangles())
+        self.assertGreater(self._volume, 0)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _path(self, name):
+        import os
+        return os.path.join(self._tmp.name, name)
+
+    def _read_stl(self, filename):
+        with open(filename, 'rb') as f:
+            data = f.read()
+        count, = struct.unpack('<I', data[80:_STL_HEADER_SIZE])
+        records = np.frombuffer(data, dtype=_STL_TRIANGLE, offset=_STL_HEADER_SIZE)
+        self.assertEqual(len(records), count)
+        return records
+
+    def test_stl(self):
+        self._mesh.write_stl(self._path('a.stl'))
+        records = self._read_stl(self._path('a.stl'))
+        self.assertEqual(len(records), len(self._mesh._all_triangles()))
+        vertices = records['vertices'].astype(np.float64)
+        points, triangles = np.unique(vertices.reshape(-1, 3), axis=0, return_inverse=True)
+        triangles = triangles.reshape(-1, 3)
+        _watertight(self, triangles)
+        self.assertAlmostEqual(_outward_volume(points, triangles), self._volume, places=4)
+        # the normals agree with the winding
+        n = np.cross(vertices[:, 1] - vertices[:, 0], vertices[:, 2] - vertices[:, 0])
+        self.assertTrue(np.all(np.sum(n * records['normal'], axis=1) > 0))
+
+    def test_stl_mmap(self):
+        self._mesh.write_stl(self._path('a.stl'))
+        self._mesh.write_stl(self._path('b.stl'), mmap=True, chunk=5)
+        with open(self._path('a.stl'), 'rb') as a, open(self._path('b.stl'), 'rb') as b:
+            self.assertEqual(a.read(), b.read())
+
+    def test_3mf(self):
+        import xml.etree.ElementTree as ElementTree
+        self._mesh.write_3mf(self._path('a.3mf'))
+        with zipfile.ZipFile(self._path('a.3mf')) as f:
+            self.assertEqual(sorted(f.namelist()), ['3D/3dmodel.model', '[Content_Types].xml', '_rels/.rels'])
+            root = ElementTree.fromstring(f.read('3D/3dmodel.model'))
+        ns = {'m': 'http://schemas.microsoft.com/3dmanufacturing/core/2015/02'}
+        points = np.array([[float(v.get(k)) for k in 'xyz'] for v in root.iterfind('.//m:vertex', ns)])
+        triangles = np.array([[int(t.get(k)) for k in ('v1', 'v2', 'v3')] for t in root.iterfind('.//m:triangle', ns)])
+        np.testing.assert_allclose(points, self._mesh.points, rtol=1e-8)
+        _watertight(self, triangles)
+        self.assertAlmostEqual(_outward_volume(points, triangles), self._volume, places=6)
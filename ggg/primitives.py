@@ -0,0 +1,135 @@
+import math
+
+import numpy as np
+
+from .mesh import Mesh
+
+__all__ = ['cylinder', 'sphere', 'capsule', 'rounded_box', 'ring', 'hull']
+
+# the default maximum distance in mm between the edges of the
+# primitives and their exact surfaces
+TOLERANCE = 0.01
+
+
+def _segments(r, segments, tolerance):
+    # number of vertices around a circle of radius r: segments unless a
+    # tolerance is given, which bounds the distance between the chords
+    # and the circle. A multiple of 4 keeps the circle symmetric on both
+    # axes.
+    if tolerance is None and segments is not None and segments > 0:
+        return max(int(segments), 3)
+    tolerance = TOLERANCE if tolerance is None else tolerance
+    if r <= tolerance:
+        return 4
+    n = math.ceil(math.pi / math.acos(1 - tolerance / r))
+    return max(4, 4 * math.ceil(n / 4))
+
+
+def _circle(rx, ry, z, n):
+    # same vertices as OpenSCAD's circles, counter-clockwise from +x
+    if rx == 0 and ry == 0:
+        return np.array([[0, 0, z]], dtype=np.float64)
+    t = np.radians(360 * np.arange(n) / n)
+    return np.column_stack((rx * np.cos(t), ry * np.sin(t), np.full(n, z, dtype=np.float64)))
+
+
+def _loft(rings):
+    # Closed mesh through rings of n points (or single points for the
+    # apexes) stacked from the bottom to the top, each counter-clockwise
+    # seen from above. Faces are clockwise seen from the outside, like
+    # OpenSCAD's.
+    points = np.concatenate(rings)
+    starts = np.cumsum([0] + [len(r) for r in rings])
+    triangles = []
+    for k in range(len(rings) - 1):
+        lower = starts[k] + np.arange(len(rings[k]))
+        upper = starts[k+1] + np.arange(len(rings[k+1]))
+        n = max(len(lower), len(upper))
+        lower = np.resize(lower, n)
+        upper = np.resize(upper, n)
+        if len(rings[k]) > 1:
+            triangles.append(np.column_stack((lower, upper, np.roll(lower, -1))))
+        if len(rings[k+1]) > 1:
+            triangles.append(np.column_stack((np.roll(lower, -1), upper, np.roll(upper, -1))))
+    polygons = []
+    if len(rings[0]) > 1:
+        polygons.append(starts[0] + np.arange(len(rings[0])))
+    if len(rings[-1]) > 1:
+        polygons.append(starts[-2] + np.arange(len(rings[-1]))[::-1])
+    return Mesh(points, np.concatenate(triangles), polygons)
+
+
+def cylinder(h, r1, r2=None, center=False, segments=None, tolerance=None):
+    # tapered cylinder, or cone when one of the radii is 0, along z
+    r2 = r1 if r2 is None else r2
+    n = _segments(max(r1, r2), segments, tolerance)
+    z = -h/2 if center else 0
+    return _loft([_circle(r1, r1, z, n), _circle(r2, r2, z+h, n)])
+
+
+def _sphere_rings(r, n, z=0):
+    # the rings of OpenSCAD's spheres
+    count = (n + 1) // 2
+    phi = np.radians(180 * (np.arange(count) + 0.5) / count)[::-1]
+    return [_circle(r*math.sin(p), r*math.sin(p), z + r*math.cos(p), n) for p in phi]
+
+
+def sphere(r, segments=None, tolerance=None):
+    return _loft(_sphere_rings(r, _segments(r, segments, tolerance)))
+
+
+def capsule(h, r, segments=None, tolerance=None):
+    # the hull of two spheres of radius r centered on z = 0 and z = h
+    n = _segments(r, segments, tolerance)
+    rings = _sphere_rings(r, n)
+    return hull(*(rings + [ring + [0, 0, h] for ring in rings]))
+
+
+def rounded_box(x, y, z, r, vertical=False, segments=None, tolerance=None):
+    # x*y*z box centered on the origin with its edges rounded with radius
+    # r, or only its vertical edges
+    n = _segments(r, segments, tolerance)
+    if vertical:
+        corner = [_circle(r, r, -z/2, n), _circle(r, r, z/2, n)]
+    else:
+        corner = _sphere_rings(r, n)
+        corner = [ring + [0, 0, dz] for ring in corner for dz in (z/2-r, -z/2+r)]
+    corner = np.concatenate(corner)
+    return hull(*[corner + [dx, dy, 0] for dx in (x/2-r, -x/2+r) for dy in (y/2-r, -y/2+r)])
+
+
+def ring(a, b, h, width=None, segments=None, tolerance=None):
+    # prism of height h between the ellipse of semi-axes a and b and the
+    # one of semi-axes a-width and b-width, or filled without width
+    n = _segments(max(a, b)**2 / min(a, b), segments, tolerance)
+    outer = _loft([_circle(a, b, 0, n), _circle(a, b, h, n)])
+    if width is None or width >= min(a, b):
+        return outer
+    inner = _circle(a-width, b-width, 0, n)
+    points = np.concatenate((outer.points, inner, inner + [0, 0, h]))
+    i = np.arange(n)
+    j = np.roll(i, -1)
+    # outer wall, inner wall, bottom and top
+    ob, ot, ib, it = i, n+i, 2*n+i, 3*n+i
+    triangles = [
+        outer.triangles,
+        np.column_stack((ib, ib[j], it)), np.column_stack((ib[j], it[j], it)),
+        np.column_stack((ob, ob[j], ib)), np.column_stack((ob[j], ib[j], ib)),
+        np.column_stack((ot, it, ot[j])), np.column_stack((ot[j], it, it[j])),
+    ]
+    return Mesh(points, np.concatenate(triangles))
+
+
+def hull(*objects):
+    # convex hull (quickhull) of meshes or arrays of points
+    import scipy.spatial
+    points = np.concatenate([np.asarray(getattr(o, 'points', o), dtype=np.float64).reshape(-1, 3) for o in objects])
+    h = scipy.spatial.ConvexHull(points)
+    triangles = h.simplices.copy()
+    # clockwise seen from the outside, like OpenSCAD
+    v = points[triangles]
+    n = np.cross(v[:, 1] - v[:, 0], v[:, 2] - v[:, 0])
+    flip = np.sum(n * h.equations[:, :3], axis=1) > 0
+    triangles[flip] = triangles[flip][:, ::-1]
+    used, triangles = np.unique(triangles, return_inverse=True)
+    return Mesh(points[used], triangles.reshape(-1, 3))
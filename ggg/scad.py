@@ -0,0 +1,236 @@
+import math
+import os
+import re
+
+import numpy as np
+
+# OpenSCAD defaults for $fa and $fs
+_FA = 12
+_FS = 2
+
+
+def fragments(r, segments):
+    # same as OpenSCAD's get_fragments_from_r()
+    if r < 1e-6:
+        return 3
+    if segments is not None and segments > 0:
+        return max(int(segments), 3)
+    return int(math.ceil(max(min(360 / _FA, r * 2 * math.pi / _FS), 5)))
+
+
+def vector(v, default=0):
+    if isinstance(v, (int, float)):
+        return [float(v)] * 3
+    v = [float(i) for i in v]
+    return v + [float(default)] * (3 - len(v))
+
+
+def _rotation(a, v):
+    if isinstance(a, (int, float)) and v is None:
+        a, v = [0, 0, a], None
+    if isinstance(a, (int, float)):
+        v = np.asarray(v, dtype=np.float64)
+        v = v / np.sqrt(v.dot(v))
+        c = math.cos(math.radians(a))
+        s = math.sin(math.radians(a))
+        k = np.array([[0, -v[2], v[1]], [v[2], 0, -v[0]], [-v[1], v[0], 0]])
+        return c * np.eye(3) + s * k + (1 - c) * np.outer(v, v)
+    x, y, z = [math.radians(i) for i in vector(a)]
+    rx = np.array([[1, 0, 0], [0, math.cos(x), -math.sin(x)], [0, math.sin(x), math.cos(x)]])
+    ry = np.array([[math.cos(y), 0, math.sin(y)], [0, 1, 0], [-math.sin(y), 0, math.cos(y)]])
+    rz = np.array([[math.cos(z), -math.sin(z), 0], [math.sin(z), math.cos(z), 0], [0, 0, 1]])
+    return rz @ ry @ rx
+
+
+def matrix(obj):
+    # the affine transformation of an OpenSCAD transformation node
+    name = obj.name
+    params = obj.params
+    m = np.eye(4)
+    if name == 'translate':
+        m[:3, 3] = vector(params['v'])
+    elif name == 'rotate':
+        m[:3, :3] = _rotation(params.get('a'), params.get('v'))
+    elif name == 'mirror':
+        n = np.asarray(vector(params['v']))
+        n = n / np.sqrt(n.dot(n))
+        m[:3, :3] = np.eye(3) - 2 * np.outer(n, n)
+    elif name == 'scale':
+        m[:3, :3] = np.diag(vector(params['v'], default=1))
+    elif name == 'multmatrix':
+        tmp = np.asarray(params['m'], dtype=np.float64)
+        m[:tmp.shape[0], :tmp.shape[1]] = tmp
+    else:
+        return None
+    return m
+
+
+def radius(params, r, d):
+    if params.get(d) is not None:
+        return params[d] / 2
+    return params.get(r)
+
+
+# polyhedra made by ggg.Mesh.solidify() are rendered as calls to
+# these, then replaced by their points and faces
+_PLACEHOLDER = re.compile(r'ggg_mesh_(\d+)\(\)')
+# rows formatted at once: about a MB of text
+_CHUNK = 1 << 14
+
+
+def _meshes(obj, found):
+    # [(node, name, params)] of the mesh-backed polyhedra under obj,
+    # each of them once even if it is shared
+    if obj.name == 'polyhedron' and getattr(obj, 'ggg_mesh', None) is not None:
+        if all(node is not obj for node, name, params in found):
+            found.append((obj, obj.name, obj.params))
+    for child in obj.children:
+        _meshes(child, found)
+    return found
+
+
+def _write_rows(f, rows, fmt):
+    # fmt for each row, the rows separated by commas, formatted a chunk
+    # at a time with a single % operation
+    for start in range(0, len(rows), _CHUNK):
+        chunk = rows[start:start+_CHUNK]
+        if start:
+            f.write(', ')
+        f.write(', '.join([fmt] * len(chunk)) % tuple(chunk.ravel().tolist()))
+
+
+def _write_polyhedron(f, mesh, params, precision):
+    from solid.solidpython import py2openscad
+    f.write('polyhedron(')
+    first = True
+    for k in sorted(params):
+        if params[k] is None:
+            continue
+        if not first:
+            f.write(', ')
+        first = False
+        f.write(k + ' = ')
+        if k == 'points':
+            f.write('[')
+            _write_rows(f, mesh.points, '[%%.%df, %%.%df, %%.%df]' % (precision, precision, precision))
+            f.write(']')
+        elif k == 'faces':
+            f.write('[')
+            _write_rows(f, mesh.triangles, '[%d, %d, %d]')
+            for i, polygon in enumerate(mesh.polygons):
+                if i or len(mesh.triangles):
+                    f.write(', ')
+                f.write(py2openscad(polygon.tolist()))
+            f.write(']')
+        else:
+            f.write(py2openscad(params[k]))
+    f.write(')')
+
+
+def write(obj, filename, header='', footer='', precision=10, sidecar=False):
+    # Same as solid.scad_render_to_file() except that the points and the
+    # faces of the polyhedra made by ggg.Mesh.solidify() are written to
+    # the file a chunk at a time instead of as one huge string, with
+    # precision digits after the decimal point (10 like SolidPython).
+    # With sidecar, each of these meshes goes to a binary STL next to
+    # filename, read back with import(): OpenSCAD parses it much faster
+    # but the coordinates are rounded to single precision. Returns the
+    # names of the STL files.
+    import solid
+    meshes = _meshes(obj, [])
+    for i, (node, name, params) in enumerate(meshes):
+        node.name, node.params = 'ggg_mesh_%d' % i, {}
+    try:
+        text = solid.scad_render(obj, header)
+    finally:
+        for node, name, params in meshes:
+            node.name, node.params = name, params
+    sidecars = []
+    if sidecar:
+        base = os.path.splitext(filename)[0]
+        for i, (node, name, params) in enumerate(meshes):
+            sidecars.append('%s.mesh%d.stl' % (base, i))
+            node.ggg_mesh.write_stl(sidecars[-1])
+    pieces = _PLACEHOLDER.split(text)
+    with open(filename, 'w') as f:
+        f.write(pieces[0])
+        for i, rest in zip(pieces[1::2], pieces[2::2]):
+            node, name, params = meshes[int(i)]
+            if sidecar:
+                f.write('import(file = "%s", convexity = %d)' % (os.path.basename(sidecars[int(i)]), params.get('convexity') or 10))
+            else:
+                _write_polyhedron(f, node.ggg_mesh, params, precision)
+            f.write(rest)
+        f.write(footer)
+    return sidecars
+
+
+import unittest
+
+
+class WriteTestCase(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        import solid
+        from .primitives import cylinder, sphere
+        self._tmp = tempfile.TemporaryDirectory()
+        self._meshes = [cylinder(3, 2, 1, segments=12), sphere(1.5, segments=10)]
+        self._nodes = [mesh.translate([0.1, 0.2, 0.3]).solidify() for mesh in self._meshes]
+        a, b = self._nodes
+        # b is there twice, and there is a polyhedron without a mesh
+        self._obj = solid.union()(
+            solid.difference()(a, solid.translate([1, 0, 0])(b), solid.cube(1)),
+            solid.rotate([0, 0, 30])(b),
+            solid.polyhedron([[0, 0, 0], [1, 0, 0], [0, 1, 0], [0, 0, 1]], [[0, 1, 2], [0, 3, 1], [0, 2, 3], [1, 3, 2]]),
+        )
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _write(self, **kwargs):
+        filename = os.path.join(self._tmp.name, 'a.scad')
+        sidecars = write(self._obj, filename, **kwargs)
+        with open(filename) as f:
+            return f.read(), sidecars
+
+    def test_identical(self):
+        # byte for byte what SolidPython writes
+        import solid
+        text, sidecars = self._write(header='// header\n', footer='// footer\n')
+        self.assertEqual(text, solid.scad_render(self._obj, '// header\n') + '// footer\n')
+        self.assertEqual(sidecars, [])
+
+    def test_chunks(self):
+        global _CHUNK
+        import solid
+        saved = _CHUNK
+        _CHUNK = 7
+        try:
+            text, sidecars = self._write()
+        finally:
+            _CHUNK = saved
+        self.assertEqual(text, solid.scad_render(self._obj))
+
+    def test_precision(self):
+        text, sidecars = self._write(precision=4)
+        self.assertIn('[2.1000, 0.2000, 0.3000]', text)
+        self.assertNotIn('0.20000', text)
+
+    def test_sidecar(self):
+        from .mesh import _STL_HEADER_SIZE, _STL_TRIANGLE
+        text, sidecars = self._write(sidecar=True)
+        self.assertEqual([os.path.basename(sidecar) for sidecar in sidecars], ['a.mesh0.stl', 'a.mesh1.stl'])
+        # the polyhedra of the meshes are imported, the others are not
+        expected, _ = self._write()
+        import solid
+        for i, node in enumerate(self._nodes):
+            polyhedron = solid.scad_render(node).strip().rstrip(';')
+            self.assertIn(polyhedron, expected)
+            expected = expected.replace(polyhedron, 'import(file = "a.mesh%d.stl", convexity = 10)' % i)
+        self.assertEqual(text, expected)
+        for sidecar, node in zip(sidecars, self._nodes):
+            with open(sidecar, 'rb') as f:
+                records = np.frombuffer(f.read(), dtype=_STL_TRIANGLE, offset=_STL_HEADER_SIZE)
+            mesh = node.ggg_mesh
+            np.testing.assert_array_equal(records['vertices'], mesh.points[mesh._outward_triangles()].astype(np.float32))
+
@@ -1,6 +1,9 @@
-import shapely
+import numpy as np
 
+from . import bbox
+from . import mesh as _mesh
 from .mesh import Mesh
+from .triangulate import _project, triangulate
 
 
 class Shapes:
@@ -8,46 +11,67 @@ class Shapes:
     ENDS_CLOSE, ENDS_CONNECT = (0, 1)
 
     def __init__(self, shapes, type):
+        if not isinstance(shapes, np.ndarray):
+            shapes = np.array([[(p.x, p.y, p.z) for p in shape] for shape in shapes], dtype=np.float64)
         self._shapes = shapes
         self._ends = type
+        self._bounds = None
 
     @property
     def shapes(self):
         return self._shapes
 
+    @property
+    def bounds(self):
+        if self._bounds is None:
+            self._bounds = bbox.from_points(self._shapes)
+        return self._bounds
+
+    def validate(self):
+        # the profiles of the sweep, each in its own plane, must not
+        # cross themselves
+        import shapely
+        projected = _project(self._shapes)
+        k, m = projected.shape[:2]
+        rings = shapely.linearrings(projected.reshape(-1, 2), indices=np.repeat(np.arange(k), m))
+        crossing = np.nonzero(~shapely.is_simple(rings))[0]
+        if len(crossing) == 0:
+            return []
+        return ['%d self-intersecting profiles, the first one at station %d: %s' % (len(crossing), crossing[0], self._shapes[crossing[0]].tolist())]
+
     def _slice_triangles(self, current, previous, delta):
-        triangles = []
-        for i in range(1, delta):
-            triangles.append((previous+i-1, previous+i, current+i-1))
-            triangles.append((previous+i, current+i, current+i-1))
-        triangles.append((previous+delta-1, previous, current+delta-1))
-        triangles.append((previous, current, current+delta-1))
-        return triangles
+        # two triangles for each quad between slice 'previous' and slice
+        # 'current', for every pair of slices at once.
+        j = np.arange(delta, dtype=np.int32)
+        k = (j + 1) % delta
+        previous = np.asarray(previous, dtype=np.int32)[:, np.newaxis]
+        current = np.asarray(current, dtype=np.int32)[:, np.newaxis]
+        triangles = np.stack((
+            previous+j, previous+k, current+j,
+            previous+k, current+k, current+j,
+        ), axis=-1)
+        return triangles.reshape(-1, 3)
 
     def mesh(self):
-        points = [point for shape in self._shapes for point in shape]
-        delta = len(self._shapes[0])
+        points = self._shapes.reshape(-1, 3)
+        delta = self._shapes.shape[1]
         n = len(self._shapes) * delta
-        previous = 0
-        current = delta
-        triangles = []
-        while current < n:
-            triangles.extend(self._slice_triangles(current, previous, delta))
-            previous = current
-            current += delta
-
+        previous = np.arange(0, n-delta, delta)
         if self._ends == Shapes.ENDS_CLOSE:
-            # XXX should project onto face plane, triangulate, and 
-            # then do the inverse transformation to get back triangles
-            # in the original space
-            triangles.append(list(reversed(range(0, delta))))
-            triangles.append(list(range(n-delta, n)))
-            #triangles.append(list(range(n-delta, n)))
-            #first = shapely.delaunay_triangles([(p.x, p.y) for p in self._shapes[0]])
-            #last = shapely.delaunay_triangles([(p.x, p.y) for p in self._shapes[-1]])
+            triangles = self._slice_triangles(previous+delta, previous, delta)
+            # the caps are triangulated in their best-fit planes, with
+            # the vertices of the side strips only
+            caps = np.stack((np.arange(delta)[::-1], np.arange(n-delta, n)))
+            caps = np.take_along_axis(caps[:, np.newaxis, :], triangulate(points[caps]).reshape(2, 1, -1), axis=2)
+            triangles = np.concatenate((triangles, caps.reshape(-1, 3).astype(np.int32)))
         elif self._ends == Shapes.ENDS_CONNECT:
-            triangles.extend(self._slice_triangles(0, n-delta, delta))
+            triangles = self._slice_triangles(np.append(previous+delta, 0), np.append(previous, n-delta), delta)
         else:
             assert False
 
-        return Mesh(points, triangles)
+        if _mesh.validation.get():
+            problems = self.validate()
+            if problems:
+                raise Exception('Invalid sweep: %s' % '; '.join(problems))
+        stations = np.column_stack((np.repeat(np.arange(len(self._shapes)), delta), np.tile(np.arange(delta), len(self._shapes))))
+        return Mesh(points, triangles, bounds=self._bounds, stations=stations)
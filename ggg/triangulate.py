@@ -0,0 +1,182 @@
+import numpy as np
+
+__all__ = ['triangulate']
+
+
+def _normals(polygons):
+    # Newell's method: the normal of the best-fit plane of each polygon,
+    # oriented so that the polygon turns counter-clockwise around it
+    a = polygons
+    b = np.roll(polygons, -1, axis=1)
+    n = np.stack((
+        np.sum((a[..., 1] - b[..., 1]) * (a[..., 2] + b[..., 2]), axis=1),
+        np.sum((a[..., 2] - b[..., 2]) * (a[..., 0] + b[..., 0]), axis=1),
+        np.sum((a[..., 0] - b[..., 0]) * (a[..., 1] + b[..., 1]), axis=1),
+    ), axis=1)
+    d = np.sqrt(np.sum(n**2, axis=1))
+    flat = d == 0
+    if np.any(flat):
+        # no enclosed area, for example a bowtie: least squares plane
+        centered = polygons[flat] - polygons[flat].mean(axis=1)[:, np.newaxis]
+        n[flat] = np.linalg.svd(centered)[2][:, -1]
+        d[flat] = 1
+    return n / d[:, np.newaxis]
+
+
+def _project(polygons):
+    # 2d coordinates of the polygons in their best-fit planes
+    normals = _normals(polygons)
+    # any vector which is not parallel to the normal
+    helper = np.where(np.abs(normals[:, :1]) < 0.9, [[1., 0, 0]], [[0., 1, 0]])
+    u = np.cross(normals, helper)
+    u /= np.sqrt(np.sum(u**2, axis=1))[:, np.newaxis]
+    v = np.cross(normals, u)
+    centered = polygons - polygons.mean(axis=1)[:, np.newaxis]
+    return np.stack((np.sum(centered * u[:, np.newaxis], axis=2), np.sum(centered * v[:, np.newaxis], axis=2)), axis=2)
+
+
+def _turns(p):
+    # cross product at each vertex of 2d polygons
+    previous = np.roll(p, 1, axis=-2)
+    following = np.roll(p, -1, axis=-2)
+    a = p - previous
+    b = following - p
+    return a[..., 0] * b[..., 1] - a[..., 1] * b[..., 0]
+
+
+def _fan(m):
+    i = np.arange(1, m-1)
+    return np.column_stack((np.zeros(m-2, dtype=np.int64), i, i+1))
+
+
+def _ear_clipping(p):
+    # triangles (indices into p) of a simple counter-clockwise polygon
+    remaining = np.arange(len(p))
+    scale = np.max(np.abs(p)) if len(p) else 1
+    epsilon = 1e-12 * max(scale, 1)**2
+    triangles = []
+    while len(remaining) > 3:
+        q = p[remaining]
+        previous = np.roll(q, 1, axis=0)
+        following = np.roll(q, -1, axis=0)
+        convex = _turns(q) > epsilon
+        # an ear does not contain any of the other vertices
+        candidates = np.nonzero(convex)[0]
+        a = previous[candidates][:, np.newaxis]
+        b = q[candidates][:, np.newaxis]
+        c = following[candidates][:, np.newaxis]
+        x = q[np.newaxis]
+
+        def side(u, v):
+            return (v[..., 0] - u[..., 0]) * (x[..., 1] - u[..., 1]) - (v[..., 1] - u[..., 1]) * (x[..., 0] - u[..., 0])
+        inside = (side(a, b) >= -epsilon) & (side(b, c) >= -epsilon) & (side(c, a) >= -epsilon)
+        # the corners of the triangle themselves
+        k = len(q)
+        inside[np.arange(len(candidates)), candidates] = False
+        inside[np.arange(len(candidates)), (candidates - 1) % k] = False
+        inside[np.arange(len(candidates)), (candidates + 1) % k] = False
+        # duplicates of the corners do not count either
+        corners = np.stack((a, b, c), axis=1)[:, :, 0]
+        same = np.any(np.all(x[:, np.newaxis] == corners[:, :, np.newaxis], axis=-1), axis=1)
+        ears = candidates[~np.any(inside & ~same, axis=1)]
+        if len(ears):
+            ear = ears[0]
+        else:
+            # only flat or reflex vertices left because of collinear
+            # or touching edges: cut the flattest one, which adds a
+            # sliver but keeps the cap closed
+            ear = np.argmax(_turns(q))
+        k = len(remaining)
+        triangles.append((remaining[(ear-1) % k], remaining[ear], remaining[(ear+1) % k]))
+        remaining = np.delete(remaining, ear)
+    triangles.append(tuple(remaining))
+    return np.array(triangles, dtype=np.int64)
+
+
+def triangulate(polygons):
+    # (k, m, 3) stack of polygons -> (k, m-2, 3) triangles, as indices
+    # into each polygon, with the same orientation as the polygon.
+    # Convex polygons are fanned out all at once, the others are ear
+    # clipped in the plane which fits them best.
+    polygons = np.asarray(polygons, dtype=np.float64)
+    k, m = polygons.shape[:2]
+    assert m >= 3
+    if m == 3:
+        return np.broadcast_to(_fan(m), (k, 1, 3)).copy()
+    projected = _project(polygons)
+    turns = _turns(projected)
+    # fanning out from the sharpest corner avoids flat triangles
+    retval = (_fan(m)[np.newaxis] + np.argmax(turns, axis=1)[:, np.newaxis, np.newaxis]) % m
+    scale = np.max(np.abs(projected), axis=(1, 2))
+    concave = np.any(turns < -1e-12 * np.maximum(scale, 1)[:, np.newaxis]**2, axis=1)
+    for i in np.nonzero(concave)[0]:
+        retval[i] = _ear_clipping(projected[i])
+    return retval
+
+import unittest
+
+
+class TriangulateTestCase(unittest.TestCase):
+    def _place(self, polygon2d, z=0):
+        # a 2d polygon in a tilted plane
+        p = np.column_stack((np.asarray(polygon2d, dtype=np.float64), np.full(len(polygon2d), z, dtype=np.float64)))
+        c, s = np.cos(0.3), np.sin(0.3)
+        return p @ np.array([[1, 0, 0], [0, c, -s], [0, s, c]]).T + [1, 2, 3]
+
+    def _check(self, polygon):
+        # every triangle turns the same way as the polygon and they
+        # cover its area exactly once
+        polygon = np.asarray(polygon, dtype=np.float64)
+        triangles = triangulate(polygon[np.newaxis])[0]
+        self.assertEqual(triangles.shape, (len(polygon)-2, 3))
+        normal = _normals(polygon[np.newaxis])[0]
+        v = polygon[triangles]
+        areas = np.cross(v[:, 1] - v[:, 0], v[:, 2] - v[:, 0]) @ normal / 2
+        self.assertTrue(np.all(areas > -1e-12), areas)
+        b = np.roll(polygon, -1, axis=0)
+        area = np.cross(polygon, b).sum(axis=0) @ normal / 2
+        self.assertAlmostEqual(np.sum(areas), area)
+        return triangles, areas
+
+    def test_convex(self):
+        t = np.radians(np.arange(0, 360, 30))
+        triangles, areas = self._check(self._place(np.column_stack((np.cos(t), np.sin(t)))))
+        self.assertTrue(np.all(areas > 0))
+
+    def test_concave(self):
+        # an L and a star
+        self._check(self._place([(0, 0), (2, 0), (2, 1), (1, 1), (1, 2), (0, 2)]))
+        t = np.radians(np.arange(0, 360, 36))
+        r = np.where(np.arange(10) % 2, 0.4, 1)
+        triangles, areas = self._check(self._place(np.column_stack((r*np.cos(t), r*np.sin(t)))))
+        self.assertTrue(np.all(areas > 0))
+
+    def test_collinear(self):
+        # an L with extra vertices along its edges: only the slivers
+        # which cannot be avoided are flat
+        triangles, areas = self._check(self._place([(0, 0), (1, 0), (2, 0), (2, 1), (1, 1), (1, 2), (0, 2), (0, 1)]))
+        self.assertTrue(np.all(areas > 1e-9))
+
+    def test_non_planar(self):
+        # a square warped into a saddle: Newell's normal is the one of
+        # the plane it is centered on, turning counter-clockwise
+        square = np.array([(0, 0, 0.1), (1, 0, -0.1), (1, 1, 0.1), (0, 1, -0.1)])
+        np.testing.assert_allclose(_normals(square[np.newaxis])[0], [0, 0, 1])
+        np.testing.assert_allclose(_normals(square[np.newaxis, ::-1])[0], [0, 0, -1])
+        self._check(square)
+        # a warped L is cut in the plane which fits it best
+        polygon = np.array([(0, 0), (2, 0), (2, 1), (1, 1), (1, 2), (0, 2)], dtype=np.float64)
+        warped = np.column_stack((polygon, 0.05*np.sin(polygon[:, 0]*3)))
+        np.testing.assert_allclose(_normals(warped[np.newaxis])[0], [0, 0, 1], atol=0.01)
+        self._check(warped)
+
+    def test_batch(self):
+        # a stack mixing convex and concave polygons gives the same
+        # triangles as one at a time
+        polygons = np.stack([
+            self._place([(0, 0), (2, 0), (2, 1), (1, 1), (1, 2), (0, 2)]),
+            self._place([(0, 0), (2, 0), (3, 1), (2, 2), (0, 2), (-1, 1)]),
+        ])
+        got = triangulate(polygons)
+        for polygon, triangles in zip(polygons, got):
+            np.testing.assert_array_equal(triangles, triangulate(polygon[np.newaxis])[0])
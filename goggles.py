@@ -1,15 +1,21 @@
 #!/usr/bin/python
 import math
+import os
+import time
 import collections
 import solid
 import solid.utils
 import euclid3
+import numpy as np
 
+import buildcache
+import memo
 import mg2
+import settings
+import spans
+import sweep
 import utils
-import lens
 import constants
-import transform
 import ggg
 
 Point3 = euclid3.Point3
@@ -62,14 +68,9 @@ def rounded_square(x, y, height, radius, adjust=False):
     if adjust:
         x = x - 2*radius
         y = y - 2*radius
-    r = solid.cylinder(radius, height, segments=40)
-    o = solid.hull()(
-        solid.translate([-x/2, -y/2, 0])(r),
-        solid.translate([x/2, -y/2, 0])(r),
-        solid.translate([-x/2, y/2, 0])(r),
-        solid.translate([x/2, y/2, 0])(r),
-    )
-    return o
+    # the hull of 4 cylinders centered on the corners of x*y
+    o = ggg.rounded_box(x+2*radius, y+2*radius, height, radius, vertical=True, segments=40, tolerance=constants.CHORD_ERROR)
+    return o.translate([0, 0, height/2]).solidify()
 
 
 def rounded_square2(x, y, height, radius, adjust=False):
@@ -77,114 +78,173 @@ def rounded_square2(x, y, height, radius, adjust=False):
         x = x - 2*radius
         y = y - 2*radius
         height = height - 2*radius
-    r = solid.sphere(radius, segments=40)
-    o = solid.hull()(
-        solid.translate([-x/2, -y/2, height/2])(r),
-        solid.translate([x/2, -y/2, height/2])(r),
-        solid.translate([-x/2, y/2, height/2])(r),
-        solid.translate([x/2, y/2, height/2])(r),
-        solid.translate([-x/2, -y/2, -height/2])(r),
-        solid.translate([x/2, -y/2, -height/2])(r),
-        solid.translate([-x/2, y/2, -height/2])(r),
-        solid.translate([x/2, y/2, -height/2])(r),
-    )
-    return o
+    # the hull of 8 spheres centered on the corners of x*y*height
+    o = ggg.rounded_box(x+2*radius, y+2*radius, height+2*radius, radius, segments=40, tolerance=constants.CHORD_ERROR)
+    return o.solidify()
+
+
+def shell_reach(alpha):
+    # how far the shell profiles extend from the ellipse, to place the
+    # sweep stations in --chord-error mode
+    width = np.vectorize(fwidth)(alpha)
+    height = np.vectorize(fheight)(alpha)
+    return constants.SHELL_TOP_X+width, height
+
+
+# the resolution of the splines in --chord-error mode, before resampling
+SPLINE_SAMPLES = 200
+
+
+@memo.memoize
+def _shell_curve_length():
+    # every profile needs the same number of vertices: the most curved
+    # one decides
+    if constants.CHORD_ERROR is None:
+        return 20
+    alphas = np.linspace(0, 1, 33)
+    curves = mg2.splinify_paths([shell_curve(alpha) for alpha in alphas], n=SPLINE_SAMPLES)
+    curves = [curve.cut(y=fheight_short(alpha))[0] for curve, alpha in zip(curves, alphas)]
+    return max(4, max(curve.chord_samples(constants.CHORD_ERROR) for curve in curves))
+
+
+def _shell_curve_cuts(alphas):
+    LENGTH = _shell_curve_length()
+    n = SPLINE_SAMPLES if constants.CHORD_ERROR is not None else LENGTH
+    curves = mg2.splinify_paths([shell_curve(alpha) for alpha in alphas], n=n)
+    cuts = mg2.cut_paths(curves, y=[fheight_short(alpha) for alpha in alphas])
+    curves = [points[start:end] for points, ((start, end), *_) in cuts]
+    if constants.CHORD_ERROR is not None:
+        return [mg2.Path(path=curve).resample_adaptive(LENGTH).array for curve in curves]
+    return [curve.array for curve in mg2.resample_paths(curves, LENGTH)]
+
+
+@memo.memoize
+def _shell_curve_cut(alpha):
+    return _shell_curve_cuts([alpha])[0]
 
 
 def shell_curve_cut(alpha):
-    LENGTH = 20
-    curve = shell_curve(alpha).splinify(n=LENGTH)
-    cuts = curve.cut(y=fheight_short(alpha))
-    curve = cuts[0].resample(LENGTH)
-    path = mg2.Path(path=curve)
+    path = mg2.Path(path=_shell_curve_cut(alpha))
+    return path
+
+
+def station_alphas(n):
+    return [utils.ellipsis_alpha(i, n, reach=shell_reach) for i in range(n)]
+
+
+def keyframe_alphas():
+    # the profiles are not smooth across these: distance() has a kink at
+    # 0.5 and the attachments start and end there
+    return [0, 0.5, 1,
+            constants.TOP_ATTACHMENT_WIDTH, 1-constants.TOP_ATTACHMENT_WIDTH,
+            0.5-constants.BOTTOM_ATTACHMENT_WIDTH, 0.5+constants.BOTTOM_ATTACHMENT_WIDTH]
+
+
+def _shell_curve(curve):
+    path = mg2.Path(path=curve)\
+        .translate(dx=constants.SHELL_TOP_X)
     return path
 
 
+def _shell_profile(path, return_path):
+    path.extend_arc(alpha=-math.pi, r=constants.SHELL_THICKNESS/2)\
+        .extend(path=return_path)\
+        .append(x=constants.SHELL_TOP_X, y=constants.SHELL_TOP_Y)\
+        .append(x=0)\
+        .append(dy=constants.SHELL_THICKNESS-constants.SKIRT_THICKNESS/2)\
+        .extend_arc(alpha=-math.pi/2, r=constants.SKIRT_THICKNESS/2)
+    return path.reversed_points.array.copy()
+
+
+def _shell_profiles_at(alphas):
+    curves = [_shell_curve(curve) for curve in _shell_curve_cuts(alphas)]
+    return_paths = mg2.offset_paths([path.copy().reverse() for path in curves], constants.SHELL_THICKNESS, left=True)
+    return [_shell_profile(path, return_path) for path, return_path in zip(curves, return_paths)]
+
+
+def _shell_profiles(indices, n):
+    return _shell_profiles_at([utils.ellipsis_alpha(i, n, reach=shell_reach) for i in indices])
+
+
+def shell_profiles(n):
+    if constants.KEYFRAMES is not None:
+        return sweep.keyframes(_shell_profiles_at, station_alphas(n), constants.KEYFRAMES, keyframe_alphas())
+    return sweep.chunks(_shell_profiles, n)
+
+
+def top_attachment_profile(i, n):
+    attachment_alpha = i/(n-1)
+    if attachment_alpha > 0.5:
+        shell_alpha = 2*constants.TOP_ATTACHMENT_WIDTH*(attachment_alpha-0.5)
+        alpha = (attachment_alpha - 0.5)/0.5
+    else:
+        shell_alpha = 1-constants.TOP_ATTACHMENT_WIDTH+2*constants.TOP_ATTACHMENT_WIDTH*attachment_alpha
+        alpha = (0.5-attachment_alpha)/0.5
+    curve = shell_curve_cut(shell_alpha)
+    top = max(2*constants.UNIT/3*(1-alpha**4), constants.SHELL_THICKNESS)
+    tooth_width = constants.TOOTH_WIDTH*(1-alpha**4)
+    epsilon = 0.1
+
+    p1 = mg2.Path(x=constants.SHELL_TOP_X+curve.width+constants.SHELL_THICKNESS-epsilon, y=curve.height)\
+        .append(dx=tooth_width, y=-top/2)\
+        .append(y=-top)\
+        .splinify(n=4)\
+        .append(dx=-tooth_width)\
+        .append(dx=-curve.width/2, y=-constants.SHELL_THICKNESS)\
+        .append(dx=-curve.width/2-constants.SHELL_THICKNESS-epsilon)\
+        .append(dy=constants.SHELL_THICKNESS-epsilon)\
+        .append(dx=curve.width-epsilon)
+    return p1.reversed_points.array.copy()
+
+
+BOTTOM_ATTACHMENT_HEIGHT = 2
+
+
+def bottom_attachment_profile(i, n):
+    attachment_alpha = i / n
+    if attachment_alpha > 0.5:
+        shell_alpha = 0.5+2*constants.BOTTOM_ATTACHMENT_WIDTH*(attachment_alpha-0.5)
+    else:
+        shell_alpha = 0.5-2*constants.BOTTOM_ATTACHMENT_WIDTH*(0.5-attachment_alpha)
+    curve = shell_curve_cut(shell_alpha)
+    handle_width = constants.SHELL_THICKNESS*4*distance(attachment_alpha)**2
+    handle_height = BOTTOM_ATTACHMENT_HEIGHT
+    xalpha = constants.XALPHA
+    yalpha = constants.YALPHA
+    epsilon = 0.4
+    points, ranges = curve.cut_ranges(y=constants.SHELL_MAX_HEIGHT-handle_height)
+    top = mg2.Path(path=points[slice(*ranges[1])])
+    delta_x = top.width
+    delta_y = top.height
+    path = mg2.Path(x=top.points.first.x+constants.LENS_BOTTOM_RING_WIDTH+constants.SHELL_THICKNESS-epsilon, y=top.points.first.y)\
+        .append(dx=delta_x, dy=delta_y)\
+        .append(dx=handle_width)\
+        .extend(mg2.Path(x=0, y=0)
+                .append(dx=-(1-xalpha)*(delta_x+handle_width)*3/4, dy=-(1-yalpha)*delta_y)
+                .append(dx=-(xalpha)*(delta_x+handle_width)*3/4, dy=-(yalpha)*delta_y)
+                .splinify())
+    return path.reversed_points.array.copy()
+
+
 def shell():
     TOP_ATTACHMENT_RESOLUTION = 40
     BOTTOM_ATTACHMENT_RESOLUTION = 40
 
-    def profile(i, n):
-        alpha = i/n
-        curve = shell_curve_cut(alpha)
-
-        path = mg2.Path(path=curve)\
-            .translate(dx=constants.SHELL_TOP_X)
-        return_path = path.copy().reverse()\
-            .offset(constants.SHELL_THICKNESS, left=True)
-        path.extend_arc(alpha=-math.pi, r=constants.SHELL_THICKNESS/2)\
-            .extend(path=return_path)\
-            .append(x=constants.SHELL_TOP_X, y=constants.SHELL_TOP_Y)\
-            .append(x=0)\
-            .append(dy=constants.SHELL_THICKNESS-constants.SKIRT_THICKNESS/2)\
-            .extend_arc(alpha=-math.pi/2, r=constants.SKIRT_THICKNESS/2)
-        return utils.eu3(path.reversed_points)
-
-    def top_attachment_profile(i, n):
-        attachment_alpha = i/(n-1)
-        if attachment_alpha > 0.5:
-            shell_alpha = 2*constants.TOP_ATTACHMENT_WIDTH*(attachment_alpha-0.5)
-            alpha = (attachment_alpha - 0.5)/0.5
-        else:
-            shell_alpha = 1-constants.TOP_ATTACHMENT_WIDTH+2*constants.TOP_ATTACHMENT_WIDTH*attachment_alpha
-            alpha = (0.5-attachment_alpha)/0.5
-        curve = shell_curve_cut(shell_alpha)
-        top = max(2*constants.UNIT/3*(1-alpha**4), constants.SHELL_THICKNESS)
-        tooth_width = constants.TOOTH_WIDTH*(1-alpha**4)
-        epsilon = 0.1
-
-        p1 = mg2.Path(x=constants.SHELL_TOP_X+curve.width+constants.SHELL_THICKNESS-epsilon, y=curve.height)\
-            .append(dx=tooth_width, y=-top/2)\
-            .append(y=-top)\
-            .splinify(n=4)\
-            .append(dx=-tooth_width)\
-            .append(dx=-curve.width/2, y=-constants.SHELL_THICKNESS)\
-            .append(dx=-curve.width/2-constants.SHELL_THICKNESS-epsilon)\
-            .append(dy=constants.SHELL_THICKNESS-epsilon)\
-            .append(dx=curve.width-epsilon)
-        return utils.eu3(p1.reversed_points)
-
-    path1 = utils.ellipsis_path()
-    shapes1 = [profile(i, len(path1)) for i in range(len(path1))]
+    path1 = utils.ellipsis_path(reach=shell_reach)
+    shapes1 = shell_profiles(len(path1))
     o = ggg.extrude(shapes1).along_closed_path(path1).mesh().solidify()
 #    o = solid.debug(o)
 
     path2 = [utils.ellipsis(constants.ELLIPSIS_WIDTH, constants.ELLIPSIS_HEIGHT, t) for t in solid.utils.frange(-constants.TOP_ATTACHMENT_WIDTH*2*math.pi, constants.TOP_ATTACHMENT_WIDTH*2*math.pi, TOP_ATTACHMENT_RESOLUTION, include_end=True)]
-    shapes2 = [top_attachment_profile(i, len(path2)) for i in range(len(path2))]
+    shapes2 = sweep.profiles(top_attachment_profile, len(path2))
     top_attachment = ggg.extrude(shapes2).along_open_path(path2).mesh().solidify()
     top_hole = rounded_square(1.5*constants.SHELL_THICKNESS, 1.5*constants.SHELL_THICKNESS, 20, constants.SHELL_THICKNESS/2)
     top_hole = solid.translate([constants.ELLIPSIS_WIDTH+shell_curve_cut(0).width+constants.SHELL_TOP_X+constants.SHELL_THICKNESS+constants.TOOTH_WIDTH/2-0.2, 0, -10])(top_hole)
     top_attachment = top_attachment - top_hole
     o = o + top_attachment
 
-    BOTTOM_ATTACHMENT_HEIGHT = 2
-
-    def bottom_attachment_profile(i, n):
-        attachment_alpha = i / n
-        if attachment_alpha > 0.5:
-            shell_alpha = 0.5+2*constants.BOTTOM_ATTACHMENT_WIDTH*(attachment_alpha-0.5)
-        else:
-            shell_alpha = 0.5-2*constants.BOTTOM_ATTACHMENT_WIDTH*(0.5-attachment_alpha)
-        curve = shell_curve_cut(shell_alpha)
-        handle_width = constants.SHELL_THICKNESS*4*distance(attachment_alpha)**2
-        handle_height = BOTTOM_ATTACHMENT_HEIGHT
-        xalpha = constants.XALPHA
-        yalpha = constants.YALPHA
-        epsilon = 0.4
-        cuts = curve.cut(y=constants.SHELL_MAX_HEIGHT-handle_height)
-        delta_x = cuts[1].width
-        delta_y = cuts[1].height
-        path = mg2.Path(x=cuts[1].points.first.x+constants.LENS_BOTTOM_RING_WIDTH+constants.SHELL_THICKNESS-epsilon, y=cuts[1].points.first.y)\
-            .append(dx=delta_x, dy=delta_y)\
-            .append(dx=handle_width)\
-            .extend(mg2.Path(x=0, y=0)
-                    .append(dx=-(1-xalpha)*(delta_x+handle_width)*3/4, dy=-(1-yalpha)*delta_y)
-                    .append(dx=-(xalpha)*(delta_x+handle_width)*3/4, dy=-(yalpha)*delta_y)
-                    .splinify())
-        return utils.eu3(path.reversed_points)
-
     path3 = [utils.ellipsis(constants.ELLIPSIS_WIDTH, constants.ELLIPSIS_HEIGHT, t) for t in solid.utils.frange(math.pi-constants.BOTTOM_ATTACHMENT_WIDTH*2*math.pi, math.pi+constants.BOTTOM_ATTACHMENT_WIDTH*2*math.pi, BOTTOM_ATTACHMENT_RESOLUTION)]
-    shapes3 = [bottom_attachment_profile(i, len(path3)) for i in range(len(path3))]
+    shapes3 = sweep.profiles(bottom_attachment_profile, len(path3))
     bottom_attachment = ggg.extrude(shapes3).along_open_path(path3).mesh().solidify()
 
     bah = rounded_square(constants.SHELL_BOTTOM_HOLE_HEIGHT, constants.SHELL_BOTTOM_HOLE_WIDTH, 20, constants.SHELL_THICKNESS/2)
@@ -199,11 +259,8 @@ def shell():
 
     # water filling holes
     for y in [1, -1]:
-        o = o - solid.translate([-constants.ELLIPSIS_WIDTH-constants.SHELL_MAX_WIDTH/2, y*1.2*constants.UNIT, -50])(
-            solid.scale([2, 1, 1])(
-                solid.cylinder(1.5*constants.UNIT/7, 100, segments=30)
-            )
-        )
+        hole = ggg.cylinder(100, 1.5*constants.UNIT/7, segments=30, tolerance=constants.CHORD_ERROR).transform(np.diag([2, 1, 1, 1]))
+        o = o - hole.translate([-constants.ELLIPSIS_WIDTH-constants.SHELL_MAX_WIDTH/2, y*1.2*constants.UNIT, -50]).solidify()
 
     # flip for final rendering
     o = solid.mirror([0, 1, 0])(o)
@@ -212,7 +269,8 @@ def shell():
     return o
 
 
-def shell_extension():
+@memo.memoize
+def _shell_extension():
     zero = shell_curve(0)
     silicon_skirt_height = 0.5*constants.UNIT
     silicon_skirt_width = constants.SHELL_TOP_X+zero.width
@@ -220,16 +278,35 @@ def shell_extension():
         .append(dy=silicon_skirt_height)\
         .append(dx=silicon_skirt_width)\
         .splinify()
-    return tmp
+    return tmp.array
 
 
-def skirt_profile(i, n):
-    alpha = i / n
+def shell_extension():
+    return mg2.Path(path=_shell_extension())
+
+
+@memo.memoize
+def _skirt_curve_length():
+    curves = mg2.splinify_paths([shell_curve(alpha) for alpha in np.linspace(0, 1, 33)], n=SPLINE_SAMPLES)
+    return max(4, max(curve.chord_samples(constants.CHORD_ERROR) for curve in curves))
+
+
+def _skirt_curve(alpha):
     curve = shell_curve(alpha)
-    path = mg2.Path(path=curve.splinify())\
+    if constants.CHORD_ERROR is None:
+        curve.splinify()
+    else:
+        # resample() leaves the last point out
+        curve.splinify(n=SPLINE_SAMPLES)
+        last = curve.points.last
+        curve.resample_adaptive(_skirt_curve_length()).append(x=last.x, y=last.y)
+    path = mg2.Path(path=curve)\
         .translate(constants.SHELL_TOP_X, 0)
     path.extend(path=shell_extension())
-    return_path = path.copy().reverse().offset(constants.SKIRT_THICKNESS, left=False)
+    return path
+
+
+def _skirt_profile(path, return_path):
     path.extend_arc(alpha=math.pi, r=constants.SKIRT_THICKNESS/2)\
         .extend(path=return_path)\
         .append(x=0+constants.SKIRT_THICKNESS/2)\
@@ -239,33 +316,57 @@ def skirt_profile(i, n):
         .append(dy=constants.SHELL_THICKNESS-constants.SKIRT_THICKNESS/2)\
         .extend_arc(alpha=-math.pi/2, r=constants.SKIRT_THICKNESS/2)
 
-    return path.points
+    return path
+
+
+def _skirt_profiles_at(alphas):
+    paths = [_skirt_curve(alpha) for alpha in alphas]
+    return_paths = mg2.offset_paths([path.copy().reverse() for path in paths], constants.SKIRT_THICKNESS, left=False)
+    return [_skirt_profile(path, return_path).array for path, return_path in zip(paths, return_paths)]
+
+
+def _skirt_chunk(indices, n):
+    return _skirt_profiles_at([utils.ellipsis_alpha(i, n, reach=shell_reach) for i in indices])
+
+
+@memo.memoize
+def _skirt_profiles(n):
+    if constants.KEYFRAMES is not None:
+        return sweep.keyframes(_skirt_profiles_at, station_alphas(n), constants.KEYFRAMES, keyframe_alphas())
+    return sweep.chunks(_skirt_chunk, n)
+
+
+def skirt_profile(i, n):
+    return mg2.Path(path=_skirt_profiles(n)[i]).points
+
+
+def skirt_profiles(n):
+    return [mg2.Path(path=profile).points for profile in _skirt_profiles(n)]
 
 
-BoundingBox = collections.namedtuple('BoundingBox', ['xmin', 'xmax', 'ymin', 'ymax', 'zmin', 'zmax'])
+BoundingBox = ggg.BoundingBox
+
+
+@memo.memoize
+def skirt_sweep():
+    path = utils.ellipsis_path(reach=shell_reach)
+    shapes = [utils.eu3(profile) for profile in skirt_profiles(len(path))]
+    return ggg.extrude(shapes).along_closed_path(path)
 
 
 def skirt_bounding_box():
-    path = utils.ellipsis_path()
-    shapes = [utils.eu3(skirt_profile(i, constants.NSTEPS)) for i in range(len(path))]
-    transformed = transform.to_path(shapes, path, True)
+    return skirt_sweep().bounds
 
-    xmin = min([p.x for shape in transformed for p in shape])
-    xmax = max([p.x for shape in transformed for p in shape])
-    ymin = min([p.y for shape in transformed for p in shape])
-    ymax = max([p.y for shape in transformed for p in shape])
-    zmin = min([p.z for shape in transformed for p in shape])
-    zmax = max([p.z for shape in transformed for p in shape])
 
-    return BoundingBox(xmin=xmin, xmax=xmax, ymin=ymin, ymax=ymax, zmin=zmin, zmax=zmax)
+def skirt_mesh():
+    m = skirt_sweep().mesh().clean()
+    m = m.mirror([0, 1, 0])
+    return m
 
 
-def skirt():
-    path = utils.ellipsis_path()
-    shapes = [utils.eu3(skirt_profile(i, constants.NSTEPS)) for i in range(len(path))]
-    o = ggg.extrude(shapes).along_closed_path(path).mesh().solidify()
-    o = solid.mirror([0, 1, 0])(o)
-    o = solid.translate([0, 0, 0])(o)
+def skirt(mesh=None):
+    mesh = skirt_mesh() if mesh is None else mesh
+    o = mesh.solidify()
     o = solid.color("grey")(o)
 #    o = solid.debug(o)
     return o
@@ -286,19 +387,15 @@ def skirt_mold_bounding_box():
 
 
 def skirt_mold_bounded():
-    corner = solid.cylinder(r=constants.MOLD_RADIUS, h=constants.MOLD_BB_Y, segments=40)
-    corner = solid.rotate([90, 0, 0])(corner)
-    corner = solid.translate([constants.MOLD_RADIUS, constants.MOLD_BB_Y, constants.MOLD_RADIUS])(corner)
-
-    c1 = corner
-    c2 = solid.translate([constants.MOLD_BB_X-constants.MOLD_RADIUS*2, 0, 0])(c1)
-    c3 = solid.translate([0, 0, constants.MOLD_BB_Z-constants.MOLD_RADIUS*2])(c1)
-    c4 = solid.translate([constants.MOLD_BB_X-constants.MOLD_RADIUS*2, 0, constants.MOLD_BB_Z-constants.MOLD_RADIUS*2])(c1)
-    o = solid.hull()([c1, c2, c3, c4])
-
+    # the edges parallel to y are rounded: build it with z and y swapped
+    o = ggg.rounded_box(constants.MOLD_BB_X, constants.MOLD_BB_Z, constants.MOLD_BB_Y, constants.MOLD_RADIUS, vertical=True, segments=40, tolerance=constants.CHORD_ERROR)
     bb = skirt_mold_bounding_box()
-    o = solid.translate([bb.xmin, bb.ymin, bb.zmin])(o)
-    return o
+    o = o.transform([
+        [1, 0, 0, bb.xmin+constants.MOLD_BB_X/2],
+        [0, 0, 1, bb.ymin+constants.MOLD_BB_Y/2],
+        [0, 1, 0, bb.zmin+constants.MOLD_BB_Z/2],
+    ])
+    return o.solidify()
 
 
 def top_split(split):
@@ -326,9 +423,7 @@ def alignment_pin(x, y, z):
             .extend_arc(alpha=math.pi/2, r=filet_radius)
         path = [euclid3.Point3(x=math.cos(t), y=math.sin(t), z=0) for t in solid.utils.frange(0, 2*math.pi, constants.NSTEPS, include_end=False)]
         shapes = [utils.eu3(profile.points) for i in range(len(path))]
-        o = ggg.extrude(shapes).along_closed_path(path).mesh().solidify()
-        o = solid.hull()(o)
-        return o
+        return ggg.extrude(shapes).along_closed_path(path).mesh().hull().solidify()
 
     male = pin(pin_height, pin_radius)
     female = pin(pin_height+pin_tolerance, pin_radius+pin_tolerance)
@@ -372,9 +467,8 @@ def _split(split, is_bottom):
     return o
 
 
-def skirt_mold():
-    path = utils.ellipsis_path()
-    shapes = [skirt_profile(i, constants.NSTEPS) for i in range(len(path))]
+def _skirt_mold_shapes():
+    shapes = skirt_profiles(len(utils.ellipsis_parameters(reach=shell_reach)))
     top_shapes = []
     bottom_shapes = []
     for shape in shapes:
@@ -387,24 +481,32 @@ def skirt_mold():
 
     bottom_shapes = normalize_shapes(bottom_shapes)
     top_shapes = normalize_shapes(top_shapes)
-    max_skirt_y = max([p.max_y for p in top_shapes])
+    return bottom_shapes, top_shapes
 
-    bottom = bottom_mold(bottom_shapes, max_skirt_y)
+
+def skirt_top_mold():
+    bottom_shapes, top_shapes = _skirt_mold_shapes()
     top = top_mold(top_shapes)
+    return solid.intersection()([top, skirt_mold_bounded()])
+
+
+def skirt_bottom_mold():
+    bottom_shapes, top_shapes = _skirt_mold_shapes()
+    max_skirt_y = max([p.max_y for p in top_shapes])
+    bottom = bottom_mold(bottom_shapes, max_skirt_y)
+    return solid.intersection()([bottom, skirt_mold_bounded()])
 
-    bb = skirt_mold_bounded()
-    top = solid.intersection()([top, bb])
-    bottom = solid.intersection()([bottom, bb])
 
-    return bottom, top
+def skirt_mold():
+    return skirt_bottom_mold(), skirt_top_mold()
 
 
 def normalize_shapes(shapes):
+    # the sweeps need as many points in every shape: split the longest
+    # segments of the short ones rather than repeat their last point,
+    # which makes degenerate faces
     maxlen = max([len(shape) for shape in shapes])
-    for shape in shapes:
-        for i in range(len(shape), maxlen):
-            shape.append(shape[-1])
-    shapes = [mg2.Path(path=shape) for shape in shapes]
+    shapes = [mg2.Path(path=shape).subdivide(maxlen) for shape in shapes]
     return shapes
 
 
@@ -424,7 +526,7 @@ MOLD_OVERLAP = 2
 
 
 def bottom_mold(bottom_shapes, max_skirt_y):
-    path = utils.ellipsis_path()
+    path = utils.ellipsis_path(reach=shell_reach)
 
     epsilon = 0
     output = []
@@ -450,9 +552,9 @@ def bottom_mold(bottom_shapes, max_skirt_y):
     o = o + filler2
 
     split = []
-    for shape in shapes.shapes:
-        max_index = argmax(shape, key=lambda p: (p.x**2+p.y**2, -p.z))
-        split.append(shape[max_index])
+    for shape in shapes.shapes.tolist():
+        max_index = argmax(shape, key=lambda p: (p[0]**2+p[1]**2, -p[2]))
+        split.append(ggg.Point3(*shape[max_index]))
     tmp = bottom_split(split)
 
     return o + tmp
@@ -461,11 +563,11 @@ def bottom_mold(bottom_shapes, max_skirt_y):
 def feeder():
     bb = skirt_mold_bounding_box()
 
-    o = solid.cylinder(h=40, r1=2.75, r2=2, center=True, segments=20)
-    o = solid.translate([-constants.ELLIPSIS_WIDTH-4, 0, 0])(o)
+    o = ggg.cylinder(40, 2.75, 2, center=True, segments=20, tolerance=constants.CHORD_ERROR)
+    o = o.translate([-constants.ELLIPSIS_WIDTH-4, 0, 0]).solidify()
 
-    base = solid.cylinder(h=2, r=7.1, center=True, segments=20)
-    base = solid.translate([-constants.ELLIPSIS_WIDTH-4, 0, bb.zmin])(base)
+    base = ggg.cylinder(2, 7.1, center=True, segments=20, tolerance=constants.CHORD_ERROR)
+    base = base.translate([-constants.ELLIPSIS_WIDTH-4, 0, bb.zmin]).solidify()
 
     return o + base
 
@@ -478,7 +580,7 @@ def top_mold(top_shapes):
         shape.append(x=shape.points[0].x)
         output.append(utils.eu3(shape.reversed_points))
 
-    path = utils.ellipsis_path()
+    path = utils.ellipsis_path(reach=shell_reach)
     shapes = ggg.extrude(output).along_closed_path(path)
 
     o = shapes.mesh().solidify()
@@ -489,9 +591,9 @@ def top_mold(top_shapes):
     o = o + filler
 
     split = []
-    for shape in shapes.shapes:
-        max_index = argmax(shape, key=lambda p: (p.x**2+p.y**2, p.z))
-        split.append(shape[max_index])
+    for shape in shapes.shapes.tolist():
+        max_index = argmax(shape, key=lambda p: (p[0]**2+p[1]**2, p[2]))
+        split.append(ggg.Point3(*shape[max_index]))
     tmp = top_split(split)
 
     return o + tmp - feeder()
@@ -507,6 +609,54 @@ def back_clip():
     return o
 
 
+def goggles():
+    return shell() + skirt()
+
+
+PARTS = collections.OrderedDict([
+    ('goggles', goggles),
+    ('shell', shell),
+    ('skirt', skirt),
+    ('back-clip', back_clip),
+    ('top-mold', skirt_top_mold),
+    ('bottom-mold', skirt_bottom_mold),
+])
+# the parts which --slice-* cuts: the back clip is flat
+SLICED = {'goggles', 'shell', 'skirt', 'top-mold', 'bottom-mold'}
+
+
+def _build_part(name, args, has_slice):
+    if name == 'skirt' and not has_slice:
+        mesh = skirt_mesh()
+        sidecars = utils.render(skirt(mesh), 'skirt', source=__file__)
+        # the skirt is a single swept polyhedron: no need for OpenSCAD
+        mesh.write_stl('skirt.stl')
+        return sidecars
+    o = PARTS[name]()
+    if has_slice:
+        o = o - utils.slice(args)
+    return utils.render(o, name, stl=args.stl, source=__file__)
+
+
+def build_part(name, args):
+    start = time.perf_counter()
+    has_slice = name in SLICED and (args.slice_a is not None or args.slice_x is not None or args.slice_y is not None or args.slice_z is not None)
+    outputs = [name + '.scad']
+    if args.stl or (name == 'skirt' and not has_slice):
+        outputs.append(name + '.stl')
+    extra = [args.slice_a, args.slice_x, args.slice_y, args.slice_z, args.stl, args.validate]
+    config = settings.current()
+    if args.profile:
+        # timing a part copied from the cache would be pointless
+        config = config._replace(cache=False)
+        spans.enable()
+    before = ggg.mesh.stats()
+    with settings.use(config), ggg.mesh.validating(config.validate), spans.span(name, 'part'):
+        cached = buildcache.build(name, extra, outputs, lambda: _build_part(name, args, has_slice))
+    removed = ggg.mesh.stats().get('removed faces', 0) - before.get('removed faces', 0)
+    return time.perf_counter() - start, cached, memo.stats(), removed, spans.drain()
+
+
 def main():
     import argparse
     parser = argparse.ArgumentParser()
@@ -515,35 +665,60 @@ def main():
     parser.add_argument('--slice-y', default=None, type=float)
     parser.add_argument('--slice-z', default=None, type=float)
     parser.add_argument('--slice-a', default=None, type=float)
+    parser.add_argument('--chord-error', default=None, type=float, help='place the vertices to stay within this distance (mm) of the exact surfaces, instead of using the resolution')
+    parser.add_argument('--keyframes', default=None, type=int, help='compute this many exact profiles and interpolate the others')
+    parser.add_argument('--precision', default=10, type=int, help='digits after the decimal point of the polyhedron points in the .scad files (default: %(default)s)')
+    parser.add_argument('--sidecar-stl', default=False, action='store_true', help='write the polyhedra to binary STL files imported by the .scad files, in single precision')
+    parser.add_argument('--no-optimize', default=False, action='store_true', help='write the CSG trees as they are built, without simplifying them')
+    parser.add_argument('--stl', default=False, action='store_true', help='also render STL files in process (needs manifold3d)')
+    parser.add_argument('-j', '--jobs', default=1, type=int, help='build the sweep profiles with this many processes')
+    parser.add_argument('--parts', default=','.join(PARTS), help='comma-separated list of parts to generate among %s' % ', '.join(PARTS))
+    parser.add_argument('--no-cache', default=False, action='store_true', help='do not reuse nor store the parts in the build cache')
+    parser.add_argument('--cache-functions', default=False, action='store_true', help='only rebuild the cached parts whose functions changed, rather than all the parts when a file they load changed: slower builds')
+    parser.add_argument('--validate', default=False, action='store_true', help='check that every mesh is closed and consistently oriented before writing it')
+    parser.add_argument('--profile', default=None, nargs='?', const='profile.json', help='time the parts, sweeps, meshes and SCAD files, and write a Chrome trace to this file (default: %(const)s)')
+    parser.add_argument('--cache-stats', default=False, action='store_true', help='print profile cache hits and misses')
     args = parser.parse_args()
 
-    constants.NSTEPS = args.resolution
-    sh = shell()
-    sk = skirt()
-    l = lens.lens()
-#    l = solid.translate([-0.2, 0, 0.05])(l)
-    lc = lens.lens_clip(constants.LENS_GROOVE_HEIGHT, 3, math.pi/4)
-    bc = back_clip()
-    bottom_mold, top_mold = skirt_mold()
-    #top_mold = solid.translate([0, 0, -0.3])(top_mold)
-
-    assembly = sh + sk
-    if args.slice_a is not None or args.slice_x is not None or args.slice_y is not None or args.slice_z is not None:
-        cut = utils.slice(args)
-        lc = lc - cut
-        sh = sh - cut
-        sk = sk - cut
-        l = l - cut
-        top_mold = top_mold - cut
-        bottom_mold = bottom_mold - cut
-        assembly = assembly - cut
-
-    solid.scad_render_to_file(assembly, 'goggles.scad')
-    solid.scad_render_to_file(sh, 'shell.scad')
-    solid.scad_render_to_file(sk, 'skirt.scad')
-    solid.scad_render_to_file(bc, 'back-clip.scad')
-    solid.scad_render_to_file(top_mold, 'top-mold.scad')
-    solid.scad_render_to_file(bottom_mold, 'bottom-mold.scad')
-
-
-main()
+    parts = [part for part in args.parts.split(',') if part]
+    for part in parts:
+        if part not in PARTS:
+            parser.error('unknown part %s' % part)
+
+    config = settings.Config(
+        nsteps=args.resolution,
+        chord_error=args.chord_error,
+        keyframes=args.keyframes,
+        jobs=args.jobs,
+        scad_precision=args.precision,
+        scad_sidecar=args.sidecar_stl,
+        optimize_csg=not args.no_optimize,
+        validate=args.validate,
+        cache=not args.no_cache,
+        cache_functions=args.cache_functions,
+    )
+    start = time.perf_counter()
+    # the parts are built and written by worker processes which share
+    # the CPUs with their args.jobs profile processes
+    processes = max(1, min(len(parts), (os.cpu_count() or 1) // max(args.jobs, 1)))
+    with settings.use(config):
+        results = sweep.calls(build_part, [(part, args) for part in parts], processes)
+    for part, (elapsed, cached, stats, removed, profile) in zip(parts, results):
+        print('%-12s %7.2fs%s' % (part, elapsed, ' (cached)' if cached else ' (%d faces removed)' % removed))
+    print('%-12s %7.2fs' % ('total', time.perf_counter() - start))
+
+    if args.profile:
+        for result in results:
+            spans.merge(*result[-1])
+        spans.write(args.profile)
+        print(spans.summary())
+
+    if args.cache_stats:
+        stats = collections.Counter()
+        for elapsed, cached, part_stats, removed, profile in results:
+            stats.update(hits=part_stats['hits'], misses=part_stats['misses'], size=part_stats['size'])
+        print('profile cache: %(hits)d hits, %(misses)d misses, %(size)d entries' % stats)
+
+
+if __name__ == '__main__':
+    main()
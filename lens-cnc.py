@@ -7,6 +7,8 @@ import solid.utils
 import ggg
 import utils
 import constants
+import settings
+import spans
 
 MATERIAL_PMMA = 'pmma'
 MATERIAL_PC = 'pc'
@@ -94,6 +96,12 @@ def main():
     parser.add_argument('--slice-y', default=None, type=float)
     parser.add_argument('--slice-z', default=None, type=float)
     parser.add_argument('--slice-a', default=None, type=float)
+    parser.add_argument('--precision', default=10, type=int, help='digits after the decimal point of the polyhedron points in the .scad files (default: %(default)s)')
+    parser.add_argument('--sidecar-stl', default=False, action='store_true', help='write the polyhedra to binary STL files imported by the .scad files, in single precision')
+    parser.add_argument('--no-optimize', default=False, action='store_true', help='write the CSG trees as they are built, without simplifying them')
+    parser.add_argument('--stl', default=False, action='store_true', help='also render STL files in process (needs manifold3d)')
+    parser.add_argument('--profile', default=None, nargs='?', const='profile.json', help='time the sweeps, meshes and SCAD files, and write a Chrome trace to this file (default: %(const)s)')
+    parser.add_argument('--validate', default=False, action='store_true', help='check that every mesh is closed and consistently oriented before writing it')
     parser.add_argument('--myopia-diopters', default=None, type=float)
     parser.add_argument('--astigmatism-diopters', default=None, type=float)
     parser.add_argument('--astigmatism-angle', default=None, type=float)
@@ -102,22 +110,30 @@ def main():
     parser.add_argument('--material', default=MATERIAL_PMMA, choices=[MATERIAL_PMMA, MATERIAL_PC])
     args = parser.parse_args()
 
-    constants.NSTEPS = args.resolution
-    correction = astigmatism_correction(
-        d1=args.myopia_diopters,
-        d2=args.astigmatism_diopters,
-        d2_angle=args.astigmatism_angle,
-        material=args.material,
-        x_offset=args.x_offset,
-        y_offset=args.y_offset
-    )
-    lens = lens_cnc(correction=correction)
-
-    if args.slice_a is not None or args.slice_x is not None or args.slice_y is not None or args.slice_z is not None:
-        cut = utils.slice(args)
-        lens = lens - cut
-    scad_filename = 'lens-cnc' if args.output is None else args.output
-    solid.scad_render_to_file(lens, '%s.scad' % scad_filename)
+    config = settings.Config(nsteps=args.resolution, scad_precision=args.precision, scad_sidecar=args.sidecar_stl, optimize_csg=not args.no_optimize, validate=args.validate)
+    if args.profile:
+        spans.enable()
+    with settings.use(config), ggg.mesh.validating(config.validate):
+        with spans.span('lens-cnc', 'part'):
+            correction = astigmatism_correction(
+                d1=args.myopia_diopters,
+                d2=args.astigmatism_diopters,
+                d2_angle=args.astigmatism_angle,
+                material=args.material,
+                x_offset=args.x_offset,
+                y_offset=args.y_offset
+            )
+            lens = lens_cnc(correction=correction)
+
+        if args.slice_a is not None or args.slice_x is not None or args.slice_y is not None or args.slice_z is not None:
+            cut = utils.slice(args)
+            lens = lens - cut
+        scad_filename = 'lens-cnc' if args.output is None else args.output
+        utils.render(lens, scad_filename, stl=args.stl, source=__file__)
+
+    if args.profile:
+        spans.write(args.profile)
+        print(spans.summary())
 
 
 if __name__ == '__main__':
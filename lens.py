@@ -8,6 +8,8 @@ import utils
 import mg2
 import ggg
 import constants
+import settings
+import spans
 
 
 def lens():
@@ -149,24 +151,41 @@ def main():
     parser.add_argument('--slice-y', default=None, type=float)
     parser.add_argument('--slice-z', default=None, type=float)
     parser.add_argument('--slice-a', default=None, type=float)
+    parser.add_argument('--chord-error', default=None, type=float, help='place the vertices to stay within this distance (mm) of the exact surfaces, instead of using the resolution')
+    parser.add_argument('--precision', default=10, type=int, help='digits after the decimal point of the polyhedron points in the .scad files (default: %(default)s)')
+    parser.add_argument('--sidecar-stl', default=False, action='store_true', help='write the polyhedra to binary STL files imported by the .scad files, in single precision')
+    parser.add_argument('--no-optimize', default=False, action='store_true', help='write the CSG trees as they are built, without simplifying them')
+    parser.add_argument('--stl', default=False, action='store_true', help='also render STL files in process (needs manifold3d)')
+    parser.add_argument('--profile', default=None, nargs='?', const='profile.json', help='time the sweeps, meshes and SCAD files, and write a Chrome trace to this file (default: %(const)s)')
+    parser.add_argument('--validate', default=False, action='store_true', help='check that every mesh is closed and consistently oriented before writing it')
     args = parser.parse_args()
 
-    constants.NSTEPS = args.resolution
-    l = lens()
-    lc = lens_clip(constants.LENS_GROOVE_HEIGHT, 2, math.pi/100)
-
-    assembly = l + lc
-
-    if args.slice_a is not None or args.slice_x is not None or args.slice_y is not None or args.slice_z is not None:
-        cut = utils.slice(args)
-        lc = lc - cut
-        l = l - cut
-        assembly = assembly - cut
-    solid.scad_render_to_file(lc, 'lens-clip.scad')
-    solid.scad_render_to_file(l, 'lens.scad')
-    solid.scad_render_to_file(assembly, 'lens-assembly.scad')
-
-    generate_lens_svg()
+    config = settings.Config(nsteps=args.resolution, chord_error=args.chord_error, scad_precision=args.precision, scad_sidecar=args.sidecar_stl, optimize_csg=not args.no_optimize, validate=args.validate)
+    if args.profile:
+        spans.enable()
+    with settings.use(config), ggg.mesh.validating(config.validate):
+        with spans.span('lens', 'part'):
+            l = lens()
+        with spans.span('lens-clip', 'part'):
+            lc = lens_clip(constants.LENS_GROOVE_HEIGHT, 2, math.pi/100)
+
+        assembly = l + lc
+
+        if args.slice_a is not None or args.slice_x is not None or args.slice_y is not None or args.slice_z is not None:
+            cut = utils.slice(args)
+            lc = lc - cut
+            l = l - cut
+            assembly = assembly - cut
+        utils.render(lc, 'lens-clip', stl=args.stl, source=__file__)
+        utils.render(l, 'lens', stl=args.stl, source=__file__)
+        utils.render(assembly, 'lens-assembly', stl=args.stl, source=__file__)
+
+        with spans.span('lens.svg', 'part'):
+            generate_lens_svg()
+
+    if args.profile:
+        spans.write(args.profile)
+        print(spans.summary())
 
 
 if __name__ == '__main__':
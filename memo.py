@@ -0,0 +1,144 @@
+import collections
+import copy
+import functools
+import threading
+
+import numpy as np
+
+import buildcache
+import settings
+
+
+def _snapshot():
+    return tuple(sorted(settings.values().items()))
+
+
+def _freeze(value):
+    if isinstance(value, np.ndarray):
+        value = value.view()
+        value.flags.writeable = False
+        return value
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if hasattr(value, '__dict__'):
+        # objects such as ggg.Shapes: a copy whose arrays are read-only
+        value = copy.copy(value)
+        for k, v in vars(value).items():
+            if isinstance(v, np.ndarray):
+                setattr(value, k, _freeze(v))
+    return value
+
+
+class Cache:
+    def __init__(self, maxsize=4096):
+        self._maxsize = maxsize
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, compute):
+        # a value computed outside of a build cache recording does not
+        # know what it depends on
+        recording = buildcache.recording()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[1] is not None or not recording):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                value, dependencies = entry
+                if dependencies is not None:
+                    buildcache.replay(dependencies)
+                return value
+            self.misses += 1
+        if recording:
+            with buildcache.record() as dependencies:
+                value = _freeze(compute())
+        else:
+            value, dependencies = _freeze(compute()), None
+        with self._lock:
+            self._entries[key] = (value, dependencies)
+            while len(self._entries) > self._maxsize:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries), 'maxsize': self._maxsize}
+
+
+_cache = Cache()
+
+
+def memoize(f):
+    # The result is shared between callers so it must not be mutated:
+    # arrays, and the arrays of objects, are returned read-only and
+    # lists become tuples.
+    @functools.wraps(f)
+    def wrapper(*args):
+        key = (f.__module__, f.__qualname__, args, _snapshot())
+        return _cache.get(key, lambda: f(*args))
+    return wrapper
+
+
+def stats():
+    return _cache.stats()
+
+
+def clear():
+    _cache.clear()
+
+
+import unittest
+
+
+class CacheTestCase(unittest.TestCase):
+    def test_lru(self):
+        cache = Cache(maxsize=2)
+        calls = []
+
+        def compute(key):
+            calls.append(key)
+            return key
+        for key in ['a', 'b', 'a', 'c', 'a', 'b']:
+            self.assertEqual(cache.get(key, lambda: compute(key)), key)
+        # a was used after b, so b went first when c came in
+        self.assertEqual(calls, ['a', 'b', 'c', 'b'])
+        self.assertEqual(cache.stats(), {'hits': 2, 'misses': 4, 'size': 2, 'maxsize': 2})
+        cache.clear()
+        self.assertEqual(cache.stats(), {'hits': 0, 'misses': 0, 'size': 0, 'maxsize': 2})
+
+    def test_settings(self):
+        # the constants are part of the key
+        import constants
+
+        @memoize
+        def f(x):
+            return x * constants.NSTEPS
+        before = stats()
+        self.assertEqual(f(2), 2 * constants.NSTEPS)
+        with settings.use(settings.Config(nsteps=constants.NSTEPS+1)):
+            self.assertEqual(f(2), 2 * constants.NSTEPS)
+        self.assertEqual(f(2), 2 * constants.NSTEPS)
+        after = stats()
+        self.assertEqual((after['hits'] - before['hits'], after['misses'] - before['misses']), (1, 2))
+
+    def test_frozen(self):
+        import ggg
+
+        @memoize
+        def f():
+            return [np.zeros(3), [np.ones(2)], ggg.Shapes(np.zeros((2, 3, 3)), ggg.Shapes.ENDS_CLOSE), 1.5]
+        array, arrays, shapes, number = f()
+        self.assertIs(f()[2], shapes)
+        self.assertIsInstance(arrays, tuple)
+        for value in [array, arrays[0], shapes.shapes]:
+            with self.assertRaises(ValueError):
+                value[0] = 1
+        self.assertEqual(number, 1.5)
@@ -1,16 +1,23 @@
 import math
 
 import numpy as np
-import scipy.interpolate as si
 import euclid3
 import shapely
 
 Point = euclid3.Point2
 
 
+def _as_array(path):
+    if isinstance(path, (Path, _Points)):
+        return path._p.copy()
+    if isinstance(path, np.ndarray):
+        return np.array(path, dtype=np.float64).reshape(-1, 2)
+    return np.array([(p.x, p.y) for p in path], dtype=np.float64).reshape(-1, 2)
+
+
 def _translate(xd, yd):
     def inner(path):
-        return [Point(x=p.x+xd, y=p.y+yd) for p in path]
+        return path + (xd, yd)
     return inner
 
 
@@ -18,7 +25,8 @@ def _rotate(alpha):
     def inner(path):
         c = math.cos(alpha)
         s = math.sin(alpha)
-        return [Point(x=c*p.x-s*p.y, y=s*p.x+c*p.y) for p in path]
+        x, y = path[:, 0], path[:, 1]
+        return np.column_stack((c*x-s*y, s*x+c*y))
     return inner
 
 
@@ -31,17 +39,19 @@ def norm2(v):
     return math.sqrt(v.x**2+v.y**2)
 
 
-def perpendicular(v, left, normalize=False):
-    import numpy
+def _perpendicular(v, left, normalize=False):
     s = -1 if left else 1
-    z = (0, 0, s)
-    retval = numpy.cross(v, z)
-    retval = Point(retval[0], retval[1])
+    retval = np.array((v[1]*s, -v[0]*s), dtype=np.float64)
     if normalize:
-        retval = retval / norm2(retval)
+        retval = retval / math.sqrt(retval[0]**2+retval[1]**2)
     return retval
 
 
+def perpendicular(v, left, normalize=False):
+    retval = _perpendicular((v.x, v.y), left, normalize=normalize)
+    return Point(float(retval[0]), float(retval[1]))
+
+
 def _thicker_path(path, thickness=0.05, left=True):
     n = len(path)
     tangents = \
@@ -53,68 +63,280 @@ def _thicker_path(path, thickness=0.05, left=True):
     return shifted
 
 
+def _thicker_paths(paths, thickness=0.05, left=True):
+    # offset all the paths in one shapely call and match every input
+    # vertex with its nearest offset vertex through a single KD-tree.
+    # The path index is stored as a third coordinate, spaced further
+    # apart than any two vertices can be, so that the nearest candidates
+    # come from the same path first.
+    import scipy.spatial
+    lines = shapely.linestrings(np.concatenate(paths), indices=np.repeat(np.arange(len(paths)), [len(p) for p in paths]))
+    # quad_segs=16 is the default of LineString.offset_curve, which the
+    # one-path version used: shapely.offset_curve defaults to 8
+    offsets = shapely.offset_curve(lines, thickness if left else -thickness, quad_segs=16)
+    coords, index = shapely.get_coordinates(offsets, return_index=True)
+    inputs = np.concatenate(paths)
+    lower = np.minimum(inputs.min(axis=0), coords.min(axis=0))
+    upper = np.maximum(inputs.max(axis=0), coords.max(axis=0))
+    spacing = 2*float(np.max(upper-lower))+1
+    tree = scipy.spatial.cKDTree(np.column_stack((coords, index*spacing)))
+    query_index = np.repeat(np.arange(len(paths)), [len(p) for p in paths])
+    # among the few nearest candidates, keep the first one along the
+    # offset curve: round joins often put two vertices at exactly the
+    # offset distance.
+    _, candidates = tree.query(np.column_stack((inputs, query_index*spacing)), k=min(8, len(coords)))
+    candidates = np.sort(candidates.reshape(len(inputs), -1), axis=1)
+    # the tree returns len(coords) for the missing neighbors, and the
+    # offsets of paths with fewer than k vertices leave room for the
+    # ones of other paths: both never match
+    valid = candidates < len(coords)
+    candidates = np.minimum(candidates, len(coords)-1)
+    valid &= index[candidates] == query_index[:, np.newaxis]
+    d = coords[candidates] - inputs[:, np.newaxis, :]
+    dist = np.where(valid, np.sqrt(d[..., 0]**2+d[..., 1]**2), np.inf)
+    best = np.argmin(dist, axis=1)
+    selected = coords[candidates[np.arange(len(inputs)), best]]
+    # the vertices of a round join are all at the offset distance of its
+    # corner, give or take an ulp, and there can be more of them than
+    # candidates: pick the one the one-path version picked, with the
+    # rounding of norm2(), among all the vertices of the offset
+    ties = np.count_nonzero(dist - dist[np.arange(len(inputs)), best][:, np.newaxis] < 1e-9, axis=1) > 1
+    starts = np.searchsorted(index, np.arange(len(paths)+1))
+    for i in np.nonzero(ties)[0]:
+        offset = coords[starts[query_index[i]]:starts[query_index[i]+1]]
+        x, y = inputs[i]
+        selected[i] = offset[_argmin([math.sqrt((ox-x)**2+(oy-y)**2) for ox, oy in offset.tolist()])]
+    return np.split(selected, np.cumsum([len(p) for p in paths])[:-1])
+
+
 def _thicker_path2(path, thickness=0.05, left=True):
-    line = shapely.LineString([(p.x, p.y) for p in path])
-    offset = line.offset_curve(thickness if left else -thickness)
+    return _thicker_paths([path], thickness=thickness, left=left)[0]
+
+
+def offset_paths(paths, offset, left):
+    shifted = _thicker_paths([_as_array(p) for p in paths], thickness=offset, left=left)
+    return [Path(path=p) for p in shifted]
+
+
+def splinify_paths(paths, n=20):
+    # Path.splinify() on each of paths, one matrix product for all the
+    # paths with the same number of control points
+    arrays = [_as_array(p) for p in paths]
+    splines = [None] * len(arrays)
+    for count in set(len(a) for a in arrays):
+        indices = [i for i, a in enumerate(arrays) if len(a) == count]
+        for i, spline in zip(indices, _bezier_spline(np.stack([arrays[i] for i in indices]), n=n)):
+            splines[i] = spline
+    return [Path(path=p) for p in splines]
+
+
+def _levels(levels, n):
+    # one entry per path: None, a level or a list of levels. Returns an
+    # (n, m) array of sorted levels, padded with nan which never cuts.
+    levels = [None] * n if levels is None else levels
+    assert len(levels) == n
+    levels = [np.sort(np.atleast_1d(np.asarray([] if l is None else l, dtype=np.float64))) for l in levels]
+    retval = np.full((n, max([len(l) for l in levels] + [0])), np.nan)
+    for i, l in enumerate(levels):
+        retval[i, :len(l)] = l
+    return retval
+
+
+def cut_paths(paths, x=None, y=None):
+    # Path.cut_ranges() on each of paths, in one pass over all their
+    # segments: x and y hold the levels of each path.
+    arrays = [_as_array(p) for p in paths]
+    sizes = np.array([len(a) for a in arrays])
+    p = np.concatenate(arrays)
+    owner = np.repeat(np.arange(len(arrays)), sizes)
+    p0, p1 = p[:-1], p[1:]
+    valid = owner[:-1] == owner[1:]
+    segments, keys, points, positions = [], [], [], []
+    for axis, levels in enumerate([x, y]):
+        levels = _levels(levels, len(arrays))[owner[:-1]]
+        a0, a1 = p0[:, axis:axis+1], p1[:, axis:axis+1]
+        # only where the path goes up through the level
+        with np.errstate(invalid='ignore'):
+            segment, level = np.nonzero(valid[:, np.newaxis] & (levels >= a0) & (levels < a1))
+        c = levels[segment, level]
+        x0, y0 = p0[segment, 0], p0[segment, 1]
+        x1, y1 = p1[segment, 0], p1[segment, 1]
+        if axis == 0:
+            t = (c-x0)/(x1-x0)
+            points.append(np.column_stack((c, y0+(y1-y0)/(x1-x0)*(c-x0))))
+        else:
+            t = (c-y0)/(y1-y0)
+            points.append(np.column_stack((x0+(x1-x0)/(y1-y0)*(c-y0), c)))
+        segments.append(segment)
+        positions.append(t)
+        keys.append(axis*(levels.shape[1]+1) + level)
+    segment, key, point = np.concatenate(segments), np.concatenate(keys), np.concatenate(points)
+    # along each segment, in the order the path crosses the levels
+    order = np.lexsort((key, np.concatenate(positions), segment))
+    segment, point = segment[order], point[order]
+    # an intersection on the last vertex does not duplicate it
+    first = np.concatenate(([True], segment[1:] != segment[:-1]))
+    previous = np.where(first[:, np.newaxis], p0[segment], np.roll(point, 1, axis=0))
+    new = np.any(point != previous, axis=1)
+    inserted = np.concatenate(([0], np.cumsum(np.bincount(segment[new], minlength=len(p)))))
+    # the index of each intersection among the vertices of the output
+    splits = segment + np.cumsum(new)
+    merged = np.insert(p, segment[new]+1, point[new], axis=0)
+    starts = np.concatenate(([0], np.cumsum(sizes)))
     retval = []
-    # this is a bad n^2 algorithm but it works
-    for i in path:
-        k = _argmin([norm2(Point(x=j[0], y=j[1]) - i) for j in offset.coords])
-        selected = offset.coords[k]
-        retval.append(Point(x=selected[0], y=selected[1]))
+    for i in range(len(arrays)):
+        start, end = starts[i] + inserted[starts[i]], starts[i+1] + inserted[starts[i+1]]
+        cuts = (splits[owner[segment] == i] - start).tolist()
+        retval.append((merged[start:end], list(zip([0] + cuts, [c+1 for c in cuts] + [end-start]))))
     return retval
 
 
+def _resample(arrays, k):
+    # (len(arrays), k, 2) points evenly spaced along each path
+    n = max(len(a) for a in arrays)
+    assert min(len(a) for a in arrays) >= 2
+    # padding with zero length segments does not change the sums
+    p = np.stack([np.concatenate((a, np.repeat(a[-1:], n-len(a), axis=0))) for a in arrays])
+    d = p[:, 1:] - p[:, :-1]
+    lengths = np.sqrt(d[..., 0]**2+d[..., 1]**2)
+    arc_length = np.cumsum(lengths, axis=1)[:, -1:] / k
+    d_t = lengths / arc_length
+    t = np.concatenate((np.zeros((len(p), 1)), np.cumsum(d_t, axis=1)), axis=1)
+    j = np.arange(1, k, dtype=np.float64)
+    # the segment where the cumulative arc length reaches each point
+    i = np.minimum(np.count_nonzero(t[:, np.newaxis, 1:] < j[np.newaxis, :, np.newaxis], axis=2), n-2)
+    rows = np.arange(len(p))[:, np.newaxis]
+    alpha = ((j - t[rows, i]) / d_t[rows, i])[..., np.newaxis]
+    points = (1-alpha) * p[rows, i] + alpha * p[rows, i+1]
+    return np.concatenate((p[:, :1], points), axis=1)
+
+
+def resample_paths(paths, k):
+    return [Path(path=p) for p in _resample([_as_array(p) for p in paths], k)]
+
+
+def _curvature(p):
+    # length and mean curvature of each segment of a polyline: the
+    # turning angle at each vertex is spread over the half segments
+    # around it
+    d = p[1:] - p[:-1]
+    lengths = np.sqrt(d[:, 0]**2+d[:, 1]**2)
+    angles = np.arctan2(d[:, 1], d[:, 0])
+    turns = np.abs(np.angle(np.exp(1j*(angles[1:]-angles[:-1]))))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        vertices = np.nan_to_num(turns / ((lengths[1:]+lengths[:-1])/2))
+    vertices = np.concatenate((vertices[:1], vertices, vertices[-1:])) if len(vertices) else np.zeros(2)
+    return lengths, (vertices[1:]+vertices[:-1])/2
+
+
+_bases = {}
+
+
+def _basis(count, degree, n):
+    # (n, count) matrix of the clamped uniform B-spline basis functions
+    # at n evenly spaced parameters: the splines of a given shape only
+    # differ by their control points, so evaluating one is a single
+    # matrix product. The Cox-de Boor recurrence below is the one of
+    # FITPACK's splev(), to get the exact same vertices.
+    key = (count, degree, n)
+    if key not in _bases:
+        t = np.array([0]*degree + list(range(count-degree+1)) + [count-degree]*degree, dtype=np.float64)
+        u = np.linspace(0, count-degree, n)
+        # knot span of each parameter, the last one is closed
+        span = np.clip(np.searchsorted(t, u, side='right') - 1, degree, count-1)
+        h = np.zeros((n, degree+1))
+        h[:, 0] = 1
+        for j in range(1, degree+1):
+            previous = h[:, :j].copy()
+            h[:, 0] = 0
+            for i in range(j):
+                right = t[span+i+1]
+                left = t[span+i+1-j]
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    f = np.where(right == left, 0, previous[:, i]/(right-left))
+                h[:, i] += f*(right-u)
+                h[:, i+1] = f*(u-left)
+        b = np.zeros((n, count))
+        for j in range(degree+1):
+            b[np.arange(n), span-degree+j] = h[:, j]
+        b.setflags(write=False)
+        _bases[key] = b
+    return _bases[key]
+
+
 def _bezier_spline(cv, max_y=None, n=100, degree=3):
-    cv = np.asarray([[p.x, p.y] for p in cv])
-    count = cv.shape[0]
-    degree = np.clip(degree, 1, count-1)
-    kv = np.array([0]*degree + list(range(count-degree+1)) + [count-degree]*degree, dtype='int')
-    u = np.linspace(0, (count-degree), n)
-    path = [Point(x=p[0], y=p[1]) for p in np.array(si.splev(u, (kv, cv.T, degree))).T]
-    return path
+    cv = np.asarray(cv, dtype=np.float64)
+    count = cv.shape[-2]
+    degree = int(np.clip(degree, 1, count-1))
+    # cv can also be a stack of control polygons. einsum() adds the
+    # terms up in order, unlike matmul().
+    return np.ascontiguousarray(np.einsum('ij,...jk->...ik', _basis(count, degree, n), cv))
 
 
 class _Points:
     def __init__(self, path):
         self._p = path
 
+    @property
+    def array(self):
+        view = self._p.view()
+        view.flags.writeable = False
+        return view
+
     @property
     def first(self):
-        return self._p[0]
+        return self[0]
 
     @property
     def last(self):
-        return self._p[-1]
+        return self[-1]
 
     def __iter__(self):
-        for i in self._p:
-            yield i
+        for x, y in self._p.tolist():
+            yield Point(x, y)
 
     def __len__(self):
         return len(self._p)
 
     def __getitem__(self, key):
-        return self._p[key]
+        if isinstance(key, slice):
+            return [Point(x, y) for x, y in self._p[key].tolist()]
+        x, y = self._p[key].tolist()
+        return Point(x, y)
 
 
 class Path:
     def __init__(self, x=None, y=None, path=None, point=None):
         if point is not None:
             assert hasattr(point, 'x') and hasattr(point, 'y')
-            point = Point(x=point.x, y=point.y)
-            self._p = [point]
+            p = np.array([[point.x, point.y]], dtype=np.float64)
         elif path is not None:
-            if isinstance(path, Path):
-                self._p = [p for p in path._p]
-            else:
-                self._p = [p for p in path]
+            p = _as_array(path)
         else:
             assert not isinstance(x, list)
             assert not isinstance(y, list)
             x = 0 if x is None else x
             y = 0 if y is None else y
-            self._p = [Point(x, y)]
+            p = np.array([[x, y]], dtype=np.float64)
+        self._set(p)
+
+    def _set(self, p):
+        self._p = p
+        self._bounds = None
+
+    @property
+    def _bbox(self):
+        if self._bounds is None:
+            lower = self._p.min(axis=0).tolist()
+            upper = self._p.max(axis=0).tolist()
+            self._bounds = (lower[0], upper[0], lower[1], upper[1])
+        return self._bounds
+
+    @property
+    def array(self):
+        view = self._p.view()
+        view.flags.writeable = False
+        return view
 
     @property
     def points(self):
@@ -122,27 +344,23 @@ class Path:
 
     @property
     def reversed_points(self):
-        return _Points(path=list(reversed(self._p)))
+        return _Points(path=self._p[::-1])
 
     @property
     def min_x(self):
-        min_x = min(p.x for p in self._p)
-        return min_x
+        return self._bbox[0]
 
     @property
     def max_x(self):
-        max_x = max(p.x for p in self._p)
-        return max_x
+        return self._bbox[1]
 
     @property
     def min_y(self):
-        min_y = min(p.y for p in self._p)
-        return min_y
+        return self._bbox[2]
 
     @property
     def max_y(self):
-        max_y = max(p.y for p in self._p)
-        return max_y
+        return self._bbox[3]
 
     @property
     def height(self):
@@ -150,20 +368,15 @@ class Path:
 
     @property
     def width(self):
-        max_x = max(p.x for p in self._p)
-        min_x = min(p.x for p in self._p)
-        return abs(max_x-min_x)
+        return abs(self.max_x-self.min_x)
 
     def copy(self):
-        return Path(path=self._p)
+        return Path(path=self)
 
     def extend(self, path):
-        if isinstance(path, Path):
-            p = path._p
-        else:
-            p = path
+        p = path._p if isinstance(path, Path) else _as_array(path)
         last = self._p[-1]
-        self._p.extend(_translate(last.x-p[0].x, last.y-p[0].y)(p))
+        self._set(np.concatenate((self._p, _translate(last[0]-p[0, 0], last[1]-p[0, 1])(p))))
         return self
 
     def append(self, dx=None, dy=None, x=None, y=None, point=None):
@@ -172,24 +385,25 @@ class Path:
         assert point is not None or not (dx is None and dy is None and x is None and y is None)
         assert len(self._p) > 0
         if point is not None:
-            self._p.append(point)
+            x, y = point.x, point.y
         else:
-            last = self._p[-1]
+            last_x, last_y = self._p[-1].tolist()
             if dx is not None:
-                x = last.x + dx
+                x = last_x + dx
             elif x is None:
-                x = last.x
+                x = last_x
             if dy is not None:
-                y = last.y + dy
+                y = last_y + dy
             elif y is None:
-                y = last.y
-            self._p.append(Point(x, y))
+                y = last_y
+        self._set(np.concatenate((self._p, [(x, y)])))
         return self
 
     def normal(self, left=True):
         assert len(self._p) >= 2
         reference = self._p[-1] - self._p[-2]
-        return perpendicular(reference, left=left, normalize=True)
+        retval = _perpendicular(reference, left=left, normalize=True)
+        return Point(float(retval[0]), float(retval[1]))
 
     def extend_arc(self, alpha, r, n=10, reference=None):
         if reference is None:
@@ -197,79 +411,99 @@ class Path:
             reference = self._p[-1] - self._p[-2]
         else:
             assert len(self._p) >= 1
-        center = self._p[-1] + r * perpendicular(reference, left=alpha > 0, normalize=True)
+            reference = (reference.x, reference.y)
+        center = self._p[-1] + r * _perpendicular(reference, left=alpha > 0, normalize=True)
         start = self._p[-1] - center
-        arc = []
-        for i in range(n):
-            beta = alpha/n * (i+1)
-            arc.append(center + _rotate(beta)([start])[0])
-        for p in arc:
-            self.append(point=p)
+        beta = alpha/n * np.arange(1, n+1)
+        c = np.cos(beta)
+        s = np.sin(beta)
+        arc = center + np.column_stack((c*start[0]-s*start[1], s*start[0]+c*start[1]))
+        self._set(np.concatenate((self._p, arc)))
         return self
 
     def append_angle(self, alpha, delta, relative_to=None):
-        i = -1
-        v = self._p[i] - self._p[i-1]
-        v = Point(x=math.cos(alpha)*v.x - math.sin(alpha)*v.y, y=math.sin(alpha)*v.x + math.cos(alpha)*v.y)
-        v = v / norm2(v) * delta
-        self.append(dx=v.x, dy=v.y, relative_to=relative_to)
+        v = self._p[-1] - self._p[-2]
+        v = np.array((math.cos(alpha)*v[0] - math.sin(alpha)*v[1], math.sin(alpha)*v[0] + math.cos(alpha)*v[1]))
+        v = v / math.sqrt(v[0]**2+v[1]**2) * delta
+        self.append(dx=v[0], dy=v[1], relative_to=relative_to)
         return self
 
     def reverse(self):
-        self._p = list(reversed(self._p))
+        self._set(self._p[::-1].copy())
         return self
 
     def splinify(self, n=20):
-        spline = _bezier_spline(self._p, n=n)
-        self._p = spline
+        self._set(_bezier_spline(self._p, n=n))
         return self
 
     def resample(self, k):
+        # k points evenly spaced along the path, without the last one
+        self._set(_resample([self._p], k)[0])
+        return self
+
+    def subdivide(self, k):
+        # split the longest segments until the path has k points: unlike
+        # resample(), the shape and the existing points do not change
+        p = self._p
+        if len(p) >= k:
+            return self
+        d = p[1:] - p[:-1]
+        lengths = np.sqrt(d[:, 0]**2+d[:, 1]**2)
+        assert np.sum(lengths) > 0
+        share = lengths / np.sum(lengths) * (k - len(p))
+        counts = np.floor(share).astype(int)
+        counts[np.argsort(counts - share, kind='stable')[:k - len(p) - np.sum(counts)]] += 1
+        parts = counts + 1
+        segment = np.repeat(np.arange(len(d)), parts)
+        t = (np.arange(len(segment)) - np.repeat(np.cumsum(parts) - parts, parts)) / parts[segment]
+        self._set(np.concatenate((p[segment] + t[:, np.newaxis] * d[segment], p[-1:])))
+        return self
+
+    def chord_samples(self, error):
+        # number of segments needed to stay within error of this path:
+        # a chord of length l on a curve of curvature k deviates from it
+        # by l**2*k/8
+        lengths, curvature = _curvature(self._p)
+        return max(1, int(math.ceil(np.sum(np.sqrt(curvature/(8*error))*lengths))))
+
+    def resample_adaptive(self, k, uniform=0.25):
+        # same as resample() but with more points where the curvature
+        # is higher: uniform is the share of the points spread evenly
         assert len(self._p) >= 2
-        edges = [(self._p[i], self._p[i+1]) for i in range(len(self._p)-1)]
-        arc_length = sum(abs(q-p) for p, q in edges) / k
-        result = [self._p[0]]
-        t = 0
-        for p, q in edges:
-            d_t = abs(p-q) / arc_length
-            while t + d_t >= len(result) < k:
-                alpha = (len(result) - t) / d_t
-                v = (1-alpha) * p + alpha * q
-                result.append(v)
-            t += d_t
-        self._p = result
+        lengths, curvature = _curvature(self._p)
+        weights = lengths / np.sum(lengths)
+        bends = np.sqrt(curvature) * lengths
+        if np.sum(bends) > 0:
+            weights = uniform * weights + (1-uniform) * bends / np.sum(bends)
+        measure = np.concatenate(([0], np.cumsum(weights)))
+        keep = np.concatenate(([True], np.diff(measure) > 0))
+        positions = np.interp(np.arange(k) / k, measure[keep], np.arange(len(self._p))[keep])
+        i = np.minimum(np.floor(positions).astype(int), len(self._p)-2)
+        alpha = (positions - i)[:, np.newaxis]
+        self._set((1-alpha) * self._p[i] + alpha * self._p[i+1])
         return self
-    
+
     def translate(self, dx=0, dy=0):
-        self._p = _translate(dx, dy)(self._p)
+        self._set(_translate(dx, dy)(self._p))
         return self
 
     def rotate(self, alpha=0):
-        self._p = _rotate(alpha)(self._p)
+        self._set(_rotate(alpha)(self._p))
         return self
 
     def offset(self, offset, left):
-        self._p = _thicker_path2(self._p, thickness=offset, left=left)
+        self._set(_thicker_path2(self._p, thickness=offset, left=left))
         return self
 
+    def cut_ranges(self, x=None, y=None):
+        # Split the path where it goes up through any of the x or y
+        # levels: returns the path with the intersections inserted, and
+        # the [start, end) ranges of the pieces, which share their ends.
+        return cut_paths([self], x=[x], y=[y])[0]
+
     def cut(self, x=None, y=None):
-        output = []
-        current = Path(x=self._p[0].x, y=self._p[0].y)
-        output.append(current)
-        for i in range(len(self._p)-1):
-            segment = self._p[i:i+2]
-            intersections = []
-            if x is not None and x >= segment[0].x and x < segment[1].x:
-                intersections.append(Point(x=x, y=segment[0].y+(segment[1].y-segment[0].y)/(segment[1].x-segment[0].x)*(x-segment[0].x)))
-            if y is not None and y >= segment[0].y and y < segment[1].y:
-                intersections.append(Point(x=segment[0].x+(segment[1].x-segment[0].x)/(segment[1].y-segment[0].y)*(y-segment[0].y), y=y))
-            for intersection in intersections:
-                if current.points.last.x != intersection.x or current.points.last.y != intersection.y:
-                    current.append(x=intersection.x, y=intersection.y)
-                current = Path(x=intersection.x, y=intersection.y)
-                output.append(current)
-            current.append(x=segment[1].x, y=segment[1].y)
-        return output
+        points, ranges = self.cut_ranges(x=x, y=y)
+        return [Path(path=points[start:end]) for start, end in ranges]
 
 import unittest
 
@@ -377,5 +611,139 @@ class CutTestCase(unittest.TestCase):
         )
 
 
+
+class CutRangesTestCase(unittest.TestCase):
+    def test_levels(self):
+        points, ranges = Path(x=0, y=0).append(x=4, y=0).append(x=4, y=4).cut_ranges(x=[3, 1], y=2)
+        self.assertEqual(points.tolist(), [[0, 0], [1, 0], [3, 0], [4, 0], [4, 2], [4, 4]])
+        self.assertEqual(ranges, [(0, 2), (1, 3), (2, 5), (4, 6)])
+
+    def test_batch(self):
+        paths = [Path(x=0, y=0).append(x=2, y=i) for i in range(1, 4)]
+        got = cut_paths(paths, y=[0.5, None, [1, 2]])
+        expected = [path.cut_ranges(y=y) for path, y in zip(paths, [0.5, None, [1, 2]])]
+        for (points, ranges), (expected_points, expected_ranges) in zip(got, expected):
+            np.testing.assert_array_equal(points, expected_points)
+            self.assertEqual(ranges, expected_ranges)
+        self.assertEqual(len(got[2][1]), 3)
+
+    def test_mixed_levels(self):
+        # the segment crosses y = 1 before x = 3
+        points, ranges = Path(x=0, y=0).append(x=4, y=4).cut_ranges(x=3, y=1)
+        self.assertEqual(points.tolist(), [[0, 0], [1, 1], [3, 3], [4, 4]])
+        self.assertEqual(ranges, [(0, 2), (1, 3), (2, 4)])
+        points, ranges = Path(x=0, y=0).append(x=4, y=2).cut_ranges(x=[1, 3], y=1)
+        self.assertEqual(points.tolist(), [[0, 0], [1, 0.5], [2, 1], [3, 1.5], [4, 2]])
+        self.assertEqual(ranges, [(0, 2), (1, 3), (2, 4), (3, 5)])
+
+class ArrayTestCase(unittest.TestCase):
+    def test_read_only(self):
+        path = Path(x=0, y=0).append(x=2, y=1)
+        self.assertEqual(path.max_x, 2)
+        for array in [path.array, path.points.array, path.reversed_points.array]:
+            with self.assertRaises(ValueError):
+                array[0, 0] = 5
+        self.assertEqual(path.max_x, 2)
+        self.assertEqual(path.points.first, Point(0, 0))
+
+
+class OffsetTestCase(unittest.TestCase):
+    def _path(self, alpha):
+        return Path(x=0, y=0)\
+            .append(dx=3, dy=alpha)\
+            .append(dx=1, dy=6)\
+            .splinify(n=30)
+
+    def _brute_force(self, path, offset, left):
+        # the original O(n^2) matching, with the same offset curve
+        line = shapely.LineString(path.array)
+        coords = line.offset_curve(offset if left else -offset, quad_segs=16).coords
+        return [coords[_argmin([norm2(Point(x=x, y=y) - p) for x, y in coords])] for p in path.points]
+
+    def test_nearest(self):
+        for left in [True, False]:
+            path = self._path(0.5)
+            got = path.copy().offset(1.2, left=left)
+            np.testing.assert_array_equal(got.array, self._brute_force(path, 1.2, left))
+
+    def test_round_join(self):
+        # the vertices of the round joins around the corners are all at
+        # the offset distance of the corner, within an ulp or two
+        path = Path(x=0, y=0).append(dx=2.85, dy=1.86).append(dx=1.96, dy=2.25).append(dx=3.83, dy=1.89).append(dx=3.14, dy=-0.42)
+        for left in [True, False]:
+            got = path.copy().offset(1.2, left=left)
+            np.testing.assert_array_equal(got.array, self._brute_force(path, 1.2, left))
+
+    def test_batch(self):
+        paths = [self._path(alpha) for alpha in [0.1, 0.5, 2]]
+        got = offset_paths(paths, 1, left=False)
+        for path, offset in zip(paths, got):
+            np.testing.assert_array_equal(offset.array, path.copy().offset(1, left=False).array)
+
+    def test_batch_short(self):
+        # the offset of the second path goes through the vertices of the
+        # first one, whose offset has fewer vertices than the candidates
+        paths = [Path(x=0, y=0).append(x=1), Path(x=0, y=-0.5).append(x=1)]
+        got = offset_paths(paths, 0.5, left=True)
+        np.testing.assert_array_equal(got[0].array, [(0, 0.5), (1, 0.5)])
+        np.testing.assert_array_equal(got[1].array, [(0, 0), (1, 0)])
+
+
+class ResampleTestCase(unittest.TestCase):
+    def _arc(self, r):
+        t = np.linspace(0, math.pi/2, 500)
+        return Path(path=np.column_stack((r*np.cos(t), r*np.sin(t))))
+
+    def test_chord_samples(self):
+        # a quarter circle needs pi/2/(2*acos(1-error/r)) chords
+        for r in [1, 10]:
+            expected = math.pi/2/(2*math.acos(1-0.01/r))
+            self.assertEqual(self._arc(r).chord_samples(0.01), math.ceil(expected))
+
+    def test_adaptive(self):
+        # a long straight line followed by a small quarter circle
+        path = Path(x=-10, y=0).append(x=0).extend(self._arc(1).rotate(-math.pi/2).translate(dy=1))
+        got = path.copy().resample_adaptive(20)
+        self.assertEqual(len(got.points), 20)
+        np.testing.assert_array_equal(got.array[0], path.array[0])
+        # more points on the small arc than on the long straight line
+        self.assertGreater(np.count_nonzero(got.array[:, 1] > 0), 5)
+
+    def test_batch(self):
+        paths = [Path(x=0, y=0).append(dx=10), Path(x=0, y=0).append(dx=1).append(dy=1).append(dx=-1)]
+        got = resample_paths(paths, 4)
+        np.testing.assert_allclose(got[0].array, [(0, 0), (2.5, 0), (5, 0), (7.5, 0)])
+        np.testing.assert_allclose(got[1].array, [(0, 0), (0.75, 0), (1, 0.5), (0.75, 1)])
+
+    def test_subdivide(self):
+        path = Path(x=0, y=0).append(dx=3).append(dy=1)
+        got = path.copy().subdivide(6)
+        np.testing.assert_allclose(got.array, [(0, 0), (1, 0), (2, 0), (3, 0), (3, 0.5), (3, 1)])
+        self.assertEqual(len(path.copy().subdivide(2).points), 3)
+
+    def test_uniform(self):
+        path = Path(x=0, y=0).append(dx=10)
+        np.testing.assert_allclose(path.copy().resample_adaptive(5).array, path.copy().resample(5).array)
+
+
+
+class SplineTestCase(unittest.TestCase):
+    def test_ends(self):
+        # clamped splines start and end on their first and last control points
+        cv = np.array([(0, 0), (1, 2), (3, 2), (4, 0)], dtype=np.float64)
+        for degree in [1, 2, 3]:
+            got = _bezier_spline(cv, n=7, degree=degree)
+            np.testing.assert_allclose(got[[0, -1]], cv[[0, -1]])
+        # straight control polygons give evenly spaced points
+        line = _bezier_spline([(0, 0), (1, 0), (2, 0), (3, 0)], n=4)
+        np.testing.assert_allclose(line, [(0, 0), (1, 0), (2, 0), (3, 0)], atol=1e-12)
+
+    def test_batch(self):
+        paths = [Path(x=0, y=0).append(dx=1, dy=i).append(dx=1).append(dx=1, dy=-i) for i in range(3)]
+        paths.append(Path(x=0, y=0).append(dx=1, dy=1).append(dx=1))
+        got = splinify_paths(paths, n=10)
+        for path, spline in zip(paths, got):
+            np.testing.assert_array_equal(spline.array, path.copy().splinify(n=10).array)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,135 @@
+import collections
+import functools
+import importlib
+import math
+
+import constants
+import ggg
+import ggg.boolean
+import goggles
+import lens
+import settings
+
+
+def _lens_cnc():
+    # the file name is not a valid module name
+    return importlib.import_module('lens-cnc')
+
+
+def lens_clip():
+    return lens.lens_clip(constants.LENS_GROOVE_HEIGHT, 2, math.pi/100)
+
+
+def lens_cnc(d1, d2=None, d2_angle=None, material='pmma', x_offset=0, y_offset=0):
+    # a lens blank corrected for this prescription, see lens-cnc.py
+    module = _lens_cnc()
+    return module.lens_cnc(module.astigmatism_correction(d1, d2, d2_angle, material, x_offset=x_offset, y_offset=y_offset))
+
+
+# every part of the repository, with the prescriptions of the Makefile
+# for the CNC lenses
+PARTS = collections.OrderedDict(goggles.PARTS)
+PARTS.update([
+    ('lens', lens.lens),
+    ('lens-clip', lens_clip),
+    ('lens-cnc', functools.partial(lens_cnc, 2.1)),
+    ('lens-cnc-astigmatism', functools.partial(lens_cnc, 2, 1.5, 5)),
+])
+
+
+def build(config, parts=tuple(PARTS)):
+    # {name: solidpython object} of parts built with config, a
+    # settings.Config, without writing anything. Builds with different
+    # configurations can run in the same process, in parallel threads:
+    # the profiles they have in common are computed once. Render the
+    # objects with utils.render() under settings.use(config).
+    retval = collections.OrderedDict()
+    with settings.use(config), ggg.mesh.validating(config.validate):
+        for name in parts:
+            if name not in PARTS:
+                raise Exception('Unknown part %s' % name)
+            retval[name] = PARTS[name]()
+    return retval
+
+
+import unittest
+
+
+class BuildTestCase(unittest.TestCase):
+    def _render(self, config):
+        import solid
+        return {name: solid.scad_render(o) for name, o in build(config, ['shell', 'lens-clip', 'lens-cnc']).items()}
+
+    def test_scad(self):
+        # the streamed .scad files are byte for byte what SolidPython
+        # writes, and the sidecar ones import every mesh
+        import os
+        import re
+        import tempfile
+        import solid
+        import ggg.scad
+        objects = build(settings.Config(nsteps=20), ['shell', 'top-mold', 'lens-clip'])
+        with tempfile.TemporaryDirectory() as directory:
+            for name, o in objects.items():
+                filename = os.path.join(directory, name + '.scad')
+                self.assertEqual(ggg.scad.write(o, filename), [])
+                with open(filename) as f:
+                    self.assertEqual(f.read(), solid.scad_render(o))
+                sidecars = ggg.scad.write(o, filename, sidecar=True)
+                with open(filename) as f:
+                    text = f.read()
+                self.assertGreater(len(sidecars), 0)
+                self.assertEqual(sorted(set(re.findall(r'import\(file = "(.*?)"', text))), sorted(os.path.basename(sidecar) for sidecar in sidecars))
+                self.assertNotIn('polyhedron', text)
+
+    def _openscad_volume(self, o):
+        # the volume of the STL OpenSCAD renders o to
+        import re
+        import shutil
+        import subprocess
+        import tempfile
+        import numpy as np
+        import ggg.scad
+        with tempfile.TemporaryDirectory() as directory:
+            scad, stl = directory + '/o.scad', directory + '/o.stl'
+            ggg.scad.write(o, scad)
+            subprocess.run([shutil.which('openscad'), '-o', stl, scad], check=True, capture_output=True)
+            with open(stl) as f:
+                v = np.array(re.findall(r'vertex\s+(\S+)\s+(\S+)\s+(\S+)', f.read()), dtype=np.float64).reshape(-1, 3, 3)
+        return np.sum(v[:, 0] * np.cross(v[:, 1], v[:, 2])) / 6
+
+    @unittest.skipUnless(ggg.boolean.available(), 'needs manifold3d')
+    def test_boolean(self):
+        # the in-process CSG makes closed meshes, with the volume of the
+        # ones OpenSCAD makes when it is there
+        import shutil
+        for name, o in build(settings.Config(nsteps=20), ['back-clip', 'lens-clip', 'shell']).items():
+            mesh = ggg.boolean.evaluate(o)
+            self.assertEqual(mesh.validate(), [], name)
+            volume = ggg.boolean._volume(mesh)
+            self.assertGreater(volume, 0)
+            if shutil.which('openscad') is not None:
+                self.assertAlmostEqual(volume / self._openscad_volume(o), 1, places=6, msg=name)
+
+    def test_unknown(self):
+        with self.assertRaisesRegex(Exception, 'Unknown part foo'):
+            build(settings.Config(), ['foo'])
+
+    def test_threads(self):
+        # two configurations built side by side build what they build
+        # one after the other
+        import threading
+        configs = [settings.Config(nsteps=20, validate=True), settings.Config(nsteps=24, optimize_csg=False)]
+        expected = [self._render(config) for config in configs]
+        results = [None] * len(configs)
+
+        def run(i):
+            results[i] = self._render(configs[i])
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(len(configs))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, expected)
+        self.assertNotEqual(expected[0]['shell'], expected[1]['shell'])
+        self.assertFalse(ggg.mesh.validation.get())
@@ -0,0 +1,233 @@
+#!/usr/bin/python
+import collections
+import hashlib
+import os
+import re
+import signal
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+import buildcache
+import constants
+
+# Rough peak memory used by OpenSCAD to render a file: CGAL keeps a
+# Nef polyhedron with exact arithmetic for every polyhedron, which costs
+# a few KB per face. The report prints the measured peak next to the
+# prediction to tune these.
+MEMORY_BASE = 200 * 1024 * 1024
+MEMORY_PER_FACE = 6 * 1024
+MEMORY_PER_POINT = 2 * 1024
+
+OOM_MESSAGES = [b'std::bad_alloc', b'out of memory', b'Cannot allocate memory']
+
+
+Job = collections.namedtuple('Job', ['scad', 'stl', 'memory', 'key'])
+
+
+def _count(text, key):
+    # number of [x, y, z] items in each "key = [[...], ..., [...]]" list
+    count = 0
+    start = text.find(key)
+    while start >= 0:
+        end = text.find(']]', start)
+        count += text.count('[', start + len(key), end)
+        start = text.find(key, end)
+    return count
+
+
+def imports(text, directory):
+    # the side-car STL files written by ggg.scad.write(sidecar=True)
+    return [os.path.join(directory, name) for name in re.findall(r'import\(file = "([^"]*\.stl)"', text)]
+
+
+def _stl_triangles(filename):
+    # from the header of a binary STL
+    with open(filename, 'rb') as f:
+        f.seek(80)
+        return struct.unpack('<I', f.read(4))[0]
+
+
+def polyhedron_size(text, directory='.'):
+    points, faces = _count(text, 'points = ['), _count(text, 'faces = [')
+    for stl in imports(text, directory):
+        triangles = _stl_triangles(stl)
+        # a closed triangle mesh has about half as many points as faces
+        points += triangles // 2
+        faces += triangles
+    return points, faces
+
+
+def predict_memory(text, directory='.'):
+    points, faces = polyhedron_size(text, directory)
+    return MEMORY_BASE + points * MEMORY_PER_POINT + faces * MEMORY_PER_FACE
+
+
+def geometry(text):
+    # without the SolidPython date header and the copy of the generator
+    # source appended to the file
+    if text.startswith('// Generated by SolidPython'):
+        text = text.split('\n', 1)[1]
+    return text.split('/***********************************************')[0]
+
+
+def available_memory():
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+
+
+def _gb(n):
+    return '%.2fGB' % (n / (1024 * 1024 * 1024))
+
+
+class Report:
+    def __init__(self, filename, n):
+        self._f = open(filename, 'w') if filename is not None else None
+        self._n = n
+        self._done = 0
+        self._start = time.time()
+
+    def write(self, line):
+        line = '[%7.1fs] %s' % (time.time() - self._start, line)
+        print(line, flush=True)
+        if self._f is not None:
+            self._f.write(line + '\n')
+            self._f.flush()
+
+    def started(self, job, running):
+        self.write('start %s (predicted %s, %d running)' % (job.stl, _gb(job.memory), running))
+
+    def cached(self, job):
+        self._done += 1
+        self.write('done %d/%d %s from the cache' % (self._done, self._n, job.stl))
+
+    def finished(self, job, elapsed, rss):
+        self._done += 1
+        self.write('done %d/%d %s in %.1fs (peak %s, predicted %s)' % (self._done, self._n, job.stl, elapsed, _gb(rss), _gb(job.memory)))
+
+    def close(self):
+        self.write('total %d files' % self._done)
+        if self._f is not None:
+            self._f.close()
+
+
+class Farm:
+    def __init__(self, openscad, jobs, memory, report):
+        self._openscad = openscad
+        self._jobs = jobs
+        self._memory = memory
+        self._report = report
+        self._running = {}
+
+    def _used(self):
+        return sum(running[0].memory for running in self._running.values())
+
+    def _fits(self, job):
+        # always run at least one job, even if it looks too big
+        if not self._running:
+            return True
+        return len(self._running) < self._jobs and self._used() + job.memory <= self._memory
+
+    def _start(self, job):
+        # openscad picks the output format from the extension
+        tmp = job.stl[:-len('.stl')] + '.tmp.stl'
+        log = tempfile.TemporaryFile()
+        process = subprocess.Popen([self._openscad, '-o', tmp, job.scad], stdout=log, stderr=subprocess.STDOUT)
+        self._running[process.pid] = (job, process, time.time(), log, len(self._running))
+        self._report.started(job, len(self._running))
+
+    def _wait(self):
+        pid, status, rusage = os.wait4(-1, 0)
+        job, process, start, log, neighbours = self._running.pop(pid)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        log.seek(0)
+        output = log.read()
+        log.close()
+        tmp = job.stl[:-len('.stl')] + '.tmp.stl'
+        if process.returncode == 0:
+            buildcache.put_file(job.key, '.stl', tmp)
+            os.replace(tmp, job.stl)
+            self._report.finished(job, time.time() - start, rusage.ru_maxrss * 1024)
+            return job, None, output, neighbours
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        oom = process.returncode == -signal.SIGKILL or any(message in output for message in OOM_MESSAGES)
+        return job, 'oom' if oom else 'failed', output, neighbours + len(self._running)
+
+    def run(self, pending):
+        cached = [job for job in pending if buildcache.get_file(job.key, '.stl', job.stl)]
+        for job in cached:
+            self._report.cached(job)
+        pending = [job for job in pending if job not in cached]
+        # biggest first: the small ones fill the gaps at the end
+        pending = sorted(pending, key=lambda job: -job.memory)
+        failed = []
+        while pending or self._running:
+            while pending and self._fits(pending[0]):
+                self._start(pending.pop(0))
+            job, error, output, neighbours = self._wait()
+            if error is None:
+                continue
+            if error == 'oom' and neighbours > 0:
+                # the prediction was too low: run it again with fewer
+                # neighbours
+                self._jobs = max(1, min(self._jobs, neighbours + 1) // 2)
+                job = job._replace(memory=job.memory * 2)
+                self._report.write('out of memory %s, retrying with at most %d jobs' % (job.stl, self._jobs))
+                pending.insert(0, job)
+                pending.sort(key=lambda job: -job.memory)
+                continue
+            self._report.write('%s %s:\n%s' % (error, job.stl, output.decode(errors='replace')))
+            failed.append(job)
+        return failed
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Render OpenSCAD files to STL concurrently within a memory budget')
+    parser.add_argument('targets', nargs='+', help='STL files to generate from the matching .scad files')
+    parser.add_argument('--openscad', default='/usr/bin/openscad')
+    parser.add_argument('-j', '--jobs', default=os.cpu_count() or 1, type=int)
+    parser.add_argument('--memory', default=None, type=float, help='memory budget in GB (default: available memory)')
+    parser.add_argument('--report', default=None, help='also write the progress report to this file')
+    parser.add_argument('-B', '--always-make', default=False, action='store_true', help='render even the up to date files')
+    parser.add_argument('--no-cache', default=False, action='store_true', help='do not reuse nor store the STL files in the build cache')
+    args = parser.parse_args()
+
+    constants.CACHE = not args.no_cache
+
+    memory = available_memory() if args.memory is None else args.memory * 1024 * 1024 * 1024
+    jobs = []
+    for stl in args.targets:
+        assert stl.endswith('.stl')
+        scad = stl[:-len('.stl')] + '.scad'
+        if not args.always_make and os.path.exists(stl) and os.path.getmtime(stl) >= os.path.getmtime(scad):
+            continue
+        with open(scad) as f:
+            text = f.read()
+        # the same geometry renders to the same STL
+        key = [os.path.realpath(args.openscad), geometry(text)]
+        directory = os.path.dirname(scad)
+        for filename in imports(text, directory):
+            with open(filename, 'rb') as f:
+                key.append(hashlib.sha256(f.read()).hexdigest())
+        jobs.append(Job(scad=scad, stl=stl, memory=predict_memory(text, directory), key='\n'.join(key)))
+
+    report = Report(args.report, len(jobs))
+    report.write('rendering %d files with at most %d jobs within %s' % (len(jobs), args.jobs, _gb(memory)))
+    failed = Farm(args.openscad, args.jobs, memory, report).run(jobs)
+    report.close()
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+import collections
+import contextlib
+import contextvars
+import types
+
+import constants
+
+# The constants which the command-line sets. A Config overrides them for
+# the code running in a use() block only, and only in the current thread
+# or asyncio task: builds with different configurations can run side by
+# side in the same process.
+FIELDS = ['NSTEPS', 'CHORD_ERROR', 'KEYFRAMES', 'KEYFRAME_ERROR', 'JOBS', 'SCAD_PRECISION', 'SCAD_SIDECAR', 'OPTIMIZE_CSG', 'VALIDATE', 'CACHE', 'CACHE_FUNCTIONS']
+
+Config = collections.namedtuple('Config', [field.lower() for field in FIELDS], defaults=[getattr(constants, field) for field in FIELDS])
+
+_current = contextvars.ContextVar('config', default=None)
+# when set, the names of the constants read are added to this set: the
+# build cache records them
+reads = contextvars.ContextVar('reads', default=None)
+
+
+class ConfiguredModule(types.ModuleType):
+    # constants.X is the value of the Config in use, if any
+    def __getattribute__(self, name):
+        if name.isupper():
+            names = reads.get()
+            if names is not None:
+                names.add(name)
+            config = _current.get()
+            if config is not None and name in FIELDS:
+                return getattr(config, name.lower())
+        return super().__getattribute__(name)
+
+
+constants.__class__ = ConfiguredModule
+
+
+@contextlib.contextmanager
+def use(config):
+    token = _current.set(config)
+    try:
+        yield config
+    finally:
+        _current.reset(token)
+
+
+def current():
+    # the Config in use, or the one of the module constants
+    config = _current.get()
+    if config is None:
+        config = Config(*[getattr(constants, field) for field in FIELDS])
+    return config
+
+
+def values():
+    # the uppercase constants as the current code sees them, without
+    # going through the module: the build cache would record each of them
+    retval = {k: v for k, v in vars(constants).items() if k.isupper()}
+    config = _current.get()
+    if config is not None:
+        retval.update((field, getattr(config, field.lower())) for field in FIELDS)
+    return retval
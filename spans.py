@@ -0,0 +1,198 @@
+import collections
+import functools
+import json
+import os
+import resource
+import threading
+import time
+
+# Named, timed spans written as a Chrome trace (chrome://tracing or
+# https://ui.perfetto.dev) plus a text summary. Nothing is recorded, and
+# the libraries are not instrumented, until enable() is called.
+enabled = False
+
+_events = []
+_calls = collections.Counter()
+_instrumented = False
+
+# the mg2.Path methods and mg2 functions whose calls are counted
+HOT_METHODS = ['copy', 'extend', 'append', 'extend_arc', 'append_angle', 'reverse', 'splinify', 'resample',
+               'subdivide', 'resample_adaptive', 'translate', 'rotate', 'offset', 'cut_ranges', 'cut']
+HOT_FUNCTIONS = ['offset_paths', 'splinify_paths', 'cut_paths', 'resample_paths']
+# the ggg.Extrude methods which start a sweep
+SWEEPS = ['along_closed_path', 'along_open_path', 'along_z', 'around_z', 'around_z_partially']
+
+
+def _max_rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class _Null:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+_NULL = _Null()
+
+
+class _Span:
+    def __init__(self, name, category, args):
+        self._name = name
+        self._category = category
+        self._args = args
+
+    def set(self, **args):
+        self._args.update(args)
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        self._args['max_rss'] = _max_rss()
+        _events.append({
+            'name': self._name,
+            'cat': self._category,
+            'ph': 'X',
+            # perf_counter() is the same clock in every process
+            'ts': self._start * 1e6,
+            'dur': (end - self._start) * 1e6,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'args': self._args,
+        })
+        return False
+
+
+def span(name, category='', **args):
+    if not enabled:
+        return _NULL
+    return _Span(name, category, args)
+
+
+def _sizes(o):
+    # vertex and triangle counts of what a mesh function returned
+    mesh = getattr(o, 'ggg_mesh', o)
+    if hasattr(mesh, 'triangles') and hasattr(mesh, 'points'):
+        return {'vertices': len(mesh.points), 'triangles': len(mesh.triangles) + len(getattr(mesh, 'polygons', ()))}
+    if hasattr(mesh, 'shapes'):
+        return {'stations': mesh.shapes.shape[0], 'vertices': mesh.shapes.shape[0] * mesh.shapes.shape[1]}
+    return {}
+
+
+def _timed(owner, attribute, category):
+    f = getattr(owner, attribute)
+    name = '%s.%s' % (getattr(owner, '__name__', ''), attribute)
+
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        with span(name, category) as s:
+            retval = f(*args, **kwargs)
+            s.set(**_sizes(retval))
+        return retval
+    setattr(owner, attribute, wrapper)
+
+
+def _counted(owner, attribute):
+    f = getattr(owner, attribute)
+    name = '%s.%s' % (getattr(owner, '__name__', ''), attribute)
+
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        _calls[name] += 1
+        return f(*args, **kwargs)
+    setattr(owner, attribute, wrapper)
+
+
+def enable():
+    global enabled, _instrumented
+    enabled = True
+    if _instrumented:
+        return
+    _instrumented = True
+    import importlib
+    import ggg
+    import mg2
+    for method in HOT_METHODS:
+        _counted(mg2.Path, method)
+    for function in HOT_FUNCTIONS:
+        _counted(mg2, function)
+    # ggg.extrude is the function, not the module
+    extrude = importlib.import_module('ggg.extrude').Extrude
+    for method in SWEEPS:
+        _timed(extrude, method, 'sweep')
+    _timed(ggg.Shapes, 'mesh', 'mesh')
+    _timed(ggg.Mesh, 'clean', 'mesh')
+    _timed(ggg.Mesh, 'solidify', 'mesh')
+
+
+def drain():
+    # the events and counts recorded by this process since the last
+    # call, to send them back from a worker process
+    events, calls = list(_events), dict(_calls)
+    del _events[:]
+    _calls.clear()
+    return events, calls
+
+
+def merge(events, calls):
+    _events.extend(events)
+    _calls.update(calls)
+
+
+def write(filename):
+    events = sorted(_events, key=lambda event: event['ts'])
+    with open(filename, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms', 'otherData': {'calls': dict(_calls)}}, f)
+
+
+def _self_times(events):
+    # time spent in each span minus the time spent in the spans nested
+    # in it, in the same thread
+    retval = {}
+    threads = collections.defaultdict(list)
+    for event in events:
+        threads[(event['pid'], event['tid'])].append(event)
+    for thread in threads.values():
+        stack = []
+        for event in sorted(thread, key=lambda event: (event['ts'], -event['dur'])):
+            while stack and stack[-1]['ts'] + stack[-1]['dur'] <= event['ts']:
+                stack.pop()
+            retval[id(event)] = event['dur']
+            if stack:
+                retval[id(stack[-1])] -= event['dur']
+            stack.append(event)
+    return retval
+
+
+def summary():
+    self_times = _self_times(_events)
+    rows = collections.OrderedDict()
+    for event in sorted(_events, key=lambda event: event['ts']):
+        row = rows.setdefault((event['cat'], event['name']), collections.Counter())
+        row['count'] += 1
+        row['total'] += event['dur']
+        row['self'] += self_times[id(event)]
+        row['vertices'] += event['args'].get('vertices', 0)
+        row['triangles'] += event['args'].get('triangles', 0)
+        row['max_rss'] = max(row['max_rss'], event['args']['max_rss'])
+    # the parts first, then the most expensive spans
+    order = ['part', 'sweep', 'mesh', 'scad', 'stl']
+    rows = sorted(rows.items(), key=lambda item: (order.index(item[0][0]) if item[0][0] in order else len(order), item[0][0] != 'part' and -item[1]['total']))
+    lines = ['%-8s %-36s %6s %10s %10s %10s %10s %9s' % ('', 'span', 'count', 'total ms', 'self ms', 'vertices', 'triangles', 'peak MB')]
+    for (category, name), row in rows:
+        lines.append('%-8s %-36s %6d %10.1f %10.1f %10d %10d %9.1f' % (
+            category, name, row['count'], row['total'] / 1e3, row['self'] / 1e3, row['vertices'], row['triangles'], row['max_rss'] / (1024 * 1024)))
+    if _calls:
+        lines.append('')
+        lines.append('%-45s %10s' % ('mg2 calls', 'count'))
+        for name, count in _calls.most_common():
+            lines.append('%-45s %10d' % (name, count))
+    return '\n'.join(lines)
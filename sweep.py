@@ -0,0 +1,268 @@
+import atexit
+import concurrent.futures
+import math
+import multiprocessing
+import multiprocessing.util
+import os
+import threading
+
+import numpy as np
+
+import buildcache
+import constants
+import settings
+
+# one executor per number of jobs, shared by every caller and thread
+# of this process: they are only shut down when it exits
+_executors = {}
+_lock = threading.Lock()
+# whether this process is a worker of one of the pools
+_worker = False
+
+
+def _initialize():
+    global _worker
+    _worker = True
+    buildcache.reset()
+    # a worker which exits waits for its children first: its own
+    # executors must be shut down before that, atexit is too late, and
+    # before the queues which send them their work are closed (10)
+    multiprocessing.util.Finalize(None, shutdown, exitpriority=100)
+
+
+def _pool(jobs):
+    with _lock:
+        if jobs not in _executors:
+            # the workers of a worker (a part built with several profile
+            # jobs) are started from a fork server rather than forked
+            # from a process which runs a pool already
+            context = multiprocessing.get_context('forkserver') if _worker else None
+            _executors[jobs] = concurrent.futures.ProcessPoolExecutor(max_workers=jobs, mp_context=context, initializer=_initialize)
+        return _executors[jobs]
+
+
+def shutdown():
+    with _lock:
+        executors = list(_executors.values())
+        _executors.clear()
+    for executor in executors:
+        executor.shutdown()
+
+
+def _forget():
+    # a forked process inherits the executors of its parent but not
+    # their processes: it starts its own
+    global _lock
+    _executors.clear()
+    _lock = threading.Lock()
+
+
+atexit.register(shutdown)
+os.register_at_fork(after_in_child=_forget)
+
+
+def _snapshot():
+    return list(settings.values().items())
+
+
+def _replay(snapshot):
+    # workers may have been started before the command-line was parsed:
+    # replay the caller's constants before building anything.
+    for k, v in snapshot:
+        setattr(constants, k, v)
+
+
+def _run(snapshot, f, args):
+    _replay(snapshot)
+    # not the configuration in use when the worker was forked
+    with settings.use(None):
+        return f(*args)
+
+
+def _record(snapshot, f, args):
+    # the recording reads the constants too
+    _replay(snapshot)
+    with settings.use(None), buildcache.record() as dependencies:
+        retval = _run(snapshot, f, args)
+    return retval, dependencies
+
+
+def calls(f, args, jobs):
+    # [f(*a) for a in args] with up to jobs processes, in order
+    if jobs <= 1 or len(args) < 2:
+        return [f(*a) for a in args]
+    snapshot = _snapshot()
+    if not buildcache.recording():
+        futures = [_pool(jobs).submit(_run, snapshot, f, a) for a in args]
+        return [future.result() for future in futures]
+    # the build cache needs to know what the workers depend on too
+    futures = [_pool(jobs).submit(_record, snapshot, f, a) for a in args]
+    retval = []
+    for future in futures:
+        result, dependencies = future.result()
+        buildcache.replay(dependencies)
+        retval.append(result)
+    return retval
+
+
+def _each(indices, n, f):
+    return [f(i, n) for i in indices]
+
+
+def chunks(f, n, *args, jobs=None):
+    # Call f(indices, n, *args) on consecutive ranges of range(n) and
+    # concatenate the lists it returns, in order. With more than one job,
+    # the ranges are spread over a process pool: a few ranges per worker
+    # keeps the pickling overhead low while balancing the load.
+    jobs = constants.JOBS if jobs is None else jobs
+    if jobs <= 1 or n < 2:
+        return list(f(range(n), n, *args))
+    size = int(math.ceil(n / (jobs * 4)))
+    ranges = [range(start, min(start+size, n)) for start in range(0, n, size)]
+    retval = []
+    for chunk in calls(f, [(indices, n) + args for indices in ranges], jobs):
+        retval.extend(chunk)
+    return retval
+
+
+def profiles(f, n, jobs=None):
+    # [f(i, n) for i in range(n)], possibly in parallel
+    return chunks(_each, n, f, jobs=jobs)
+
+
+def _polyline_distance(points, polyline):
+    # distance from each of points to the closest segment of polyline
+    a = polyline[:-1][np.newaxis]
+    ab = (polyline[1:] - polyline[:-1])[np.newaxis]
+    ap = points[:, np.newaxis] - a
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t = np.nan_to_num(np.clip(np.sum(ap*ab, axis=2) / np.sum(ab*ab, axis=2), 0, 1))
+    d = ap - t[..., np.newaxis]*ab
+    return np.min(np.sqrt(d[..., 0]**2 + d[..., 1]**2), axis=1)
+
+
+def _deviation(a, b):
+    # how far apart the outlines of two profiles are: the vertices are
+    # not compared one to one because mg2.offset_paths() snaps them to
+    # the nearest vertex of the offset curve, which moves in jumps
+    return max(np.max(_polyline_distance(a, b)), np.max(_polyline_distance(b, a)))
+
+
+def _interpolator(x, y):
+    import scipy.interpolate
+    return scipy.interpolate.CubicSpline(x, y, axis=0)
+
+
+def keyframes(f, alphas, count, breaks=(), error=None, min_step=1e-3):
+    # Profiles at each of alphas, interpolated vertex by vertex between
+    # exact profiles f(list of alphas) -> list of (m, 2) arrays computed
+    # at count evenly spaced keyframes. The profiles are smooth functions
+    # of alpha except at breaks, so a cubic spline is fitted between
+    # each pair of breaks. Every interval is checked at its middle
+    # against the exact profile and split until the interpolated outline
+    # is within error of it there. Only the middles are checked: the
+    # other stations can be further off, about twice error for the
+    # shell.
+    error = constants.KEYFRAME_ERROR if error is None else error
+    breaks = sorted(set([0.0, 1.0]) | set(float(alpha) for alpha in breaks))
+    exact = {}
+
+    def evaluate(keys):
+        keys = [key for key in keys if key not in exact]
+        if not keys:
+            return
+        for key, profile in zip(keys, f(keys)):
+            exact[key] = np.asarray(profile, dtype=np.float64)
+        if len(set(profile.shape for profile in exact.values())) != 1:
+            raise Exception('Keyframe profiles must all have the same number of vertices')
+
+    def interpolate(keys, at):
+        retval = np.empty((len(at),) + exact[keys[0]].shape)
+        piece = np.clip(np.searchsorted(breaks, at, side='right') - 1, 0, len(breaks) - 2)
+        for i, (start, end) in enumerate(zip(breaks[:-1], breaks[1:])):
+            selected = piece == i
+            if np.any(selected):
+                x = [key for key in keys if start <= key <= end]
+                spline = _interpolator(x, np.stack([exact[key] for key in x]))
+                retval[selected] = spline(at[selected])
+        return retval
+
+    keys = sorted(set(np.linspace(0, 1, max(count, 2)).tolist()) | set(breaks))
+    evaluate(keys)
+    unchecked = [(a, b) for a, b in zip(keys[:-1], keys[1:]) if b - a > min_step]
+    while unchecked:
+        middles = [(a+b)/2 for a, b in unchecked]
+        evaluate(middles)
+        guesses = interpolate(keys, np.array(middles))
+        split = []
+        for (a, b), middle, guess in zip(unchecked, middles, guesses):
+            if _deviation(guess, exact[middle]) > error:
+                split.extend([(a, middle), (middle, b)])
+        keys = sorted(set(keys) | set(a for a, b in split))
+        unchecked = [(a, b) for a, b in split if b - a > min_step]
+    alphas = np.asarray(alphas, dtype=np.float64)
+    profiles = interpolate(sorted(exact), alphas)
+    # stations which are keyframes get their exact profile
+    return [exact[alpha] if alpha in exact else profile for alpha, profile in zip(alphas.tolist(), profiles)]
+
+import unittest
+
+
+def _square(x):
+    return x * x
+
+
+def _nested(x):
+    return sum(calls(_square, [(x,), (x+1,)], 2))
+
+
+class PoolTestCase(unittest.TestCase):
+    def test_threads(self):
+        # callers with different numbers of jobs share the executors
+        # without shutting down each other's
+        errors = []
+
+        def run(jobs):
+            try:
+                for i in range(3):
+                    self.assertEqual(calls(_square, [(k,) for k in range(6)], jobs), [k*k for k in range(6)])
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=run, args=(jobs,)) for jobs in [2, 3, 2, 3]]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(_executors), [2, 3])
+
+    def _python(self, args, directory, env=None):
+        import subprocess
+        import sys
+        return subprocess.run([sys.executable] + args, cwd=directory, env=env, capture_output=True, text=True, timeout=300)
+
+    def test_nested(self):
+        # the workers of a pool run pools of their own, and the process
+        # exits once they are done
+        code = 'import sweep; print(sweep.calls(sweep._nested, [(k,) for k in range(4)], 2))'
+        result = self._python(['-c', code], os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip(), str([_nested(k) for k in range(4)]))
+
+    def test_goggles_jobs(self):
+        # several parts, each built by a worker with its own profile
+        # processes: on 4 CPUs, 2 workers with 2 processes each
+        import tempfile
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'goggles.py')
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, 'sitecustomize.py'), 'w') as f:
+                f.write('import os\nos.cpu_count = lambda: 4\n')
+            env = dict(os.environ, PYTHONPATH=directory)
+            result = self._python([script, '-r', '40', '-j', '2', '--no-cache', '--parts', 'shell,back-clip,top-mold'], directory, env)
+            self.assertEqual(result.returncode, 0, result.stderr)
+            for part in ['shell', 'back-clip', 'top-mold']:
+                self.assertTrue(os.path.exists(os.path.join(directory, part + '.scad')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,17 @@
+import datetime
 import math
+import os
+import sys
 
+import numpy as np
 import solid
 import euclid3
 
 import constants
 import ggg
+import ggg.scad
+import memo
+import spans
 
 
 def eu3(path):
@@ -17,17 +24,84 @@ def ellipsis(a, b, t):
     return euclid3.Point3(a*math.cos(t), b*math.sin(t), 0)
 
 
-def ellipsis_path(delta=0):
-    path = [ellipsis(constants.ELLIPSIS_WIDTH+delta, constants.ELLIPSIS_HEIGHT+delta, t) for t in solid.utils.frange(0, 2*math.pi, constants.NSTEPS, include_end=False)]
+@memo.memoize
+def _adaptive_parameters(a, b, reach, error):
+    # Stations along the ellipse such that the rails swept by the
+    # profiles stay within error of their chords. Over a parameter step
+    # h, a curve r(t) deviates from its chord by about h**2*|r''|/8 so
+    # the station density is sqrt(|r''|/(8*error)).
+    SAMPLES = 4096
+    t = np.linspace(0, 2*math.pi, SAMPLES, endpoint=False)
+    h = 2*math.pi/SAMPLES
+    rails = [np.column_stack((a*np.cos(t), b*np.sin(t), np.zeros(SAMPLES)))]
+    if reach is not None:
+        dx, dz = reach(t/(2*math.pi))
+        rails.append(np.column_stack(((a+dx)*np.cos(t), (b+dx)*np.sin(t), dz)))
+    second = [np.sqrt(np.sum(((np.roll(r, -1, axis=0)-2*r+np.roll(r, 1, axis=0))/h**2)**2, axis=1)) for r in rails]
+    density = np.sqrt(np.max(second, axis=0)/(8*error))
+    measure = np.concatenate(([0], np.cumsum((density+np.roll(density, -1))/2*h)))
+    # a multiple of 4 keeps the stations symmetric on both axes
+    n = max(8, 4*int(math.ceil(measure[-1]/4)))
+    return np.interp(np.arange(n)*measure[-1]/n, measure, np.append(t, 2*math.pi))
+
+
+def ellipsis_parameters(delta=0, reach=None):
+    # reach(alpha) gives, for each alpha = t/(2*pi), how far (dx, dz)
+    # the swept profile extends from the ellipse
+    if constants.CHORD_ERROR is None:
+        return list(solid.utils.frange(0, 2*math.pi, constants.NSTEPS, include_end=False))
+    return _adaptive_parameters(constants.ELLIPSIS_WIDTH+delta, constants.ELLIPSIS_HEIGHT+delta, reach, constants.CHORD_ERROR).tolist()
+
+
+def ellipsis_alpha(i, n, reach=None):
+    # the alpha of the i-th station of ellipsis_path(reach=reach)
+    if constants.CHORD_ERROR is None:
+        return i/n
+    t = ellipsis_parameters(reach=reach)
+    assert len(t) == n
+    return t[i]/(2*math.pi)
+
+
+def ellipsis_path(delta=0, reach=None):
+    path = [ellipsis(constants.ELLIPSIS_WIDTH+delta, constants.ELLIPSIS_HEIGHT+delta, t) for t in ellipsis_parameters(delta, reach)]
     return path
 
 
 def ring(height, delta):
-    path = [ellipsis(constants.ELLIPSIS_WIDTH+delta, constants.ELLIPSIS_HEIGHT+delta, t) for t in solid.utils.frange(-math.pi, math.pi, constants.NSTEPS+1, include_end=True)]
+    if constants.CHORD_ERROR is None:
+        parameters = solid.utils.frange(-math.pi, math.pi, constants.NSTEPS+1, include_end=True)
+    else:
+        parameters = ellipsis_parameters(delta) + [2*math.pi]
+    path = [ellipsis(constants.ELLIPSIS_WIDTH+delta, constants.ELLIPSIS_HEIGHT+delta, t) for t in parameters]
     o = ggg.extrude(path).along_z(height).mesh().solidify()
     return o
 
 
+def render(o, name, stl=False, source=None):
+    # returns the side-car files written along with name.scad. Like
+    # solid.scad_render_to_file(), the code of the script which generated
+    # it is appended as a comment: source, or the file of the caller,
+    # unless it has none (interactive sessions).
+    if source is None:
+        source = sys._getframe(1).f_code.co_filename
+    if constants.OPTIMIZE_CSG:
+        with spans.span('optimize', 'scad', file='%s.scad' % name):
+            o = ggg.optimize(o)
+    header = '// Generated by SolidPython %s on %s\n' % (solid.solidpython._get_version(), datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+    footer = solid.solidpython.sp_code_in_scad_comment(source) if os.path.isfile(source) else ''
+    # the polyhedra are not serialized by SolidPython anymore: cheap
+    # enough to let the build cache track ggg.scad like the rest
+    with spans.span('write', 'scad', file='%s.scad' % name):
+        sidecars = ggg.scad.write(o, '%s.scad' % name, header, footer, precision=constants.SCAD_PRECISION, sidecar=constants.SCAD_SIDECAR)
+    if stl:
+        from ggg import boolean
+        with spans.span('evaluate', 'stl', file='%s.stl' % name) as s:
+            mesh = boolean.evaluate(o)
+            s.set(vertices=len(mesh.points), triangles=len(mesh.triangles))
+            mesh.write_stl('%s.stl' % name)
+    return sidecars
+
+
 def slice(args):
     if args.slice_a is not None:
         cut = solid.rotate([0, 0, args.slice_a])(solid.translate([-0, 0, -100])(solid.cube([200, 200, 200])))